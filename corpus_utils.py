@@ -0,0 +1,458 @@
+####################################
+# Project: Document Summarization
+# Comments: Compiled binary corpus
+####################################
+
+"""
+Compiled corpus store: flat token arrays with CSR style sentence and
+document offsets, memory-mapped from disk after a one-time compile step.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import os
+import shutil
+from contextlib import closing
+from multiprocessing import Pool
+
+import numpy as np
+
+# Sections of a preprocessed corpus (doc, title and image files)
+SECTIONS = ("doc", "title", "image")
+
+# Bump whenever the layout of the compiled arrays changes
+CORPUS_FORMAT_VERSION = 1
+
+def _head(lines, limit):
+    return lines if limit is None else lines[:limit]
+
+def _ragged_arange(counts):
+    """For counts [2, 0, 3] returns owners [0, 0, 2, 2, 2] and positions
+    [0, 1, 0, 1, 2].
+    """
+    owners = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(owners.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, positions
+
+def _gather_ranges(offsets, ids):
+    """Select the ranges ids of a CSR offsets array. Returns the offsets of
+    the selection and the indices of the selected items.
+    """
+    starts = offsets[ids]
+    counts = offsets[ids+1] - starts
+    owners, positions = _ragged_arange(counts)
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), starts[owners] + positions
+
+def _concatenate_offsets(offsets_list):
+    shifted = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for offsets in offsets_list:
+        shifted.append(np.asarray(offsets[1:], dtype=np.int64) + base)
+        base += int(offsets[-1])
+    return np.concatenate(shifted)
+
+class CorpusBuilder:
+    """Accumulates parsed documents into flat arrays.
+    """
+    def __init__(self):
+        self.filenames = []
+        self.tokens = dict((section, array.array("i")) for section in SECTIONS)
+        self.sent_offsets = dict((section, [0]) for section in SECTIONS)
+        self.doc_offsets = dict((section, [0]) for section in SECTIONS)
+        self.doc_lengths = []
+        self.oracle_sents = array.array("i")
+        self.oracle_offsets = [0]
+        self.oracle_doc_offsets = [0]
+        self.oracle_rewards = array.array("f")
+
+    def add_document(self, filename, section_lines, originaldoclen, oracle_lines):
+        """
+        filename: document name
+        section_lines: {section: [sentence lines of word ids]}
+        originaldoclen: number of sentences in the original document
+        oracle_lines: ["sentid sentid ... reward"]
+        """
+        self.filenames.append(filename)
+        for section in SECTIONS:
+            tokens = self.tokens[section]
+            sent_offsets = self.sent_offsets[section]
+            for line in section_lines[section]:
+                tokens.extend([int(item) for item in line.strip().split()])
+                sent_offsets.append(len(tokens))
+            self.doc_offsets[section].append(len(sent_offsets) - 1)
+
+        self.doc_lengths.append(originaldoclen)
+        for line in oracle_lines:
+            linedata = line.split()
+            self.oracle_sents.extend([int(item) for item in linedata[:-1]])
+            self.oracle_offsets.append(len(self.oracle_sents))
+            self.oracle_rewards.append(float(linedata[-1]))
+        self.oracle_doc_offsets.append(len(self.oracle_offsets) - 1)
+
+    def build(self):
+        arrays = {}
+        for section in SECTIONS:
+            tokens = np.frombuffer(self.tokens[section], dtype=np.int32) if len(self.tokens[section]) else np.zeros(0, dtype=np.int32)
+            # uint16 is enough for most vocabularies smaller than 65536 words
+            if len(tokens) and tokens.min() >= 0 and tokens.max() < np.iinfo(np.uint16).max:
+                tokens = tokens.astype(np.uint16)
+            else:
+                tokens = tokens.copy()
+            arrays[section+"_tokens"] = tokens
+            arrays[section+"_sent_offsets"] = np.array(self.sent_offsets[section], dtype=np.int64)
+            arrays[section+"_doc_offsets"] = np.array(self.doc_offsets[section], dtype=np.int64)
+        arrays["doc_lengths"] = np.array(self.doc_lengths, dtype=np.int32)
+        arrays["oracle_sents"] = np.array(self.oracle_sents, dtype=np.int32)
+        arrays["oracle_offsets"] = np.array(self.oracle_offsets, dtype=np.int64)
+        arrays["oracle_doc_offsets"] = np.array(self.oracle_doc_offsets, dtype=np.int64)
+        arrays["oracle_rewards"] = np.array(self.oracle_rewards, dtype=np.float32)
+        return CorpusStore(self.filenames, arrays)
+
+class CorpusStore:
+    """CSR store of one corpus split.
+
+    For every section, sentence s of the section spans
+    tokens[sent_offsets[s]:sent_offsets[s+1]] and document d owns sentences
+    doc_offsets[d]:doc_offsets[d+1]. Oracles follow the same layout with
+    oracle_doc_offsets -> oracle_offsets -> oracle_sents, and one reward per
+    oracle.
+    """
+    def __init__(self, filenames, arrays):
+        self.filenames = filenames
+        self.arrays = arrays
+        self.oracle_table = None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def sentences(self, section, docindex, limit=None):
+        doc_offsets = self.arrays[section+"_doc_offsets"]
+        sent_offsets = self.arrays[section+"_sent_offsets"]
+        tokens = self.arrays[section+"_tokens"]
+        start, end = int(doc_offsets[docindex]), int(doc_offsets[docindex+1])
+        if limit is not None:
+            end = min(end, start + limit)
+        return [tokens[sent_offsets[sentidx]:sent_offsets[sentidx+1]].tolist() for sentidx in range(start, end)]
+
+    def oracles(self, docindex, limit=None):
+        oracle_doc_offsets = self.arrays["oracle_doc_offsets"]
+        oracle_offsets = self.arrays["oracle_offsets"]
+        oracle_sents = self.arrays["oracle_sents"]
+        start, end = int(oracle_doc_offsets[docindex]), int(oracle_doc_offsets[docindex+1])
+        if limit is not None:
+            end = min(end, start + limit)
+        return [oracle_sents[oracle_offsets[oracleidx]:oracle_offsets[oracleidx+1]].tolist() for oracleidx in range(start, end)]
+
+    def rewards(self, docindex, limit=None):
+        oracle_doc_offsets = self.arrays["oracle_doc_offsets"]
+        start, end = int(oracle_doc_offsets[docindex]), int(oracle_doc_offsets[docindex+1])
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.arrays["oracle_rewards"][start:end].tolist()
+
+    def doc_length(self, docindex):
+        return int(self.arrays["doc_lengths"][docindex])
+
+    def subset(self, docindices):
+        """In-memory copy of the documents docindices, in that order.
+        """
+        docindices = np.asarray(docindices, dtype=np.int64)
+        arrays = {}
+        for section in SECTIONS:
+            arrays[section+"_doc_offsets"], sentids = _gather_ranges(self.arrays[section+"_doc_offsets"], docindices)
+            arrays[section+"_sent_offsets"], tokenids = _gather_ranges(self.arrays[section+"_sent_offsets"], sentids)
+            arrays[section+"_tokens"] = self.arrays[section+"_tokens"][tokenids]
+        arrays["doc_lengths"] = self.arrays["doc_lengths"][docindices]
+        arrays["oracle_doc_offsets"], oracleids = _gather_ranges(self.arrays["oracle_doc_offsets"], docindices)
+        arrays["oracle_offsets"], oraclesentids = _gather_ranges(self.arrays["oracle_offsets"], oracleids)
+        arrays["oracle_sents"] = self.arrays["oracle_sents"][oraclesentids]
+        arrays["oracle_rewards"] = self.arrays["oracle_rewards"][oracleids]
+        return CorpusStore([self.filenames[docindex] for docindex in docindices], arrays)
+
+    ### Vectorized batch assembly
+
+    def mark_token_ids(self, present, chunk_size=(1 << 24)):
+        """Set present[tokenid] for every token id used by the store. Ids
+        outside of present are ignored.
+        """
+        for section in SECTIONS:
+            tokens = self.arrays[section+"_tokens"]
+            for start in range(0, len(tokens), chunk_size):
+                chunk = tokens[start:start+chunk_size]
+                present[chunk[chunk < len(present)]] = True
+
+    def fill_sentences(self, batch_out, section, docindices, row_offset, max_sents, max_sent_length, token_map=None):
+        """Scatter the first max_sents sentences (each chopped to
+        max_sent_length) of every document into batch_out[batch_idx,
+        row_offset:row_offset+max_sents, :]. batch_out must be zero (PAD)
+        initialised. Token ids are translated through token_map if given.
+        """
+        if max_sents <= 0 or len(docindices) == 0:
+            return
+        doc_offsets = self.arrays[section+"_doc_offsets"]
+        sent_offsets = self.arrays[section+"_sent_offsets"]
+        tokens = self.arrays[section+"_tokens"]
+
+        sent_starts = doc_offsets[docindices]
+        sent_counts = np.minimum(doc_offsets[docindices+1] - sent_starts, max_sents)
+        sent_batch, sent_rows = _ragged_arange(sent_counts)
+        sentids = sent_starts[sent_batch] + sent_rows
+
+        token_starts = sent_offsets[sentids]
+        token_counts = np.minimum(sent_offsets[sentids+1] - token_starts, max_sent_length)
+        token_sent, token_cols = _ragged_arange(token_counts)
+        batch_tokens = tokens[token_starts[token_sent] + token_cols]
+        if token_map is not None:
+            batch_tokens = token_map[batch_tokens]
+        batch_out[sent_batch[token_sent], row_offset + sent_rows[token_sent], token_cols] = batch_tokens
+
+    def oracle_mask(self, docindices, oracle_choice, max_doc_length):
+        """Selected oracle of every document as a [batch, max_doc_length] bool
+        mask and its reward. oracle_choice[batch_idx] indexes the oracles of
+        a document, falling back to the first (best) oracle if the document
+        has fewer.
+        """
+        oracle_doc_offsets = self.arrays["oracle_doc_offsets"]
+        oracle_offsets = self.arrays["oracle_offsets"]
+
+        batch_size = len(docindices)
+        mask = np.zeros((batch_size, max_doc_length), dtype=bool)
+        rewards = np.zeros(batch_size, dtype=np.float32)
+
+        first_oracle = oracle_doc_offsets[docindices]
+        oracle_counts = oracle_doc_offsets[docindices+1] - first_oracle
+        oracle_choice = np.where(oracle_choice < oracle_counts, oracle_choice, 0)
+        has_oracle = oracle_counts > 0
+        oracleids = (first_oracle + oracle_choice)[has_oracle]
+        rewards[has_oracle] = self.arrays["oracle_rewards"][oracleids]
+
+        sent_starts = oracle_offsets[oracleids]
+        sent_batch, sent_positions = _ragged_arange(oracle_offsets[oracleids+1] - sent_starts)
+        sentids = self.arrays["oracle_sents"][sent_starts[sent_batch] + sent_positions]
+        inside = (sentids >= 0) & (sentids < max_doc_length)
+        mask[np.flatnonzero(has_oracle)[sent_batch[inside]], sentids[inside]] = True
+        return mask, rewards
+
+    def prepare_oracle_table(self, num_rollouts, max_doc_length, chunk_size=10000):
+        """Precompute the oracle labels of every document as a bitset array
+        [docs, num_rollouts, ceil(max_doc_length/8)] (uint8) and the rewards
+        [docs, num_rollouts] (float32). Rollouts beyond the oracles of a
+        document repeat the first (best) oracle.
+        """
+        if (self.oracle_table is not None) and (self.oracle_table[0] == (num_rollouts, max_doc_length)):
+            return
+        packed = np.zeros((len(self), num_rollouts, (max_doc_length + 7) // 8), dtype=np.uint8)
+        rewards = np.zeros((len(self), num_rollouts), dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            docindices = np.arange(start, min(start+chunk_size, len(self)))
+            for rolloutidx in range(num_rollouts):
+                mask, reward = self.oracle_mask(docindices, np.full(len(docindices), rolloutidx, dtype=np.int64), max_doc_length)
+                packed[docindices, rolloutidx] = np.packbits(mask, axis=1)
+                rewards[docindices, rolloutidx] = reward
+        self.oracle_table = ((num_rollouts, max_doc_length), packed, rewards)
+
+    def sample_oracles(self, docindices, rolloutindices, max_doc_length):
+        """Oracle label masks [batch, max_doc_length] and rewards [batch] of
+        rollout rolloutindices[batch_idx] of every document, gathered from
+        the precomputed table in one go.
+        """
+        _, packed, rewards = self.oracle_table
+        mask = np.unpackbits(packed[docindices, rolloutindices], axis=1)[:, :max_doc_length].astype(bool)
+        return mask, rewards[docindices, rolloutindices]
+
+    def weight_mask(self, docindices, max_doc_length):
+        """[batch, max_doc_length] bool mask of sentences inside the original
+        document length.
+        """
+        doc_lengths = self.arrays["doc_lengths"][docindices]
+        return np.arange(max_doc_length)[np.newaxis, :] < doc_lengths[:, np.newaxis]
+
+def concatenate_stores(stores):
+    """Single in-memory store with the documents of all stores, in order.
+    """
+    arrays = {}
+    for section in SECTIONS:
+        for level in ["_doc_offsets", "_sent_offsets"]:
+            arrays[section+level] = _concatenate_offsets([store.arrays[section+level] for store in stores])
+        arrays[section+"_tokens"] = np.concatenate([store.arrays[section+"_tokens"] for store in stores])
+    for level in ["oracle_doc_offsets", "oracle_offsets"]:
+        arrays[level] = _concatenate_offsets([store.arrays[level] for store in stores])
+    for key in ["doc_lengths", "oracle_sents", "oracle_rewards"]:
+        arrays[key] = np.concatenate([store.arrays[key] for store in stores])
+    filenames = []
+    for store in stores:
+        filenames += store.filenames
+    return CorpusStore(filenames, arrays)
+
+class StoreView:
+    """Read-only list-like view of one field of a CorpusStore, so that code
+    written against lists of documents keeps working.
+    """
+    def __init__(self, store, getter):
+        self.store = store
+        self.getter = getter
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, docindex):
+        if docindex < 0 or docindex >= len(self.store):
+            raise IndexError("document index out of range")
+        return self.getter(docindex)
+
+    def __iter__(self):
+        for docindex in range(len(self.store)):
+            yield self.getter(docindex)
+
+def _add_text_block(builder, file_prefix, doc_data, title_data, image_data, label_data, limits):
+    doc_lines = doc_data.strip().split("\n")
+    title_lines = title_data.strip().split("\n")
+    image_lines = image_data.strip().split("\n")
+    label_lines = label_data.strip().split("\n")
+
+    filename = doc_lines[0].strip()
+    if not ((filename == title_lines[0].strip()) and (filename == image_lines[0].strip()) and (filename == label_lines[0].strip())):
+        raise ValueError("Some problem with %s.* files."%file_prefix)
+
+    max_doc_length, max_title_length, max_image_length, max_oracles = limits
+    section_lines = {"doc": _head(doc_lines[1:], max_doc_length),
+                     "title": _head(title_lines[1:], max_title_length),
+                     "image": _head(image_lines[1:], max_image_length)}
+    builder.add_document(filename, section_lines, int(label_lines[1].strip()), _head(label_lines[2:], max_oracles))
+
+def _parse_text_chunk(args):
+    file_prefix, block_lists, limits = args
+    builder = CorpusBuilder()
+    for doc_data, title_data, image_data, label_data in zip(*block_lists):
+        _add_text_block(builder, file_prefix, doc_data, title_data, image_data, label_data, limits)
+    return builder.build()
+
+def read_corpus_text(file_prefix, max_doc_length=None, max_title_length=None, max_image_length=None, max_oracles=None, num_workers=1, chunk_size=5000):
+    """Parse the preprocessed text files (.doc, .title, .image,
+    .label.multipleoracle) of one split. Limits of None keep everything.
+    Chunks of chunk_size documents are parsed in num_workers processes and
+    merged in order. Raises ValueError if the four files disagree on a
+    filename.
+    """
+    doc_data_list = open(file_prefix+".doc").read().strip().split("\n\n")
+    title_data_list = open(file_prefix+".title").read().strip().split("\n\n")
+    image_data_list = open(file_prefix+".image").read().strip().split("\n\n")
+    label_data_list = open(file_prefix+".label.multipleoracle").read().strip().split("\n\n")
+
+    print("Data sizes: %d %d %d %d"%(len(doc_data_list), len(title_data_list), len(image_data_list), len(label_data_list)))
+
+    print("Reading data (no padding to save memory) ...")
+    limits = (max_doc_length, max_title_length, max_image_length, max_oracles)
+    doccount = min(len(doc_data_list), len(title_data_list), len(image_data_list), len(label_data_list))
+    chunks = [(file_prefix, [data_list[start:start+chunk_size] for data_list in (doc_data_list, title_data_list, image_data_list, label_data_list)], limits)
+              for start in range(0, doccount, chunk_size)]
+    del doc_data_list, title_data_list, image_data_list, label_data_list
+
+    stores = []
+    if num_workers > 1 and len(chunks) > 1:
+        with closing(Pool(min(num_workers, len(chunks)))) as pool:
+            # imap keeps the order of the chunks
+            for store in pool.imap(_parse_text_chunk, chunks):
+                stores.append(store)
+                print("%d ..."%min(len(stores)*chunk_size, doccount))
+    else:
+        for chunk in chunks:
+            stores.append(_parse_text_chunk(chunk))
+            print("%d ..."%min(len(stores)*chunk_size, doccount))
+
+    if not stores:
+        return CorpusBuilder().build()
+    return stores[0] if len(stores) == 1 else concatenate_stores(stores)
+
+def _iterate_text_blocks(filename):
+    """Blank line separated blocks of a file, read line by line.
+    """
+    block = []
+    with open(filename) as fdata:
+        for line in fdata:
+            if line != "\n":
+                block.append(line)
+            elif block:
+                yield "".join(block)
+                block = []
+    if block:
+        yield "".join(block)
+
+def count_text_blocks(filename):
+    return sum(1 for _ in _iterate_text_blocks(filename))
+
+def iterate_corpus_text_shards(file_prefix, shard_size, max_doc_length=None, max_title_length=None, max_image_length=None, max_oracles=None):
+    """Stream the preprocessed text files of one split as stores of at most
+    shard_size documents, without ever reading the whole files.
+    """
+    limits = (max_doc_length, max_title_length, max_image_length, max_oracles)
+    builder = CorpusBuilder()
+    for doc_data, title_data, image_data, label_data in zip(_iterate_text_blocks(file_prefix+".doc"), _iterate_text_blocks(file_prefix+".title"),
+                                                            _iterate_text_blocks(file_prefix+".image"), _iterate_text_blocks(file_prefix+".label.multipleoracle")):
+        _add_text_block(builder, file_prefix, doc_data, title_data, image_data, label_data, limits)
+        if len(builder.filenames) == shard_size:
+            yield builder.build()
+            builder = CorpusBuilder()
+    if builder.filenames:
+        yield builder.build()
+
+def text_signature(file_prefix):
+    """(size, mtime) of every preprocessed text file of a split, used to
+    detect stale compiled corpora.
+    """
+    signature = []
+    for ext in [".doc", ".title", ".image", ".label.multipleoracle"]:
+        filestat = os.stat(file_prefix+ext)
+        signature.append("%s %d %d"%(ext, filestat.st_size, int(filestat.st_mtime)))
+    return signature
+
+def write_corpus_store(store, store_dir, signature=None):
+    """Write store as one .npy file per array plus filenames into
+    store_dir. Written to a temporary directory first and renamed, so readers
+    never see a half written corpus.
+    """
+    tmp_dir = store_dir + ".tmp-%d"%os.getpid()
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    for key, value in store.arrays.items():
+        np.save(os.path.join(tmp_dir, key+".npy"), np.ascontiguousarray(value))
+    with open(os.path.join(tmp_dir, "filenames"), "w") as ffilenames:
+        ffilenames.write("".join([filename+"\n" for filename in store.filenames]))
+    with open(os.path.join(tmp_dir, "info"), "w") as finfo:
+        finfo.write("version %d\n"%CORPUS_FORMAT_VERSION)
+        finfo.write("".join([line+"\n" for line in (signature or [])]))
+
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+
+def read_corpus_info(store_dir):
+    info_filename = os.path.join(store_dir, "info")
+    if not os.path.isfile(info_filename):
+        return None
+    return open(info_filename).read().strip().split("\n")
+
+def is_compiled_corpus(store_dir, signature=None):
+    """True if store_dir holds a compiled corpus of the current format (and
+    of the given text signature, if any).
+    """
+    info = read_corpus_info(store_dir)
+    if info is None or info[0] != "version %d"%CORPUS_FORMAT_VERSION:
+        return False
+    return (signature is None) or (info[1:] == signature)
+
+def load_corpus_store(store_dir, mmap=True):
+    """Open a compiled corpus. With mmap, arrays are memory-mapped read-only
+    and shared through the page cache by all processes reading them.
+    """
+    arrays = {}
+    for filename in os.listdir(store_dir):
+        if filename.endswith(".npy"):
+            arrays[filename[:-len(".npy")]] = np.load(os.path.join(store_dir, filename), mmap_mode=("r" if mmap else None))
+    filenames = open(os.path.join(store_dir, "filenames")).read().split("\n")[:-1]
+    return CorpusStore(filenames, arrays)
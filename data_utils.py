@@ -17,17 +17,35 @@ from __future__ import print_function
 import numpy as np
 import tensorflow as tf
 import random
+import io
 import os
+import threading
+import time
+from multiprocessing import Pool
+from contextlib import closing
 
 from my_flags import FLAGS
 from model_utils import convert_logits_to_softmax, predict_topranked
+from corpus_utils import read_corpus_text, iterate_corpus_text_shards, count_text_blocks, concatenate_stores, text_signature, write_corpus_store, is_compiled_corpus, read_corpus_info, load_corpus_store, StoreView
 
 # Special IDs
 PAD_ID = 0
 UNK_ID = 1
 
+# Shard size when streaming without --streaming_shard_size (e.g. for scans)
+DEFAULT_SHARD_SIZE = 10000
+
+# Dense token ids of a pruned vocabulary (see DataProcessor.prepare_vocab_remap)
+vocab_remap = None
+
+def set_vocab_remap(remap):
+    global vocab_remap
+    vocab_remap = remap
+
 class Data:
     def __init__(self, vocab_dict, data_type):
+        self.store = None
+        self.source_signature = []
         self.filenames = []
         self.docs = []
         self.titles = []
@@ -43,8 +61,9 @@ class Data:
         # populate the data 
         self.populate_data(vocab_dict, data_type)
         
-        # Write to files
-        self.write_to_files(data_type)
+        # Write a binary snapshot of the data (optional)
+        if FLAGS.write_data_files:
+            self.write_to_files(data_type)
         
     def write_prediction_summaries(self, pred_logits, modelname, session=None):
         print("Writing predictions and final summaries ...")
@@ -118,239 +137,512 @@ class Data:
             summary_file.close()
         
     def get_batch(self, startidx, endidx): 
-        # This is very fast if you keep everything in Numpy
-        
-        def process_to_chop_pad(orgids, requiredsize):
-            if (len(orgids) >= requiredsize):
-                return orgids[:requiredsize]
-            else:
-                padids = [PAD_ID] * (requiredsize - len(orgids))
-                return (orgids + padids)
-
-        # Numpy dtype
-        dtype = np.float16 if FLAGS.use_fp16 else np.float32
-        
-        # For train, (endidx-startidx)=FLAGS.batch_size, for others its as specified
-        batch_docnames = np.empty((endidx-startidx), dtype="S60") # File ID of size "cnn-" or "dailymail-" with fileid of size 40
-        batch_docs = np.empty(((endidx-startidx), (FLAGS.max_doc_length + FLAGS.max_title_length + FLAGS.max_image_length), FLAGS.max_sent_length), dtype="int32") 
-        batch_label = np.empty(((endidx-startidx), FLAGS.max_doc_length, FLAGS.target_label_size), dtype=dtype) # Single best oracle, used for JP models or accuracy estimation 
-        batch_weight = np.empty(((endidx-startidx), FLAGS.max_doc_length), dtype=dtype) 
-        batch_oracle_multiple = np.empty(((endidx-startidx), 1, FLAGS.max_doc_length, FLAGS.target_label_size), dtype=dtype)
-        batch_reward_multiple = np.empty(((endidx-startidx), 1), dtype=dtype)
-        
-        batch_idx = 0
-        for fileindex in self.fileindices[startidx:endidx]:
-            # Document Names
-            batch_docnames[batch_idx] = self.filenames[fileindex]
-            
-            # Document
-            doc_wordids = [] # [FLAGS.max_doc_length + FLAGS.max_title_length + FLAGS.max_image_length, FLAGS.max_sent_length]
-            for idx in range(FLAGS.max_doc_length):
-                thissent = []
-                if idx < len(self.docs[fileindex]):
-                    thissent = self.docs[fileindex][idx][:]
-                thissent = process_to_chop_pad(thissent, FLAGS.max_sent_length) # [FLAGS.max_sent_length]
-                doc_wordids.append(thissent)
-            for idx in range(FLAGS.max_title_length):
-                thissent = []
-                if idx < len(self.titles[fileindex]):
-                    thissent = self.titles[fileindex][idx][:]
-                thissent = process_to_chop_pad(thissent, FLAGS.max_sent_length) # [FLAGS.max_sent_length]
-                doc_wordids.append(thissent)
-            for idx in range(FLAGS.max_image_length):
-                thissent = []
-                if idx < len(self.images[fileindex]):
-                    thissent = self.images[fileindex][idx][:]
-                thissent = process_to_chop_pad(thissent, FLAGS.max_sent_length) # [FLAGS.max_sent_length]
-                doc_wordids.append(thissent)
-            batch_docs[batch_idx] = np.array(doc_wordids[:], dtype="int32")
-            
-            # Labels: Select the single best
-            labels_vecs = [[1, 0] if (item in self.labels[fileindex][0]) else [0, 1] for item in range(FLAGS.max_doc_length)]
-            batch_label[batch_idx] = np.array(labels_vecs[:], dtype=dtype)
-
-            # Weights
-            weights = process_to_chop_pad(self.weights[fileindex][:], FLAGS.max_doc_length)
-            batch_weight[batch_idx] = np.array(weights[:], dtype=dtype)
-
-            # Multiple Labels and rewards
-            labels_set = [] # FLAGS.num_sample_rollout, FLAGS.max_doc_length, FLAGS.target_label_size
-            reward_set = [] # FLAGS.num_sample_rollout, FLAGS.max_doc_length, FLAGS.target_label_size
-            for idx in range(FLAGS.num_sample_rollout):
-                thislabels = []
-                if idx < len(self.labels[fileindex]):
-                    thislabels = [[1, 0] if (item in self.labels[fileindex][idx]) else [0, 1] for item in range(FLAGS.max_doc_length)]
-                    reward_set.append(self.rewards[fileindex][idx])
-                else:
-                    # Simply copy the best one
-                    thislabels = [[1, 0] if (item in self.labels[fileindex][0]) else [0, 1] for item in range(FLAGS.max_doc_length)]
-                    reward_set.append(self.rewards[fileindex][0])
-                labels_set.append(thislabels)
-            # Randomly Sample one oracle label
-            randidx_oracle = random.randint(0, (FLAGS.num_sample_rollout-1))
-            batch_oracle_multiple[batch_idx][0] = np.array(labels_set[randidx_oracle][:], dtype=dtype)
-            batch_reward_multiple[batch_idx] = np.array([reward_set[randidx_oracle]], dtype=dtype)
-            
-            # increase batch count
-            batch_idx += 1
-
-        return batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple
+        return build_batch(self.store, np.array(self.fileindices[startidx:endidx], dtype=np.int64))
+
+    def get_batch_ranges(self, batch_size, include_last=False):
+        """(startidx, endidx) of consecutive batches over fileindices, the last
+        smaller batch is only included if include_last.
+        """
+        batch_ranges = [(startidx, startidx+batch_size) for startidx in range(0, len(self.fileindices) - batch_size + 1, batch_size)]
+        if include_last and (len(self.fileindices) % batch_size) != 0:
+            batch_ranges.append((len(self.fileindices) - (len(self.fileindices) % batch_size), len(self.fileindices)))
+        return batch_ranges
+
+    def get_batch_jobs(self, batch_size, include_last=False):
+        """build_batch arguments of consecutive batches over fileindices.
+        """
+        return [(self.store, np.array(self.fileindices[startidx:endidx], dtype=np.int64)) for startidx, endidx in self.get_batch_ranges(batch_size, include_last)]
 
     def shuffle_fileindices(self):
         random.shuffle(self.fileindices)
 
+    def __len__(self):
+        return len(self.fileindices)
+
     def write_to_files(self, data_type):
-        full_data_file_prefix = FLAGS.train_dir + "/" + FLAGS.data_mode + "." + data_type  
-        print("Writing data files with prefix (.filename, .doc, .title, .image, .label, .weight, .rewards): %s"%full_data_file_prefix)
-
-        ffilenames = open(full_data_file_prefix+".filename", "w")
-        fdoc = open(full_data_file_prefix+".doc", "w")
-        ftitle = open(full_data_file_prefix+".title", "w")
-        fimage = open(full_data_file_prefix+".image", "w")
-        flabel = open(full_data_file_prefix+".label", "w")
-        fweight = open(full_data_file_prefix+".weight", "w")
-        freward = open(full_data_file_prefix+".reward", "w")
-        
-        for filename, doc, title, image, label, weight, reward in zip(self.filenames, self.docs, self.titles, self.images, self.labels, self.weights, self.rewards):
-            ffilenames.write(filename+"\n")
-            fdoc.write("\n".join([" ".join([str(item) for item in itemlist]) for itemlist in doc])+"\n\n")
-            ftitle.write("\n".join([" ".join([str(item) for item in itemlist]) for itemlist in title])+"\n\n")
-            fimage.write("\n".join([" ".join([str(item) for item in itemlist]) for itemlist in image])+"\n\n")
-            flabel.write("\n".join([" ".join([str(item) for item in itemlist]) for itemlist in label])+"\n\n")            
-            fweight.write(" ".join([str(item) for item in weight])+"\n")
-            freward.write(" ".join([str(item) for item in reward])+"\n")            
-
-        ffilenames.close()
-        fdoc.close()
-        ftitle.close()
-        fimage.close()
-        flabel.close()
-        fweight.close()
-        freward.close()
+        """Binary snapshot of the data in the compiled corpus format, skipped if
+        train_dir already has a snapshot of the same input.
+        """
+        snapshot_dir = FLAGS.train_dir + "/" + FLAGS.data_mode + "." + data_type + ".corpus"
+        if is_compiled_corpus(snapshot_dir, self.source_signature):
+            print("Data snapshot is up to date: %s"%snapshot_dir)
+            return
+
+        print("Writing binary data snapshot: %s"%snapshot_dir)
+        write_corpus_store(self.store, snapshot_dir, self.source_signature)
 
     def populate_data(self, vocab_dict, data_type):
 
         full_data_file_prefix = FLAGS.preprocessed_data_directory + "/" + FLAGS.data_mode + "." + data_type
-        print("Data file prefix (.doc, .title, .image, .label.multipleoracle): %s"%full_data_file_prefix)
-        
-        # Process doc, title, image, label
-        doc_data_list = open(full_data_file_prefix+".doc").read().strip().split("\n\n")
-        title_data_list = open(full_data_file_prefix+".title").read().strip().split("\n\n")
-        image_data_list = open(full_data_file_prefix+".image").read().strip().split("\n\n")
-        label_data_list = open(full_data_file_prefix+".label.multipleoracle").read().strip().split("\n\n") 
-        
-        print("Data sizes: %d %d %d %d"%(len(doc_data_list), len(title_data_list), len(image_data_list), len(label_data_list)))
-        
-        print("Reading data (no padding to save memory) ...")
-        doccount = 0
-        for doc_data, title_data, image_data, label_data in zip(doc_data_list, title_data_list, image_data_list, label_data_list):
-            
-            doc_lines = doc_data.strip().split("\n")
-            title_lines = title_data.strip().split("\n")
-            image_lines = image_data.strip().split("\n")
-            label_lines = label_data.strip().split("\n")
-            
-            filename = doc_lines[0].strip()
-
-            if ((filename == title_lines[0].strip()) and (filename == image_lines[0].strip()) and (filename == label_lines[0].strip())):
-                # Put filename
-                self.filenames.append(filename)
-                
-                # Doc
-                thisdoc = []
-                for line in doc_lines[1:FLAGS.max_doc_length+1]:
-                    thissent = [int(item) for item in line.strip().split()]
-                    thisdoc.append(thissent)
-                self.docs.append(thisdoc)
-
-                # Title
-                thistitle = []
-                for line in title_lines[1:FLAGS.max_title_length+1]:
-                    thissent = [int(item) for item in line.strip().split()]
-                    thistitle.append(thissent)
-                self.titles.append(thistitle)
-    
-                # Image
-                thisimage = []
-                for line in image_lines[1:FLAGS.max_image_length+1]:
-                    thissent = [int(item) for item in line.strip().split()]
-                    thisimage.append(thissent)
-                self.images.append(thisimage)
-                        
-                # Weights
-                originaldoclen = int(label_lines[1].strip())
-                thisweight = [1 for item in range(originaldoclen)][:FLAGS.max_doc_length]
-                self.weights.append(thisweight)
-
-                # Labels (multiple oracles and preestimated rewards)
-                thislabel = []
-                thisreward = []
-                for line in label_lines[2:FLAGS.num_sample_rollout+2]:
-                    thislabel.append([int(item) for item in line.split()[:-1]])
-                    thisreward.append(float(line.split()[-1]))                    
-                self.labels.append(thislabel)
-                self.rewards.append(thisreward)
+        compiled_corpus_dir = get_compiled_corpus_dir(data_type)
 
+        if compiled_corpus_dir and is_compiled_corpus(compiled_corpus_dir):
+            if os.path.isfile(full_data_file_prefix+".doc") and not is_compiled_corpus(compiled_corpus_dir, text_signature(full_data_file_prefix)):
+                print("Compiled corpus %s is out of date, rerun with --exp_mode compile. Reading text files instead."%compiled_corpus_dir)
             else:
+                print("Loading compiled corpus (memory-mapped): %s"%compiled_corpus_dir)
+                self.store = load_corpus_store(compiled_corpus_dir)
+                self.source_signature = ["compiled "+compiled_corpus_dir] + read_corpus_info(compiled_corpus_dir)
+
+        if self.store is None:
+            print("Data file prefix (.doc, .title, .image, .label.multipleoracle): %s"%full_data_file_prefix)
+            try:
+                self.store = read_corpus_text(full_data_file_prefix, FLAGS.max_doc_length, FLAGS.max_title_length, FLAGS.max_image_length, FLAGS.num_sample_rollout,
+                                              num_workers=FLAGS.num_parse_workers)
+            except ValueError:
                 print("Some problem with %s.* files. Exiting!"%full_data_file_prefix)
                 exit(0)
-                   
-            if doccount%10000==0:
-                print("%d ..."%doccount)
-            doccount += 1
+            # Text input is truncated with the current limits
+            self.source_signature = (["text "+full_data_file_prefix] + text_signature(full_data_file_prefix) +
+                                     ["limits %d %d %d %d"%(FLAGS.max_doc_length, FLAGS.max_title_length, FLAGS.max_image_length, FLAGS.num_sample_rollout)])
+
+        # Oracle labels in compact form: one bitset per document and rollout
+        self.store.prepare_oracle_table(FLAGS.num_sample_rollout, FLAGS.max_doc_length)
+
+        # List like views over the store: documents are only materialised when accessed
+        store = self.store
+        self.filenames = store.filenames
+        self.docs = StoreView(store, lambda docindex: store.sentences("doc", docindex, FLAGS.max_doc_length))
+        self.titles = StoreView(store, lambda docindex: store.sentences("title", docindex, FLAGS.max_title_length))
+        self.images = StoreView(store, lambda docindex: store.sentences("image", docindex, FLAGS.max_image_length))
+        self.weights = StoreView(store, lambda docindex: [1] * min(store.doc_length(docindex), FLAGS.max_doc_length))
+        # Labels (multiple oracles and preestimated rewards)
+        self.labels = StoreView(store, lambda docindex: store.oracles(docindex, FLAGS.num_sample_rollout))
+        self.rewards = StoreView(store, lambda docindex: store.rewards(docindex, FLAGS.num_sample_rollout))
 
         # Set Fileindices
-        self.fileindices = range(len(self.filenames))
+        self.fileindices = list(range(len(self.filenames)))
+
+def build_batch(store, docindices):
+    """Batch Numpy arrays of the documents docindices of store. Everything is
+    gathered and scattered in Numpy straight from the store.
+    """
+    # Numpy dtype
+    dtype = np.float16 if FLAGS.use_fp16 else np.float32
+
+    batch_size = len(docindices)
+    
+    # For train, batch_size=FLAGS.batch_size, for others its as specified
+    batch_docnames = np.empty(batch_size, dtype="S60") # File ID of size "cnn-" or "dailymail-" with fileid of size 40
+    batch_docnames[:] = [store.filenames[fileindex] for fileindex in docindices]
+
+    # Document: doc, title and image sentences, padded with PAD_ID
+    batch_docs = np.zeros((batch_size, (FLAGS.max_doc_length + FLAGS.max_title_length + FLAGS.max_image_length), FLAGS.max_sent_length), dtype="int32") 
+    store.fill_sentences(batch_docs, "doc", docindices, 0, FLAGS.max_doc_length, FLAGS.max_sent_length, vocab_remap)
+    store.fill_sentences(batch_docs, "title", docindices, FLAGS.max_doc_length, FLAGS.max_title_length, FLAGS.max_sent_length, vocab_remap)
+    store.fill_sentences(batch_docs, "image", docindices, FLAGS.max_doc_length + FLAGS.max_title_length, FLAGS.max_image_length, FLAGS.max_sent_length, vocab_remap)
+
+    # Oracle labels and rewards are looked up in the precomputed table of the store
+    store.prepare_oracle_table(FLAGS.num_sample_rollout, FLAGS.max_doc_length)
+
+    # Labels: Select the single best, used for JP models or accuracy estimation
+    best_mask, _ = store.sample_oracles(docindices, np.zeros(batch_size, dtype=np.int64), FLAGS.max_doc_length)
+    batch_label = np.stack([best_mask, ~best_mask], axis=-1).astype(dtype)
+
+    # Weights
+    batch_weight = store.weight_mask(docindices, FLAGS.max_doc_length).astype(dtype)
+
+    # Multiple Labels and rewards: Randomly sample one oracle label, the table repeats the best one if a document has fewer oracles
+    randidx_oracle = np.random.randint(0, FLAGS.num_sample_rollout, size=batch_size)
+    oracle_mask, oracle_reward = store.sample_oracles(docindices, randidx_oracle, FLAGS.max_doc_length)
+    batch_oracle_multiple = np.stack([oracle_mask, ~oracle_mask], axis=-1).astype(dtype)[:, np.newaxis]
+    batch_reward_multiple = oracle_reward.astype(dtype)[:, np.newaxis]
+
+    return batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple
+
+class StreamingData:
+    """Training data read as a sequence of shards of FLAGS.streaming_shard_size
+    documents, for corpora larger than memory.
+
+    Shards are collected in a buffer of FLAGS.shard_buffer_size shards whose
+    documents are shuffled together and turned into batches; documents left
+    over from a buffer move on to the next one. At most one buffer of shards
+    is held in memory at any time. Shards come in file order from the text
+    files, or in a random order from a compiled corpus.
+    """
+    def __init__(self, data_type):
+        self.data_type = data_type
+        self.full_data_file_prefix = FLAGS.preprocessed_data_directory + "/" + FLAGS.data_mode + "." + data_type
+        self.shard_size = FLAGS.streaming_shard_size if FLAGS.streaming_shard_size > 0 else DEFAULT_SHARD_SIZE
+
+        self.compiled_store = None
+        compiled_corpus_dir = get_compiled_corpus_dir(data_type)
+        if compiled_corpus_dir and is_compiled_corpus(compiled_corpus_dir):
+            print("Streaming shards from compiled corpus: %s"%compiled_corpus_dir)
+            self.compiled_store = load_corpus_store(compiled_corpus_dir)
+            self.num_docs = len(self.compiled_store)
+        else:
+            print("Streaming shards from text files: %s"%self.full_data_file_prefix)
+            self.num_docs = count_text_blocks(self.full_data_file_prefix+".label.multipleoracle")
+        print("Streaming %d documents in shards of %d, shuffle buffer of %d shards"%(self.num_docs, self.shard_size, FLAGS.shard_buffer_size))
+
+    def __len__(self):
+        return self.num_docs
+
+    def shuffle_fileindices(self):
+        # Documents are shuffled inside the shard buffer while iterating
+        pass
+
+    def iterate_shards(self):
+        if self.compiled_store is not None:
+            shard_starts = list(range(0, self.num_docs, self.shard_size))
+            random.shuffle(shard_starts)
+            for shard_start in shard_starts:
+                yield self.compiled_store.subset(np.arange(shard_start, min(shard_start+self.shard_size, self.num_docs)))
+        else:
+            for shard in iterate_corpus_text_shards(self.full_data_file_prefix, self.shard_size, FLAGS.max_doc_length,
+                                                    FLAGS.max_title_length, FLAGS.max_image_length, FLAGS.num_sample_rollout):
+                yield shard
+
+    def get_batch_jobs(self, batch_size, include_last=False):
+        """Lazily yields build_batch arguments while reading the shards.
+        """
+        buffer_shards = []
+        for shard in self.iterate_shards():
+            buffer_shards.append(shard)
+            if sum([len(item) for item in buffer_shards]) >= FLAGS.shard_buffer_size * self.shard_size:
+                leftover = None
+                for job in self._buffer_batch_jobs(buffer_shards, batch_size):
+                    if len(job[1]) < batch_size:
+                        leftover = job[0].subset(job[1])
+                    else:
+                        yield job
+                buffer_shards = [leftover] if leftover is not None else []
+        for job in self._buffer_batch_jobs(buffer_shards, batch_size):
+            if include_last or len(job[1]) == batch_size:
+                yield job
+
+    def _buffer_batch_jobs(self, buffer_shards, batch_size):
+        if not buffer_shards:
+            return
+        buffer_store = concatenate_stores(buffer_shards)
+        docindices = np.arange(len(buffer_store))
+        np.random.shuffle(docindices)
+        for startidx in range(0, len(docindices), batch_size):
+            yield (buffer_store, docindices[startidx:startidx+batch_size])
+
+class BatchPrefetcher:
+    """Iterates over batch_fn(*args) for every args in batch_args, in order,
+    while producer threads build the upcoming batches in the background.
+    batch_args may be a lazy iterator, it is consumed as batches are built.
+
+    At most queue_size batches are built ahead of the consumer. wait_time
+    accumulates the time the consumer was starved, waiting for a batch that
+    was not ready yet. With num_threads = 0 batches are built on demand in
+    the calling thread.
+    """
+    def __init__(self, batch_fn, batch_args, num_threads=None, queue_size=None):
+        self.batch_fn = batch_fn
+        self.batch_args = iter(batch_args)
+        self.num_threads = FLAGS.prefetch_threads if num_threads is None else num_threads
+        self.queue_size = max(1, FLAGS.prefetch_batches if queue_size is None else queue_size)
+        self.wait_time = 0.0
+
+        self._condition = threading.Condition()
+        self._args_lock = threading.Lock()
+        self._next_job = 0
+        self._num_jobs = None # known once batch_args is exhausted
+        self._results = {}
+        self._stopped = False
+        self._threads = []
+
+    def __iter__(self):
+        if self.num_threads <= 0:
+            for args in self.batch_args:
+                yield self.batch_fn(*args)
+            return
+
+        self._start()
+        try:
+            jobidx = 0
+            while True:
+                success, result = self._get(jobidx)
+                if success is None:
+                    break
+                if not success:
+                    raise result
+                yield result
+                jobidx += 1
+        finally:
+            self.stop()
+
+    def _start(self):
+        for _ in range(self.num_threads):
+            thread = threading.Thread(target=self._produce)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _produce(self):
+        while True:
+            with self._condition:
+                # Do not run more than queue_size batches ahead of the consumer
+                while (not self._stopped) and (self._num_jobs is None) and (len(self._results) >= self.queue_size):
+                    self._condition.wait()
+                if self._stopped or (self._num_jobs is not None):
+                    return
+                # Reserve the slot while the batch is being built
+                self._results[("reserved", id(threading.current_thread()))] = None
+
+            # Reading the next arguments may be slow (e.g. shard loading), keep the condition free
+            with self._args_lock:
+                try:
+                    args = next(self.batch_args)
+                    jobidx = self._next_job
+                    self._next_job += 1
+                except StopIteration:
+                    args = None
+                except Exception as e:
+                    args = e
+                    jobidx = self._next_job
+                    self._next_job += 1
+
+            if args is None:
+                result = None
+            elif isinstance(args, Exception):
+                result = (False, args)
+            else:
+                try:
+                    result = (True, self.batch_fn(*args))
+                except Exception as e:
+                    result = (False, e)
+
+            with self._condition:
+                del self._results[("reserved", id(threading.current_thread()))]
+                if result is None:
+                    self._num_jobs = self._next_job
+                else:
+                    self._results[jobidx] = result
+                self._condition.notify_all()
+
+    def _get(self, jobidx):
+        with self._condition:
+            if jobidx not in self._results:
+                start_time = time.time()
+                while (jobidx not in self._results) and (self._num_jobs is None or jobidx < self._num_jobs):
+                    self._condition.wait()
+                self.wait_time += time.time() - start_time
+            if jobidx not in self._results:
+                return None, None
+            result = self._results.pop(jobidx)
+            self._condition.notify_all()
+        return result
+
+    def stop(self):
+        """Stops the producer threads and waits for the batches they are
+        building to finish.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+def get_compiled_corpus_dir(data_type):
+    if not FLAGS.compiled_data_directory:
+        return ""
+    return FLAGS.compiled_data_directory + "/" + FLAGS.data_mode + "." + data_type + ".corpus"
 
 class DataProcessor:
     def prepare_news_data(self, vocab_dict, data_type="training"):
         data = Data(vocab_dict, data_type)
         return data
+
+    def prepare_streaming_news_data(self, data_type="training"):
+        data = StreamingData(data_type)
+        return data
+
+    def compile_news_data(self, data_type="training"):
+        """One-time conversion of the preprocessed text files of a split into a
+        binary corpus in FLAGS.compiled_data_directory. Nothing is truncated,
+        so the compiled corpus is valid for any max_*_length setting.
+        """
+        compiled_corpus_dir = get_compiled_corpus_dir(data_type)
+        if not compiled_corpus_dir:
+            print("Set --compiled_data_directory to compile the corpus. Exiting!")
+            exit(0)
+
+        full_data_file_prefix = FLAGS.preprocessed_data_directory + "/" + FLAGS.data_mode + "." + data_type
+        signature = text_signature(full_data_file_prefix)
+        if is_compiled_corpus(compiled_corpus_dir, signature):
+            print("Compiled corpus is up to date: %s"%compiled_corpus_dir)
+            return
+
+        print("Compiling %s.* into %s"%(full_data_file_prefix, compiled_corpus_dir))
+        try:
+            store = read_corpus_text(full_data_file_prefix, num_workers=FLAGS.num_parse_workers)
+        except ValueError:
+            print("Some problem with %s.* files. Exiting!"%full_data_file_prefix)
+            exit(0)
+        if not os.path.isdir(FLAGS.compiled_data_directory):
+            os.makedirs(FLAGS.compiled_data_directory)
+        write_corpus_store(store, compiled_corpus_dir, signature)
+        print("Compiled %d documents."%len(store))
         
     def prepare_vocab_embeddingdict(self):
         # Numpy dtype
         dtype = np.float16 if FLAGS.use_fp16 else np.float32
         
         vocab_dict = {}
-        word_embedding_array = []
         
         # Add padding
         vocab_dict["_PAD"] = PAD_ID
         # Add UNK
         vocab_dict["_UNK"] = UNK_ID
         
-        # Read word embedding file
+        # Read word embedding file, or its binary cache
         wordembed_filename = FLAGS.pretrained_wordembedding
-        print("Reading pretrained word embeddings file: %s"%wordembed_filename)
-
-        embed_line = ""
-        linecount = 0
-        with open(wordembed_filename, "r") as fembedd:
-            for line in fembedd:
-                if linecount == 0:
-                    vocabsize = int(line.split()[0])
-                    # Initiate fixed size empty array
-                    word_embedding_array = np.empty((vocabsize, FLAGS.wordembed_size), dtype=dtype)    
-                else:
-                    linedata = line.split()
-                    vocab_dict[linedata[0]] = linecount + 1
-                    embeddata = [float(item) for item in linedata[1:]][0:FLAGS.wordembed_size]
-                    word_embedding_array[linecount-1] = np.array(embeddata, dtype=dtype)
-                    
-                if linecount%100000 == 0:
-                    print(str(linecount)+" ...")
-                linecount += 1
+        cache_prefix = get_embedding_cache_prefix(wordembed_filename)
+        if os.path.isfile(cache_prefix+".npy") and os.path.isfile(cache_prefix+".vocab"):
+            print("Reading cached pretrained word embeddings: %s.npy"%cache_prefix)
+            words = io.open(cache_prefix+".vocab", encoding="utf-8").read().split("\n")[:-1]
+            word_embedding_array = np.load(cache_prefix+".npy", mmap_mode="r")
+        else:
+            print("Reading pretrained word embeddings file: %s"%wordembed_filename)
+            words, word_embedding_array = read_embedding_text(wordembed_filename, FLAGS.wordembed_size, FLAGS.num_parse_workers)
+            print("Writing pretrained word embeddings cache: %s.npy"%cache_prefix)
+            write_embedding_cache(cache_prefix, words, word_embedding_array)
+        if word_embedding_array.dtype != dtype:
+            word_embedding_array = word_embedding_array.astype(dtype)
+
+        for wordidx, word in enumerate(words):
+            vocab_dict[word] = wordidx + 2
         print("Read pretrained embeddings: %s"%str(word_embedding_array.shape))
         
         print("Size of vocab: %d (_PAD:0, _UNK:1)"%len(vocab_dict))
         vocabfilename = FLAGS.train_dir+"/vocab.txt"
         print("Writing vocab file: %s"%vocabfilename)
 
-        foutput = open(vocabfilename,"w")
+        foutput = io.open(vocabfilename, "w", encoding="utf-8")
         vocab_list = [(vocab_dict[key], key) for key in vocab_dict.keys()]
         vocab_list.sort()
         vocab_list = [item[1] for item in vocab_list]
         foutput.write("\n".join(vocab_list)+"\n")
         foutput.close()
         return vocab_dict, word_embedding_array
-    
+
+    def prepare_vocab_remap(self, vocab_dict, datasets=[]):
+        """Map the token ids used by the training, validation and test corpora
+        (plus _PAD and _UNK) to a dense range, every other id maps to _UNK.
+        Already loaded datasets are scanned in memory, other splits are
+        streamed shard by shard. The table is saved in train_dir for test().
+        """
+        present = np.zeros(len(vocab_dict), dtype=bool)
+        present[[PAD_ID, UNK_ID]] = True
+        loaded_stores = dict((data.data_type, data.store) for data in datasets if getattr(data, "store", None) is not None)
+        for data_type in ["training", "validation", "test"]:
+            if data_type in loaded_stores:
+                stores = [loaded_stores[data_type]]
+            elif (get_compiled_corpus_dir(data_type) and is_compiled_corpus(get_compiled_corpus_dir(data_type))) or os.path.isfile(
+                    FLAGS.preprocessed_data_directory + "/" + FLAGS.data_mode + "." + data_type + ".doc"):
+                stores = StreamingData(data_type).iterate_shards()
+            else:
+                print("No %s data to scan for the vocabulary."%data_type)
+                continue
+            print("Scanning token ids of %s data ..."%data_type)
+            for store in stores:
+                store.mark_token_ids(present)
+
+        remap = np.empty(len(vocab_dict), dtype=np.int32)
+        remap.fill(UNK_ID)
+        remap[present] = np.arange(np.count_nonzero(present))
+        print("Pruned vocab: %d of %d words used by the corpora"%(np.count_nonzero(present), len(vocab_dict)))
+
+        remapfilename = FLAGS.train_dir+"/vocab-remap.npy"
+        print("Writing vocab remapping table: %s"%remapfilename)
+        np.save(remapfilename, remap)
+        return remap
+
+    def restore_vocab_remap(self):
+        remapfilename = FLAGS.train_dir+"/vocab-remap.npy"
+        if not os.path.isfile(remapfilename):
+            print("Vocab remapping table %s not found, train with --prune_vocab first. Exiting!"%remapfilename)
+            exit(0)
+        print("Reading vocab remapping table: %s"%remapfilename)
+        return np.load(remapfilename)
+
+def prune_word_embedding_array(remap, word_embedding_array):
+    """Rows of word_embedding_array (ids from 2, no _PAD and _UNK) kept by
+    remap, in the order of their new ids.
+    """
+    kept_ids = np.flatnonzero(remap > UNK_ID)
+    return np.asarray(word_embedding_array[kept_ids - 2])
+
+### Pretrained word embeddings
+
+def get_embedding_cache_prefix(wordembed_filename):
+    """Cache files are keyed on the size and mtime of the embedding file and on
+    FLAGS.wordembed_size.
+    """
+    cache_directory = FLAGS.embedding_cache_directory or os.path.dirname(os.path.abspath(wordembed_filename))
+    filestat = os.stat(wordembed_filename)
+    return cache_directory + "/" + os.path.basename(wordembed_filename) + ".%d-%d-%d"%(filestat.st_size, int(filestat.st_mtime), FLAGS.wordembed_size)
+
+def _parse_embedding_chunk(args):
+    """Words and [words, wordembed_size] float32 embeddings of the lines in
+    byte range [start, end) of the embedding file.
+    """
+    wordembed_filename, start, end, wordembed_size = args
+    with open(wordembed_filename, "rb") as fembedd:
+        fembedd.seek(start)
+        lines = fembedd.read(end - start).decode("utf-8").split("\n")
+    words = []
+    values = []
+    for line in lines:
+        linedata = line.split()
+        if not linedata:
+            continue
+        words.append(linedata[0])
+        values += linedata[1:wordembed_size+1]
+    return words, np.array(values, dtype=np.float32).reshape((len(words), wordembed_size))
+
+def read_embedding_text(wordembed_filename, wordembed_size, num_workers=1):
+    """Parse a word2vec text file in num_workers processes, each one
+    parsing a chunk of whole lines.
+    """
+    filesize = os.path.getsize(wordembed_filename)
+    with open(wordembed_filename, "rb") as fembedd:
+        vocabsize = int(fembedd.readline().split()[0])
+        # Chunk boundaries: roughly equal byte ranges, moved to the next line start
+        boundaries = [fembedd.tell()]
+        num_chunks = max(1, num_workers) * 4
+        for chunkidx in range(1, num_chunks):
+            fembedd.seek(max(boundaries[-1], (filesize * chunkidx) // num_chunks))
+            fembedd.readline()
+            boundaries.append(fembedd.tell())
+        boundaries.append(filesize)
+    chunks = [(wordembed_filename, start, end, wordembed_size) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+    if num_workers > 1:
+        with closing(Pool(num_workers)) as pool:
+            results = pool.map(_parse_embedding_chunk, chunks)
+    else:
+        results = [_parse_embedding_chunk(chunk) for chunk in chunks]
+
+    words = []
+    for chunk_words, _ in results:
+        words += chunk_words
+    word_embedding_array = np.concatenate([chunk_array for _, chunk_array in results]) if results else np.empty((0, wordembed_size), dtype=np.float32)
+    if len(words) != vocabsize:
+        print("Warning: %s announces %d words, read %d."%(wordembed_filename, vocabsize, len(words)))
+    return words, word_embedding_array
+
+def write_embedding_cache(cache_prefix, words, word_embedding_array):
+    """Writes the cache files, or only warns if they cannot be written (e.g.
+    read-only embedding directory): training goes on with the embeddings in
+    memory.
+    """
+    tmp_suffix = ".tmp-%d"%os.getpid()
+    try:
+        with io.open(cache_prefix+".vocab"+tmp_suffix, "w", encoding="utf-8") as fvocab:
+            fvocab.write("".join([word+"\n" for word in words]))
+        with open(cache_prefix+".npy"+tmp_suffix, "wb") as farray:
+            np.save(farray, word_embedding_array)
+        os.rename(cache_prefix+".vocab"+tmp_suffix, cache_prefix+".vocab")
+        os.rename(cache_prefix+".npy"+tmp_suffix, cache_prefix+".npy")
+    except (IOError, OSError) as e:
+        print("Warning: could not write the word embeddings cache %s (%s), set --embedding_cache_directory to a writable directory."%(cache_prefix, e))
+        for filename in (cache_prefix+".vocab"+tmp_suffix, cache_prefix+".npy"+tmp_suffix):
+            if os.path.isfile(filename):
+                os.remove(filename)
@@ -20,12 +20,14 @@ import os
 import random
 import sys
 import time
+from collections import deque
 
 import numpy as np
 import tensorflow as tf
 
-from reward_utils import Reward_Generator
-from data_utils import DataProcessor
+from reward_utils import Reward_Generator, get_full_rouge, get_gold_summary_directory
+from model_utils import multisample_three_forsummary
+from data_utils import DataProcessor, BatchPrefetcher, build_batch, set_vocab_remap, prune_word_embedding_array
 from my_flags import FLAGS
 from my_model import MY_Model
 
@@ -38,29 +40,16 @@ def batch_predict_with_a_model(data, model, session=None):
   data_labels = []
   data_weights = []
   
-  step = 1
-  while (step * FLAGS.batch_size) <= len(data.fileindices):
-    # Get batch data as Numpy Arrays : Without shuffling
-    batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple = data.get_batch(((step-1)*FLAGS.batch_size), (step * FLAGS.batch_size))
-    batch_logits = session.run(model.logits, feed_dict={model.document_placeholder: batch_docs})
-    
-    data_logits.append(batch_logits)
-    data_labels.append(batch_label)
-    data_weights.append(batch_weight)
-    
-    # Increase step
-    step += 1
-
-  # Check if any data left
-  if (len(data.fileindices) > ((step-1)*FLAGS.batch_size)):
-    # Get last batch as Numpy Arrays
-    batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple = data.get_batch(((step-1)*FLAGS.batch_size), len(data.fileindices))
+  # Get batch data as Numpy Arrays : Without shuffling, including the last smaller batch
+  prefetcher = BatchPrefetcher(build_batch, data.get_batch_jobs(FLAGS.batch_size, include_last=True))
+  for batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple in prefetcher:
     batch_logits = session.run(model.logits, feed_dict={model.document_placeholder: batch_docs})
     
     data_logits.append(batch_logits)
     data_labels.append(batch_label)
     data_weights.append(batch_weight)
     # print(data_logits) 
+  print("Batch prediction: waited %.2f seconds for batches"%prefetcher.wait_time)
     
   # Convert list to tensors
   data_logits = tf.concat(0, data_logits)
@@ -69,6 +58,63 @@ def batch_predict_with_a_model(data, model, session=None):
   # print(data_logits,data_lables,data_weights)
   return data_logits, data_lables, data_weights 
 
+######################## Online Reinforcement Learning ###########
+
+def sample_policy_rollouts(sess, model, batch_docs, batch_label, batch_weight):
+  """ Sample one rollout per document from the current policy
+  Return:
+  batch_labels_mask: [batch_size] selected sentence bitmasks
+  """
+  batch_logits = sess.run(model.logits, feed_dict={model.document_placeholder: batch_docs})
+  # Softmax in numpy, to keep the graph fixed
+  batch_softmax_logits = np.exp(batch_logits - np.max(batch_logits, axis=2, keepdims=True))
+  batch_softmax_logits /= np.sum(batch_softmax_logits, axis=2, keepdims=True)
+  
+  # Rollout 0 is the oracle, the others are sampled; keep one of them per document
+  batch_labelstr_multisample = multisample_three_forsummary(batch_softmax_logits, batch_label, batch_weight) # [batch_size, FLAGS.num_sample_rollout]
+  rolloutindices = np.random.randint(batch_labelstr_multisample.shape[1], size=batch_labelstr_multisample.shape[0])
+  batch_labels_mask = []
+  for labelstr, rolloutidx in zip(batch_labelstr_multisample, rolloutindices):
+    final_labels_str = labelstr[rolloutidx].decode("ascii") if isinstance(labelstr[rolloutidx], bytes) else labelstr[rolloutidx]
+    final_labels_mask = 0
+    for sentidx in final_labels_str.split("-"):
+      if sentidx:
+        final_labels_mask |= 1 << int(sentidx)
+    batch_labels_mask.append(final_labels_mask)
+  return batch_labels_mask
+
+def online_rl_batches(sess, model, rouge_generator, batches):
+  """ Replace the pre-estimated oracles of training batches with rollouts
+  sampled from the current policy and rewarded by the reward pool.
+
+  Rewards of a batch are computed while the following training steps run: a
+  batch is yielded for training once FLAGS.reward_staleness newer batches
+  have been sampled, so its rollouts come from a policy at most that many
+  updates old (0: score and train synchronously).
+  """
+  dtype = np.float16 if FLAGS.use_fp16 else np.float32
+  pending = deque()
+
+  def finish(item):
+    batch_docnames, batch_docs, batch_label, batch_weight, batch_labels_mask, submitted = item
+    batch_reward_multiple = rouge_generator.collect_batch_rouge(submitted) # [batch_size, 1]
+    batch_oracle_multiple = np.zeros((len(batch_labels_mask), 1, FLAGS.max_doc_length, FLAGS.target_label_size), dtype=dtype)
+    batch_oracle_multiple[:, :, :, 1] = 1
+    for docindex, final_labels_mask in enumerate(batch_labels_mask):
+      for sentidx in range(FLAGS.max_doc_length):
+        if (final_labels_mask >> sentidx) & 1:
+          batch_oracle_multiple[docindex, 0, sentidx] = [1, 0]
+    return batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple
+
+  for batch_docnames, batch_docs, batch_label, batch_weight, _, _ in batches:
+    batch_labels_mask = sample_policy_rollouts(sess, model, batch_docs, batch_label, batch_weight)
+    submitted = rouge_generator.submit_batch_rouge(batch_docnames, [[final_labels_mask] for final_labels_mask in batch_labels_mask])
+    pending.append((batch_docnames, batch_docs, batch_label, batch_weight, batch_labels_mask, submitted))
+    while len(pending) > FLAGS.reward_staleness:
+      yield finish(pending.popleft())
+  while pending:
+    yield finish(pending.popleft())
+
 ######################## Training Mode ###########################
 
 def train():
@@ -90,16 +136,27 @@ def train():
       # vocab_dict contains _PAD and _UNK but not word_embedding_array
 
       print("Prepare training data ...")
-      train_data = DataProcessor().prepare_news_data(vocab_dict, data_type="training")
+      if FLAGS.streaming_shard_size > 0:
+        train_data = DataProcessor().prepare_streaming_news_data(data_type="training")
+      else:
+        train_data = DataProcessor().prepare_news_data(vocab_dict, data_type="training")
       
       print("Prepare validation data ...")
       validation_data = DataProcessor().prepare_news_data(vocab_dict, data_type="validation")
 
+      vocab_size = len(vocab_dict)-2
+      if FLAGS.prune_vocab:
+        print("Prune vocab to the words used by the corpora ...")
+        vocab_remap = DataProcessor().prepare_vocab_remap(vocab_dict, [train_data, validation_data])
+        set_vocab_remap(vocab_remap)
+        word_embedding_array = prune_word_embedding_array(vocab_remap, word_embedding_array)
+        vocab_size = word_embedding_array.shape[0]
+
       print("Prepare ROUGE reward generator ...")
-      rouge_generator = Reward_Generator()
+      rouge_generator = Reward_Generator(None if FLAGS.streaming_shard_size > 0 else train_data.filenames)
 
       # Create Model with various operations
-      model = MY_Model(sess, len(vocab_dict)-2)
+      model = MY_Model(sess, vocab_size)
       
       # Start training with some pretrained model
       start_epoch = 1
@@ -136,12 +193,14 @@ def train():
         print("MRT: Epoch "+str(epoch)+" : Restore Rouge Dict")
         rouge_generator.restore_rouge_dict()
           
-        # Start Batch Training
+        # Start Batch Training: batches are built in the background while the session runs
+        prefetcher = BatchPrefetcher(build_batch, train_data.get_batch_jobs(FLAGS.batch_size))
+        training_batches = prefetcher
+        if FLAGS.online_rl:
+          # Rollouts sampled from the policy, rewards computed alongside the training steps
+          training_batches = online_rl_batches(sess, model, rouge_generator, prefetcher)
         step = 1
-        while (step * FLAGS.batch_size) <= len(train_data.fileindices):
-          # Get batch data as Numpy Arrays
-          batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple = train_data.get_batch(((step-1)*FLAGS.batch_size), 
-                                                                                                                                     (step * FLAGS.batch_size))
+        for batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple in training_batches:
           # print(batch_docnames)
           # print(batch_label[0])
           # print(batch_weight[0])
@@ -161,10 +220,10 @@ def train():
                                                                              model.weight_placeholder: batch_weight})
             
             # Print Summary to Tensor Board
-            model.summary_writer.add_summary(ce_loss_sum, ((epoch-1)*len(train_data.fileindices)+ step*FLAGS.batch_size))
-            model.summary_writer.add_summary(acc_sum, ((epoch-1)*len(train_data.fileindices)+step*FLAGS.batch_size))
+            model.summary_writer.add_summary(ce_loss_sum, ((epoch-1)*len(train_data)+ step*FLAGS.batch_size))
+            model.summary_writer.add_summary(acc_sum, ((epoch-1)*len(train_data)+step*FLAGS.batch_size))
 
-            print("MRT: Epoch "+str(epoch)+" : Covered " + str(step*FLAGS.batch_size)+"/"+str(len(train_data.fileindices)) + 
+            print("MRT: Epoch "+str(epoch)+" : Covered " + str(step*FLAGS.batch_size)+"/"+str(len(train_data)) + 
                   " : Minibatch Reward Weighted Multisample CE Loss= {:.6f}".format(ce_loss_val) + " : Minibatch training accuracy= {:.6f}".format(acc_val))
 
           # Run optimizer: optimize policy network 
@@ -179,6 +238,10 @@ def train():
           # if step == 20:
           #   break 
 
+        print("MRT: Epoch "+str(epoch)+" : Waited {:.2f} seconds for training batches".format(prefetcher.wait_time))
+        if FLAGS.online_rl:
+          print("MRT: Epoch "+str(epoch)+" : Waited {:.2f} seconds for the rewards of {} rollouts (reward_staleness {})".format(rouge_generator.wait_time, rouge_generator.scored_count, FLAGS.reward_staleness))
+
         # Save Model 
         print("MRT: Epoch "+str(epoch)+" : Saving model after epoch completion")
         checkpoint_path = os.path.join(FLAGS.train_dir, "model.ckpt.epoch-"+str(epoch))
@@ -197,7 +260,7 @@ def train():
                                                                                                               model.label_placeholder: validation_labels.eval(session=sess), 
                                                                                                               model.weight_placeholder: validation_weights.eval(session=sess)})
         # Print Validation Summary 
-        model.summary_writer.add_summary(validation_sum, (epoch*len(train_data.fileindices)))
+        model.summary_writer.add_summary(validation_sum, (epoch*len(train_data)))
         
         print("MRT: Epoch "+str(epoch)+" : Validation ("+str(len(validation_data.fileindices))+") accuracy= {:.6f}".format(validation_acc))
         # Writing validation predictions and final summaries
@@ -235,8 +298,16 @@ def test():
       print("Prepare test data ...")
       test_data = DataProcessor().prepare_news_data(vocab_dict, data_type="test")
 
+      vocab_size = len(vocab_dict)-2
+      if FLAGS.prune_vocab:
+        # Use the same pruned vocab ids as during training
+        vocab_remap = DataProcessor().restore_vocab_remap()
+        set_vocab_remap(vocab_remap)
+        word_embedding_array = prune_word_embedding_array(vocab_remap, word_embedding_array)
+        vocab_size = word_embedding_array.shape[0]
+
       # Create Model with various operations
-      model = MY_Model(sess, len(vocab_dict)-2)
+      model = MY_Model(sess, vocab_size)
 
       # # Initialize word embedding before training
       # print("Initialize word embedding vocabulary with pretrained embeddings ...")
@@ -270,12 +341,30 @@ def test():
       print("Test ("+str(len(test_data.fileindices))+") accuracy= {:.6f}".format(test_acc))
       # Writing test predictions and final summaries
       test_data.write_prediction_summaries(test_logits, "model.ckpt.epoch-"+str(FLAGS.model_to_load), session=sess)
+      # Estimate Rouge Scores (per-document scores are kept next to the summaries), if the gold summaries are available
+      if os.path.isdir(get_gold_summary_directory("test")):
+        rouge_score = get_full_rouge(FLAGS.train_dir+"/model.ckpt.epoch-"+str(FLAGS.model_to_load)+".test-summary-topranked", "test")
+        print("Test ("+str(len(test_data.fileindices))+") rouge= {:.6f}".format(rouge_score))
+      else:
+        print("No gold summaries in "+get_gold_summary_directory("test")+", skipping ROUGE")
+
+######################## Compile Mode ###########################
+
+def compile_corpus():
+  """
+  Compile Mode: Convert the preprocessed text corpora into binary corpora
+  """
+  for data_type in ["training", "validation", "test"]:
+    print("Compile "+data_type+" data ...")
+    DataProcessor().compile_news_data(data_type)
 
 ######################## Main Function ###########################
 
 def main(_):
   if FLAGS.exp_mode == "train":
     train()
+  elif FLAGS.exp_mode == "compile":
+    compile_corpus()
   else:
     test()
 
@@ -28,7 +28,7 @@ tf.app.flags.DEFINE_string("use_gpu", "/gpu:3", "Specify which gpu to use.")
 
 ### Global setting
 
-tf.app.flags.DEFINE_string("exp_mode", "train", "Training 'train' or Test 'test' Mode.")
+tf.app.flags.DEFINE_string("exp_mode", "train", "Training 'train', Test 'test' or corpus compilation 'compile' Mode.")
 
 tf.app.flags.DEFINE_integer("model_to_load", 100, "Model to load for testing.")
 
@@ -43,6 +43,8 @@ tf.app.flags.DEFINE_integer("wordembed_size", 200, "Size of wordembedding (<= 20
 tf.app.flags.DEFINE_boolean("trainable_wordembed", False, "Is wordembedding trainable?") 
 # UNK and PAD are always trainable and non-trainable respectively.
 
+tf.app.flags.DEFINE_boolean("prune_vocab", False, "Only keep the wordembeddings of words used by the corpora (use the same value for train and test).")
+
 ### Sentence level features
 
 tf.app.flags.DEFINE_integer("max_sent_length", 100, "Maximum sentence length (word per sent.)")
@@ -97,6 +99,14 @@ tf.app.flags.DEFINE_integer("train_epoch_wce", 20, "Number of training epochs pe
 
 tf.app.flags.DEFINE_integer("num_sample_rollout", 10, "Number of Multiple Oracles Used.") # default 10
 
+tf.app.flags.DEFINE_boolean("online_rl", False, "Train on rollouts sampled from the policy and rewarded online, instead of pre-estimated oracles.")
+
+tf.app.flags.DEFINE_integer("reward_staleness", 1, "Online RL: number of training steps the reward computation of a batch may lag behind (0: synchronous).")
+
+tf.app.flags.DEFINE_integer("reward_workers", 0, "Number of ROUGE reward worker processes (0: one per CPU).")
+
+tf.app.flags.DEFINE_integer("reward_cache_memory_mb", 256, "Memory budget (MB) of the in-memory ROUGE reward cache, backed by train_dir/reward-cache.sqlite.")
+
 ### Training features
 
 tf.app.flags.DEFINE_string("train_dir", "/address/to/training/directory", "Training directory.")
@@ -109,6 +119,18 @@ tf.app.flags.DEFINE_integer("batch_size", 20, "Batch size to use during training
 
 tf.app.flags.DEFINE_integer("training_checkpoint", 1, "How many training steps to do per checkpoint.")
 
+tf.app.flags.DEFINE_boolean("write_data_files", False, "Write a binary snapshot of every data split into train_dir.")
+
+tf.app.flags.DEFINE_integer("streaming_shard_size", 0, "Stream training data in shards of this many documents (0: load the whole split).")
+
+tf.app.flags.DEFINE_integer("shard_buffer_size", 8, "Number of streamed shards shuffled together.")
+
+tf.app.flags.DEFINE_integer("num_parse_workers", 4, "Number of processes used to parse large text input files.")
+
+tf.app.flags.DEFINE_integer("prefetch_threads", 2, "Number of background threads building batches (0: build batches in the main thread).")
+
+tf.app.flags.DEFINE_integer("prefetch_batches", 8, "Maximum number of batches built ahead of the training step.")
+
 ###### Input file addresses: No change needed
 
 # Pretrained wordembeddings data
@@ -117,11 +139,17 @@ tf.app.flags.DEFINE_string("pretrained_wordembedding",
                            "/address/data/1-billion-word-language-modeling-benchmark-r13output.word2vec.vec", 
                            "Pretrained wordembedding file trained on the one million benchmark data.")
 
+tf.app.flags.DEFINE_string("embedding_cache_directory", "", 
+                           "Directory for the binary cache of the pretrained wordembeddings (default: next to the wordembedding file).")
+
 # Data directory address
 
 tf.app.flags.DEFINE_string("preprocessed_data_directory", "/address/data/preprocessed-input-directory", 
                            "Pretrained news articles for various types of word embeddings.")
 
+tf.app.flags.DEFINE_string("compiled_data_directory", "", 
+                           "Directory of binary corpora written by '--exp_mode compile' (memory-mapped when present).")
+
 tf.app.flags.DEFINE_string("gold_summary_directory", 
                            "/address/data/Baseline-Gold-Models", 
                            "Gold summary directory.")
@@ -19,27 +19,60 @@ import tensorflow as tf
 import random
 import os
 import re
+import time
 import os.path
 
-from pyrouge import Rouge155
 import json
-from multiprocessing import Pool
-from contextlib import closing
+import sqlite3
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
 
 from my_flags import FLAGS
-
-def _rouge(system_dir, gold_dir):
-    # Run rouge
-    r = Rouge155()
-    r.system_dir = system_dir
-    r.model_dir = gold_dir
-    r.system_filename_pattern = '([a-zA-Z0-9]*).model'
-    r.model_filename_pattern = '#ID#.gold'
-    output = r.convert_and_evaluate(rouge_args="-e /usr/local/share/ROUGE-1.5.5/data -a -c 95 -m -n 4 -w 1.2")
-    # print output
-    output_dict = r.output_to_dict(output)
+from rouge_utils import read_summary, rouge_batch, rouge_directories, RewardScorer, ROUGE_METRICS
+
+# Tokenized gold summaries and document sentences kept per process
+SUMMARY_CACHE_SIZE = 20000
+
+# Rough size of one in-memory reward cache entry (key tuple, float, links)
+REWARD_CACHE_ENTRY_BYTES = 256
+
+# Pending rewards written to the reward cache store at once
+REWARD_CACHE_FLUSH_SIZE = 100000
+
+_summary_cache = OrderedDict()
+
+def _read_summary_cached(filename):
+    sents = _summary_cache.pop(filename, None)
+    if sents is None:
+        sents = read_summary(filename)
+        if len(_summary_cache) >= SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    _summary_cache[filename] = sents
+    return sents
+
+def _rouge(system_dir, gold_dir, num_workers=1, pool=None):
+    # Run rouge (in process, ROUGE-1.5.5 "-a -c 95 -m -n 4 -w 1.2" conventions), per-document scores saved next to system_dir
+    output_dict = rouge_directories(system_dir, gold_dir, num_workers=num_workers, scores_filename=system_dir.rstrip("/")+".rouge-scores.npz", pool=pool)
+    if not output_dict:
+        print("No summaries to evaluate in %s"%system_dir)
+        return 0.0
     # print output_dict
-    
+    for name in ["1", "2", "l"]:
+        print("ROUGE-%s F: %.5f (95%%-conf.int. %.5f - %.5f)"%(name.upper(), output_dict["rouge_%s_f_score"%name], output_dict["rouge_%s_f_score_cb"%name], output_dict["rouge_%s_f_score_ce"%name]))
+    return _average_rouge(output_dict)
+
+def get_gold_summary_directory(datatype):
+    # Gold Directory: Always use original files
+    return FLAGS.gold_summary_directory + "/gold-"+FLAGS.data_mode+"-"+datatype+"-orgcase"
+
+def get_full_rouge(system_dir, datatype, pool=None):
+    """Average of the ROUGE-1, ROUGE-2 and ROUGE-L F-scores of the summaries
+    in system_dir, evaluated in FLAGS.reward_workers processes (those of
+    pool when given).
+    """
+    return _rouge(system_dir, get_gold_summary_directory(datatype), FLAGS.reward_workers if FLAGS.reward_workers > 0 else cpu_count(), pool)
+
+def _average_rouge(output_dict):
     # avg_rscore = 0
     # if FLAGS.rouge_reward_fscore:
     #     avg_rscore = (output_dict["rouge_1_f_score"]+output_dict["rouge_2_f_score"]+
@@ -54,154 +87,212 @@ def _rouge(system_dir, gold_dir):
 
     return avg_rscore
                
-def _rouge_wrapper_traindata(docname, final_labels, final_labels_str):
-    # Gold Summary Directory : Always use original sentences
+def _rouge_wrapper_traindata(docname, final_labels_masks):
+    """Rewards of the candidates of one document, one per selected sentence bitmask.
+    """
+    # Gold Summary: Always use original sentences
     gold_summary_directory = FLAGS.gold_summary_directory + "/gold-"+FLAGS.data_mode+"-training-org"
-    gold_summary_fileaddress = gold_summary_directory + "/" + docname + ".gold"
+    gold_sents = _read_summary_cached(gold_summary_directory + "/" + docname + ".gold")
 
-    # Prepare Gold Model File
-    os.system("mkdir -p "+FLAGS.tmp_directory+"/gold-"+docname+"-"+final_labels_str)
-    os.system("cp "+gold_summary_fileaddress+" "+FLAGS.tmp_directory+"/gold-"+docname+"-"+final_labels_str+"/")
-    
     # Document Sentence: Always use original sentences to generate summaries
     doc_sent_fileaddress = FLAGS.doc_sentence_directory + "/" + FLAGS.data_mode + "/training-sent/"+docname+".summary.final.org_sents"
-    doc_sents = open(doc_sent_fileaddress).readlines()
+    doc_sents = _read_summary_cached(doc_sent_fileaddress)
+
+    # Selected sentences (bit i of a mask selects sentence i)
+    candidates = []
+    for final_labels_mask in final_labels_masks:
+        labels_ones = [idx for idx in range(min(len(doc_sents), FLAGS.max_doc_length)) if (final_labels_mask >> idx) & 1]
+        candidates.append([doc_sents[idx] for idx in labels_ones])
 
-    # Prepare Model file
-    os.system("mkdir -p "+FLAGS.tmp_directory+"/model-"+docname+"-"+final_labels_str)
-    
-    # Write selected sentences
-    labels_ones = [idx for idx in range(len(final_labels[:len(doc_sents)])) if final_labels[idx]=="1"]
-    model_highlights = [doc_sents[idx] for idx in labels_ones]
-    foutput = open(FLAGS.tmp_directory+"/model-"+docname+"-"+final_labels_str+"/"+docname+".model" , "w")
-    foutput.write("".join(model_highlights))
-    foutput.close()
+    return [_average_rouge(dict(zip(ROUGE_METRICS, scores))) for scores in rouge_batch(candidates, gold_sents).tolist()]
 
-    return _rouge(FLAGS.tmp_directory+"/model-"+docname+"-"+final_labels_str, FLAGS.tmp_directory+"/gold-"+docname+"-"+final_labels_str)
+# Training document names, set once in every reward worker
+_reward_docnames = None
+
+def _init_reward_worker(docnames):
+    global _reward_docnames
+    _reward_docnames = docnames
 
 def _multi_run_wrapper(args):
-    return _rouge_wrapper_traindata(*args)
-
-def _get_lcs(a, b):
-    lengths = [[0 for j in range(len(b)+1)] for i in range(len(a)+1)]
-    # row 0 and column 0 are initialized to 0 already
-    for i, x in enumerate(a):
-        for j, y in enumerate(b):
-            if x == y:
-                lengths[i+1][j+1] = lengths[i][j] + 1
-            else:
-                lengths[i+1][j+1] = max(lengths[i+1][j], lengths[i][j+1])
-    # read the substring out from the matrix
-    result = []
-    x, y = len(a), len(b)
-    while x != 0 and y != 0:
-        if lengths[x][y] == lengths[x-1][y]:
-            x -= 1
-        elif lengths[x][y] == lengths[x][y-1]:
-            y -= 1
-        else:
-            assert a[x-1] == b[y-1]
-            result = [a[x-1]] + result
-            x -= 1
-            y -= 1
-    return len(result)
-
-def _get_ngram_sets(highlights):
-    set_1gram = set()
-    set_2gram = set()
-    set_3gram = set()
-    set_4gram = set()
-    fullen = len(highlights)
-    for widx in range(fullen):
-        # 1gram
-        set_1gram.add(str(highlights[widx]))
-        # 2gram
-        if (widx+1) < fullen:
-            set_2gram.add(str(highlights[widx])+"-"+str(highlights[widx+1]))
-        # 3gram
-        if (widx+2) < fullen:
-            set_3gram.add(str(highlights[widx])+"-"+str(highlights[widx+1])+"-"+str(highlights[widx+2]))
-        # 4gram
-        if (widx+3) < fullen:
-            set_4gram.add(str(highlights[widx])+"-"+str(highlights[widx+1])+"-"+str(highlights[widx+2])+"-"+str(highlights[widx+3]))
-    return set_1gram, set_2gram, set_3gram, set_4gram
-        
-def _rouge_wrapper_traindata_nopyrouge(docname, final_labels_str, document, highlights):
-    cand_highlights_full = []
-    for sentidx in final_labels_str.split("-"):
-        cand_highlights_full += [wordid for wordid in document[int(sentidx)] if wordid != 0]
-        cand_highlights_full.append(0)
-    highlights_full = []
-    for sent in highlights:
-        highlights_full += sent
-        highlights_full.append(0)
-    # print(cand_highlights_full,highlights_full)
-       
-    # Get sets
-    cand_1gram, cand_2gram, cand_3gram, cand_4gram = _get_ngram_sets(cand_highlights_full)
-    # print(cand_1gram, cand_2gram, cand_3gram, cand_4gram)
-    gold_1gram, gold_2gram, gold_3gram, gold_4gram = _get_ngram_sets(highlights_full)
-    # print(gold_1gram, gold_2gram, gold_3gram, gold_4gram)
-    
-    # Get ROUGE-N recalls
-    rouge_recall_1 = 0
-    if len(gold_1gram) != 0:
-        rouge_recall_1 = float(len(gold_1gram.intersection(cand_1gram)))/float(len(gold_1gram))
-    rouge_recall_2 = 0
-    if len(gold_2gram) != 0:
-        rouge_recall_2 = float(len(gold_2gram.intersection(cand_2gram)))/float(len(gold_2gram))
-    rouge_recall_3 = 0
-    if len(gold_3gram) != 0:
-        rouge_recall_3 = float(len(gold_3gram.intersection(cand_3gram)))/float(len(gold_3gram))
-    rouge_recall_4 = 0
-    if len(gold_4gram) != 0:
-        rouge_recall_4 = float(len(gold_4gram.intersection(cand_4gram)))/float(len(gold_4gram))
-    
-    # Get ROUGE-L
-    len_lcs = _get_lcs(cand_highlights_full, highlights_full)
-    r = 0 if (len_lcs == 0) else (float(len_lcs)/len(cand_highlights_full))
-    p = 0 if (len_lcs == 0) else (float(len_lcs)/len(highlights_full))
-    b = 0 if (r == 0) else (p / r)
-    rouge_recall_l = 0 if (len_lcs == 0) else (((1+(b*b))*r*p)/(r+(b*b*p)))
-    
-    rouge_recall_average = (rouge_recall_1+rouge_recall_2+rouge_recall_3+rouge_recall_4+rouge_recall_l)/5.0
-    # print(rouge_recall_1, rouge_recall_2, rouge_recall_3, rouge_recall_4, rouge_recall_l, rouge_recall_average)
-    
-    # Get final labels
-    final_labels = [[1, 0] if (str(sentidx) in final_labels_str.split("-")) else [0, 1] for sentidx in range(FLAGS.max_doc_length)]  # [max_doc_length, target_label_size]
-    
-    return rouge_recall_average, final_labels
-    
+    # args: (document index in _reward_docnames or docname, final_labels_masks)
+    doc, final_labels_masks = args
+    docname = _reward_docnames[doc] if isinstance(doc, int) else doc
+    return _rouge_wrapper_traindata(docname, final_labels_masks)
+
+def _rouge_wrapper_traindata_nopyrouge(docname, final_labels_str_list, document, highlights):
+    """Scores all candidate label strings ("sentidx-sentidx-...") of one
+    document. Returns a list of (rouge_recall_average, final_labels).
+    """
+    # Sentence n-grams and gold sets, shared by all candidates
+    scorer = RewardScorer(np.asarray(document).tolist(), highlights)
+
+    candidates = [[int(sentidx) for sentidx in final_labels_str.split("-")] for final_labels_str in final_labels_str_list]
+
+    results = []
+    for sentindices, rouge_recall_average in zip(candidates, scorer.score_batch(candidates).tolist()):
+        # Get final labels
+        final_labels = [[1, 0] if (sentidx in sentindices) else [0, 1] for sentidx in range(FLAGS.max_doc_length)]  # [max_doc_length, target_label_size]
+
+        results.append((rouge_recall_average, final_labels))
+    return results
+
 def _multi_run_wrapper_nopyrouge(args):
     return _rouge_wrapper_traindata_nopyrouge(*args)
 
+class Reward_Cache:
+    """Rewards keyed by (document id, candidate bitmask), where bit i of the
+    mask marks sentence i as selected. The most recently used entries are
+    kept in memory; all entries are appended to an sqlite store so that
+    saving only writes what is new.
+    """
+    def __init__(self, filename, max_entries, import_filename=None):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.import_filename = import_filename
+        self.connection = None
+        self.entries = OrderedDict()
+        self.doc_ids = {}
+        self.pending_docs = []
+        self.pending_rewards = []
+        self.reset_stats()
+
+    def open(self):
+        if self.connection is not None:
+            return
+        isnew = not os.path.isfile(self.filename)
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS documents (doc_id INTEGER PRIMARY KEY, docname TEXT UNIQUE)")
+        # Masks can be wider than 64 bits, they are stored as hex strings
+        self.connection.execute("CREATE TABLE IF NOT EXISTS rewards (doc_id INTEGER, mask TEXT, score REAL, PRIMARY KEY (doc_id, mask))")
+        self.doc_ids = dict((docname, doc_id) for doc_id, docname in self.connection.execute("SELECT doc_id, docname FROM documents"))
+        if isnew and self.import_filename is not None and os.path.isfile(self.import_filename):
+            self.import_rouge_dict(self.import_filename)
+
+    def import_rouge_dict(self, filename):
+        # Old json dictionary: docname -> {"1-5-7": score} (1-based sentence indices)
+        print("Importing %s into %s"%(filename, self.filename))
+        with open(filename) as data_file:
+            rouge_dict = json.load(data_file)
+        for docname in rouge_dict:
+            for final_labels_string, rougescore in rouge_dict[docname].items():
+                mask = 0
+                for sentidx in final_labels_string.split("-"):
+                    if sentidx:
+                        mask |= 1 << (int(sentidx)-1)
+                self.put(docname, mask, rougescore)
+        self.flush()
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def reset_stats(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_doc_id(self, docname):
+        doc_id = self.doc_ids.get(docname)
+        if doc_id is None:
+            doc_id = len(self.doc_ids)
+            self.doc_ids[docname] = doc_id
+            self.pending_docs.append((doc_id, docname))
+        return doc_id
+
+    def get(self, docname, mask):
+        """Cached reward or None.
+        """
+        doc_id = self.doc_ids.get(docname)
+        if doc_id is not None:
+            key = (doc_id, mask)
+            rougescore = self.entries.pop(key, None)
+            if rougescore is not None:
+                self.entries[key] = rougescore
+                self.hits += 1
+                return rougescore
+            row = self.connection.execute("SELECT score FROM rewards WHERE doc_id=? AND mask=?", (doc_id, "%x"%mask)).fetchone()
+            if row is not None:
+                self._remember(key, row[0])
+                self.disk_hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def put(self, docname, mask, rougescore):
+        doc_id = self.get_doc_id(docname)
+        self._remember((doc_id, mask), rougescore)
+        self.pending_rewards.append((doc_id, "%x"%mask, rougescore))
+        if len(self.pending_rewards) >= REWARD_CACHE_FLUSH_SIZE:
+            self.flush()
+
+    def _remember(self, key, rougescore):
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.max_entries:
+            self.entries.popitem(last=False)
+        self.entries[key] = rougescore
+
+    def flush(self):
+        """Appends the rewards computed since the last flush to the store.
+        """
+        if self.pending_docs:
+            self.connection.executemany("INSERT OR IGNORE INTO documents (doc_id, docname) VALUES (?, ?)", self.pending_docs)
+            self.pending_docs = []
+        if self.pending_rewards:
+            self.connection.executemany("INSERT OR REPLACE INTO rewards (doc_id, mask, score) VALUES (?, ?, ?)", self.pending_rewards)
+            self.pending_rewards = []
+        self.connection.commit()
+
+    def stats_string(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        hit_rate = 100.0 * (self.hits + self.disk_hits) / lookups if lookups else 0.0
+        return "%d lookups, %d memory hits, %d disk hits, %d misses (hit rate %.2f%%), %d entries in memory"%(lookups, self.hits, self.disk_hits, self.misses, hit_rate, len(self.entries))
+
 class Reward_Generator:
-    def __init__(self):
-        self.rouge_dict = {}
+    def __init__(self, docnames=None):
+        """docnames: training document names, shared once with the reward
+        workers so that tasks only carry a document index and a candidate.
+        """
+        self.rouge_cache = Reward_Cache(FLAGS.train_dir+"/reward-cache.sqlite", max(1, FLAGS.reward_cache_memory_mb * 2**20 // REWARD_CACHE_ENTRY_BYTES),
+                                        import_filename=FLAGS.train_dir+"/rouge-dict.json")
         
-        # Start a pool
-        self.pool = Pool(10)
+        # Pool kept for the whole training, started by the first batch that needs it
+        self.docnames = docnames
+        self.docindices = {}
+        if docnames is not None:
+            self.docindices = dict((docname, docindex) for docindex, docname in enumerate(docnames))
+        self.num_workers = FLAGS.reward_workers if FLAGS.reward_workers > 0 else cpu_count()
+        self.pool = None
+
+        # Time spent waiting for the pool in collect_batch_rouge and candidates scored, per epoch
+        self.wait_time = 0.0
+        self.scored_count = 0
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = Pool(self.num_workers, initializer=_init_reward_worker, initargs=(self.docnames,))
+        return self.pool
+
+    def get_chunksize(self, task_count):
+        return max(1, task_count // (4*self.num_workers))
 
     def save_rouge_dict(self):
-        with open(FLAGS.train_dir+"/rouge-dict.json", 'w') as outfile:
-            json.dump(self.rouge_dict, outfile)
+        # Append new rewards to the store and report the cache usage of this epoch
+        self.rouge_cache.open()
+        self.rouge_cache.flush()
+        print("Reward cache: "+self.rouge_cache.stats_string())
+        self.rouge_cache.reset_stats()
             
     def restore_rouge_dict(self):
-        self.rouge_dict = {}
-        if os.path.isfile(FLAGS.train_dir+"/rouge-dict.json"):
-            with open(FLAGS.train_dir+"/rouge-dict.json") as data_file: 
-                self.rouge_dict = json.load(data_file)
+        self.rouge_cache.open()
+        self.rouge_cache.reset_stats()
+        self.wait_time = 0.0
+        self.scored_count = 0
 
     def get_full_rouge(self, system_dir, datatype):
-        # Gold Directory: Always use original files
-        gold_summary_directory = FLAGS.gold_summary_directory + "/gold-"+FLAGS.data_mode+"-"+datatype+"-orgcase"
-
-        rouge_score = _rouge(system_dir, gold_summary_directory)
-
-        # Delete any tmp file
-        os.system("rm -r "+FLAGS.tmp_directory+"/tmp*")
-
-        return rouge_score
+        # Scored by the reward workers, idle between epochs
+        return get_full_rouge(system_dir, datatype, self.get_pool())
         
     # def get_batch_rouge(self, batch_docnames, batch_predicted_labels):
         
@@ -270,15 +361,43 @@ class Reward_Generator:
         rougescore: [batch_size, FLAGS.num_sample_rollout]
         """
         
+        # Batch Size and sample rollout count
+        batch_size = len(batch_docnames)
+        rollout_count = batch_predicted_labels_multisample.shape[1]
+
+        # Prepare final labels for summary generation: bit sentidx is set if the sentence is selected
+        batch_labels_mask_multisample = []
+        for docindex in range(batch_size):
+            labels_masks = []
+            for rolloutidx in range(rollout_count):
+                predicted_labels = batch_predicted_labels_multisample[docindex][rolloutidx] # [FLAGS.max_doc_length, FLAGS.target_label_size]
+                final_labels_mask = 0
+                for sentidx in range(FLAGS.max_doc_length):
+                    if int(predicted_labels[sentidx][0]) == 1:
+                        final_labels_mask |= 1 << sentidx
+                labels_masks.append(final_labels_mask)
+            batch_labels_mask_multisample.append(labels_masks)
+
+        return self.collect_batch_rouge(self.submit_batch_rouge(batch_docnames, batch_labels_mask_multisample))
+
+    def submit_batch_rouge(self, batch_docnames, batch_labels_mask_multisample):
+        """Starts scoring a batch of candidates in the reward pool and returns
+        at once; collect_batch_rouge waits for the rewards.
+        Args:
+        batch_docnames: [batch_size]
+        batch_labels_mask_multisample: [batch_size, rollout_count] selected sentence bitmasks
+        """
+        
         # Numpy dtype
         dtype = np.float16 if FLAGS.use_fp16 else np.float32
         
         # Batch Size and sample rollout count
         batch_size = len(batch_docnames)
-        rollout_count = batch_predicted_labels_multisample.shape[1]
+        rollout_count = len(batch_labels_mask_multisample[0]) if batch_size > 0 else 0
 
         # batch_rouge
         batch_rouge_multisample = np.empty((batch_size, rollout_count), dtype=dtype)
+        self.rouge_cache.open()
         
         # Prepare of all rollout labels dict and prepare docname_labels_list to run
         docname_labels_rollout_dict = {}
@@ -288,67 +407,65 @@ class Reward_Generator:
             # print(docname)
 
             for rolloutidx in range(rollout_count):
-                predicted_labels = batch_predicted_labels_multisample[docindex][rolloutidx] # [FLAGS.max_doc_length, FLAGS.target_label_size]
-                # Prepare final labels for summary generation
-                final_labels = []
-                final_labels_sindices = []
-                for sentidx in range(FLAGS.max_doc_length):
-                    final_labels.append(str(int(predicted_labels[sentidx][0])))
-                    if int(predicted_labels[sentidx][0]) == 1:
-                        final_labels_sindices.append(str(sentidx+1))
-                final_labels_string = "-".join(final_labels_sindices)
-                    
-                # print(final_labels,final_labels_string)
+                final_labels_mask = batch_labels_mask_multisample[docindex][rolloutidx]
+                # print(final_labels_mask)
                 
-                isfound = False
-                rougescore = 0.0
-                if docname in self.rouge_dict:
-                    if final_labels_string in self.rouge_dict[docname]:
-                        rougescore = self.rouge_dict[docname][final_labels_string]
-                        isfound = True
-
-                if isfound:
+                rougescore = self.rouge_cache.get(docname, final_labels_mask)
+
+                if rougescore is not None:
                     # Update batch_rouge
                     batch_rouge_multisample[docindex][rolloutidx] = rougescore
                 else:
                     if docname not in docname_labels_rollout_dict:
-                        docname_labels_rollout_dict[docname] = [docindex, {final_labels_string:[rolloutidx]}]
-                        docname_labels_list.append((docname, final_labels, final_labels_string))
+                        docname_labels_rollout_dict[docname] = [docindex, {final_labels_mask:[rolloutidx]}]
+                        docname_labels_list.append((docname, final_labels_mask))
                     else:
-                        if final_labels_string not in docname_labels_rollout_dict[docname][1]:
-                            docname_labels_rollout_dict[docname][1][final_labels_string] = [rolloutidx]
-                            docname_labels_list.append((docname, final_labels, final_labels_string))
+                        if final_labels_mask not in docname_labels_rollout_dict[docname][1]:
+                            docname_labels_rollout_dict[docname][1][final_labels_mask] = [rolloutidx]
+                            docname_labels_list.append((docname, final_labels_mask))
                         else:
-                            docname_labels_rollout_dict[docname][1][final_labels_string].append(rolloutidx)
+                            docname_labels_rollout_dict[docname][1][final_labels_mask].append(rolloutidx)
                             # no need to add to docname_labels_list
                     
         # print(docname_labels_list)
         # Run parallel pool
+        async_result = None
         if(len(docname_labels_list) > 0):
-            # Run in parallel
-            with closing(Pool(10)) as mypool:
-                rougescore_list = mypool.map(_multi_run_wrapper,docname_labels_list)            
-            # rougescore_list = self.pool.map(_multi_run_wrapper,docname_labels_list)
+            # One task per document scores all its candidates against the gold summary at once
+            docname_masks = OrderedDict()
+            for docname, final_labels_mask in docname_labels_list:
+                docname_masks.setdefault(docname, []).append(final_labels_mask)
+            docname_labels_list = [(docname, final_labels_mask) for docname, masks in docname_masks.items() for final_labels_mask in masks]
+
+            # Run in parallel, documents known to the workers are sent as indices
+            tasks = [(self.docindices.get(docname, docname), masks) for docname, masks in docname_masks.items()]
+            async_result = self.get_pool().map_async(_multi_run_wrapper, tasks, self.get_chunksize(len(tasks)))
+
+        return batch_rouge_multisample, docname_labels_rollout_dict, docname_labels_list, async_result
+
+    def collect_batch_rouge(self, submitted):
+        """Rewards of a batch started with submit_batch_rouge: [batch_size, rollout_count]
+        """
+        batch_rouge_multisample, docname_labels_rollout_dict, docname_labels_list, async_result = submitted
+        if async_result is not None:
+            start_time = time.time()
+            doc_rougescores_list = async_result.get()
+            self.wait_time += time.time() - start_time
+            rougescore_list = [rougescore for doc_rougescores in doc_rougescores_list for rougescore in doc_rougescores]
+            self.scored_count += len(rougescore_list)
 
             # Process results
             for rougescore, docname_labels in zip(rougescore_list, docname_labels_list):
                 docname = docname_labels[0]
-                final_labels = docname_labels[1]
-                final_labels_string = docname_labels[2]
+                final_labels_mask = docname_labels[1]
                 
                 # Update batch_rouge
                 docindex = docname_labels_rollout_dict[docname][0]
-                for rolloutidx in docname_labels_rollout_dict[docname][1][final_labels_string]:
+                for rolloutidx in docname_labels_rollout_dict[docname][1][final_labels_mask]:
                     batch_rouge_multisample[docindex][rolloutidx] = rougescore
 
-                # Update rouge dict
-                if docname not in self.rouge_dict:
-                    self.rouge_dict[docname] = {final_labels_string:rougescore}
-                else:
-                    self.rouge_dict[docname][final_labels_string] = rougescore
-            # Delete any tmp file
-            os.system("rm -r "+ FLAGS.tmp_directory+"/tmp* " + FLAGS.tmp_directory+"/gold-* " + FLAGS.tmp_directory+"/model-*")
-        # print(self.rouge_dict)
+                # Update rouge cache
+                self.rouge_cache.put(docname, final_labels_mask, rougescore)
         
         return batch_rouge_multisample
         
@@ -376,7 +493,7 @@ class Reward_Generator:
         batch_rouge_multisample = np.empty((batch_size, rollout_count), dtype=dtype)
         batch_gold_sampled_label_multisample = np.empty((batch_size, rollout_count, FLAGS.max_doc_length, FLAGS.target_label_size), dtype=dtype) 
         
-        # Prepare of all rollout labels dict and prepare docname_labels_list to run
+        # Prepare of all rollout labels dict and prepare docname_labels_list to run (one entry per document)
         docname_labels_rollout_dict = {}
         docname_labels_list = []
         for docindex in range(batch_size):
@@ -390,12 +507,12 @@ class Reward_Generator:
                 # print(final_labels_string)
                 
                 if docname not in docname_labels_rollout_dict:
-                    docname_labels_rollout_dict[docname] = [docindex, {final_labels_string:[rolloutidx]}]
-                    docname_labels_list.append((docname, final_labels_string, document, highlights))
+                    docname_labels_rollout_dict[docname] = [docindex, {final_labels_string:[rolloutidx]}, len(docname_labels_list)]
+                    docname_labels_list.append((docname, [final_labels_string], document, highlights))
                 else:
                     if final_labels_string not in docname_labels_rollout_dict[docname][1]:
                         docname_labels_rollout_dict[docname][1][final_labels_string] = [rolloutidx]
-                        docname_labels_list.append((docname, final_labels_string, document, highlights))
+                        docname_labels_list[docname_labels_rollout_dict[docname][2]][1].append(final_labels_string)
                     else:
                         docname_labels_rollout_dict[docname][1][final_labels_string].append(rolloutidx)
                         # no need to add to docname_labels_list
@@ -430,20 +547,25 @@ class Reward_Generator:
             # Run in parallel
             # with closing(Pool(10)) as mypool:
             #     rougescore_finallabels_list = mypool.map(_multi_run_wrapper_nopyrouge,docname_labels_list)
-            rougescore_finallabels_list = self.pool.map(_multi_run_wrapper_nopyrouge,docname_labels_list)
+            # Only the document rows used by the candidates are sent to the workers
+            tasks = []
+            for docname, final_labels_str_list, document, highlights in docname_labels_list:
+                rowcount = max(int(sentidx) for final_labels_str in final_labels_str_list for sentidx in final_labels_str.split("-")) + 1
+                tasks.append((docname, final_labels_str_list, document[:rowcount], highlights))
+            rougescore_finallabels_list = self.get_pool().imap(_multi_run_wrapper_nopyrouge, tasks, self.get_chunksize(len(tasks)))
 
             # Process results
-            for rougescore_finallabels, docname_labels in zip(rougescore_finallabels_list, docname_labels_list):
-                rougescore = rougescore_finallabels[0]
-                finallabels = rougescore_finallabels[1]
+            for doc_rougescore_finallabels, docname_labels in zip(rougescore_finallabels_list, docname_labels_list):
                 docname = docname_labels[0]
-                final_labels_string = docname_labels[1]
-                
-                # Update batch_rouge
                 docindex = docname_labels_rollout_dict[docname][0]
-                for rolloutidx in docname_labels_rollout_dict[docname][1][final_labels_string]:
-                    batch_rouge_multisample[docindex][rolloutidx] = rougescore
-                    batch_gold_sampled_label_multisample[docindex][rolloutidx] = np.array(finallabels[:], dtype=dtype)  
+                for rougescore_finallabels, final_labels_string in zip(doc_rougescore_finallabels, docname_labels[1]):
+                    rougescore = rougescore_finallabels[0]
+                    finallabels = rougescore_finallabels[1]
+                
+                    # Update batch_rouge
+                    for rolloutidx in docname_labels_rollout_dict[docname][1][final_labels_string]:
+                        batch_rouge_multisample[docindex][rolloutidx] = rougescore
+                        batch_gold_sampled_label_multisample[docindex][rolloutidx] = np.array(finallabels[:], dtype=dtype)  
 
                 # # Update rouge dict
                 # if docname not in self.rouge_dict:
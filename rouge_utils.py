@@ -0,0 +1,757 @@
+####################################
+# Project: Document Summarization
+# Comments: In-process ROUGE scoring
+####################################
+
+"""
+ROUGE-N and summary-level ROUGE-L computed in memory, following the
+conventions of ROUGE-1.5.5 as it was run through pyrouge in this project
+("-a -c 95 -m -n 4 -w 1.2"): lowercased alphanumeric tokens, WordNet
+exceptions then Porter stemming of tokens longer than three characters, n-grams over the whole
+summary, union LCS per reference sentence, F with alpha 0.5 and scores
+macro-averaged over documents. rouge_batch scores many candidates, given
+as strings or token ids, against one reference.
+
+RewardScorer and OracleScorer score many candidate summaries built from the
+sentences of one document, for the training reward and the oracle
+estimator respectively. oracle_rouge_n and oracle_rouge_l_summary_level
+replace scripts/oracle-estimator/rouge.py.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import heapq
+import io
+import os
+import re
+from collections import Counter
+from contextlib import closing
+from multiprocessing import Pool
+
+import numpy as np
+from nltk.stem.porter import PorterStemmer
+
+# ROUGE-N orders reported, as with "-n 4"
+ROUGE_ORDERS = (1, 2, 3, 4)
+
+# Weight of precision in the F-measure, ROUGE-1.5.5 default ("-p 0.5")
+ROUGE_ALPHA = 0.5
+
+def metric_names(orders=ROUGE_ORDERS):
+    """Score names of ROUGE-N for every order and of ROUGE-L, keyed like
+    pyrouge's output_to_dict.
+    """
+    return tuple("rouge_%s_%s"%(name, measure) for name in [str(n) for n in orders]+["l"]
+                 for measure in ("recall", "precision", "f_score"))
+
+# Per-document scores, in the column order of the score files
+ROUGE_METRICS = metric_names(ROUGE_ORDERS)
+
+# Bootstrap resamples for confidence intervals, as ROUGE-1.5.5
+BOOTSTRAP_SAMPLES = 1000
+
+# Added to search bounds so that float rounding never prunes a candidate
+BOUND_SLACK = 1e-9
+
+# ROUGE-1.5.5 splits hyphens into tokens of their own and then drops every
+# token that does not start with a letter or a digit
+_NON_TOKEN_CHARS = re.compile(r"[^a-z0-9]")
+
+WORDNET_EXCEPTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "wordnet-2.0-exceptions.txt")
+
+def _read_wordnet_exceptions(filename):
+    exceptions = {}
+    with io.open(filename, encoding="utf-8") as exceptions_file:
+        for line in exceptions_file:
+            if not line.startswith("#"):
+                form, base = line.split()
+                exceptions[form] = base
+    return exceptions
+
+_stemmer = PorterStemmer(mode=PorterStemmer.ORIGINAL_ALGORITHM)
+# Irregular forms are looked up before Porter stemming, as in ROUGE-1.5.5's MorphStem
+_stem_cache = _read_wordnet_exceptions(WORDNET_EXCEPTIONS_FILE)
+
+def _stem(token):
+    if len(token) <= 3:
+        return token
+    stemmed = _stem_cache.get(token)
+    if stemmed is None:
+        stemmed = _stemmer.stem(token)
+        _stem_cache[token] = stemmed
+    return stemmed
+
+def tokenize(text, stem=True):
+    """ROUGE-1.5.5 tokenization of one sentence.
+    """
+    tokens = _NON_TOKEN_CHARS.sub(" ", text.lower()).split()
+    if stem:
+        tokens = [_stem(token) for token in tokens]
+    return tokens
+
+def read_summary(filename, stem=True):
+    """Tokenized sentences of a summary file, one sentence per line (blank
+    lines give empty sentences).
+    """
+    with io.open(filename, encoding="utf-8", errors="ignore") as summary_file:
+        return [tokenize(line, stem) for line in summary_file]
+
+def _f_score(precision, recall, alpha=ROUGE_ALPHA):
+    if precision == 0 or recall == 0:
+        return 0.0
+    return (precision * recall) / ((1 - alpha) * precision + alpha * recall)
+
+def _measures(hit, peer_count, model_count):
+    # (recall, precision, f_score), the column order of metric_names
+    precision = hit / peer_count if peer_count > 0 else 0.0
+    recall = hit / model_count if model_count > 0 else 0.0
+    return recall, precision, _f_score(precision, recall)
+
+def ngram_counts(tokens, n):
+    return Counter(tuple(tokens[idx:idx+n]) for idx in range(len(tokens)-n+1))
+
+def _clipped_hits(peer_tokens, model_grams, n):
+    peer_grams = ngram_counts(peer_tokens, n)
+    return sum(min(count, peer_grams[gram]) for gram, count in model_grams.items() if gram in peer_grams)
+
+def rouge_n_hits(peer_tokens, model_tokens, n):
+    """Clipped n-gram overlap of two token lists, with the n-gram totals of
+    both sides: (hit, peer_count, model_count).
+    """
+    hit = _clipped_hits(peer_tokens, ngram_counts(model_tokens, n), n)
+    return hit, max(len(peer_tokens)-n+1, 0), max(len(model_tokens)-n+1, 0)
+
+def lcs_match_masks(b):
+    """Bit masks of the positions of every token of b, for lcs_length and
+    lcs_positions.
+    """
+    match_masks = {}
+    for j, y in enumerate(b):
+        match_masks[y] = match_masks.get(y, 0) | (1 << j)
+    return match_masks
+
+def lcs_length(a, b, match_masks=None):
+    """Length of the longest common subsequence, bit-parallel over b
+    (Allison-Dix/Hyyro): bit j of v is cleared when b[j] ends a match.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return 0
+    if match_masks is None:
+        match_masks = lcs_match_masks(b)
+    full = (1 << len(b)) - 1
+    v = full
+    for x in a:
+        m = match_masks.get(x)
+        if m:
+            u = v & m
+            v = ((v + u) | (v - u)) & full
+    return len(b) - bin(v).count("1")
+
+def _lcs_rows(a, b, match_masks):
+    # Bit-parallel rows of the LCS table of a and b (see lcs_length)
+    full = (1 << len(b)) - 1
+    v = full
+    rows = [v]
+    for x in a:
+        m = match_masks.get(x)
+        if m:
+            u = v & m
+            v = ((v + u) | (v - u)) & full
+        rows.append(v)
+    return rows
+
+def lcs_positions(model, peer, match_masks=None, ties_up=True):
+    """Positions in model of one longest common subsequence with peer, read
+    back iteratively from the bit-parallel rows of the LCS table: the LCS of
+    model[:i] and peer[:j] is j minus the set bits among the low j bits of
+    row i. When skipping a token of either side keeps the LCS, ROUGE-1.5.5
+    skips the model token (ties_up); rouge.py skips the peer token.
+    """
+    if len(model) == 0 or len(peer) == 0:
+        return []
+    if match_masks is None:
+        match_masks = lcs_match_masks(peer)
+    rows = _lcs_rows(model, peer, match_masks)
+    i, j = len(model), len(peer)
+    length = j - bin(rows[i]).count("1")
+    positions = []
+    while length > 0:
+        if model[i-1] == peer[j-1]:
+            positions.append(i-1)
+            i -= 1
+            j -= 1
+            length -= 1
+        elif ties_up:
+            if j - bin(rows[i-1] & ((1 << j) - 1)).count("1") == length:
+                i -= 1
+            else:
+                j -= 1
+        else:
+            if j - 1 - bin(rows[i] & ((1 << (j-1)) - 1)).count("1") == length:
+                j -= 1
+            else:
+                i -= 1
+    positions.reverse()
+    return positions
+
+def rouge_l_hits(peer_sents, model_sents, lcs_cache=None):
+    """Summary-level union LCS hits: (hit, peer_count, model_count).
+    lcs_cache keeps the LCS positions of peer sentences met before, for
+    scoring several peers against the same model sentences.
+    """
+    peer_counts = Counter(token for sent in peer_sents for token in sent)
+    model_counts = Counter(token for sent in model_sents for token in sent)
+    peer_count = sum(peer_counts.values())
+    model_count = sum(model_counts.values())
+    hit = 0
+    for modelidx, model_sent in enumerate(model_sents):
+        union = set()
+        for peer_sent in peer_sents:
+            if lcs_cache is None:
+                union.update(lcs_positions(model_sent, peer_sent))
+                continue
+            key = (modelidx, tuple(peer_sent))
+            positions = lcs_cache.get(key)
+            if positions is None:
+                positions = lcs_positions(model_sent, peer_sent)
+                lcs_cache[key] = positions
+            union.update(positions)
+        for position in sorted(union):
+            token = model_sent[position]
+            if model_counts[token] > 0 and peer_counts[token] > 0:
+                hit += 1
+                model_counts[token] -= 1
+                peer_counts[token] -= 1
+    return hit, peer_count, model_count
+
+def _tokenized(sents, stem):
+    # Strings are tokenized, token lists (words or ids) are used as they are
+    return [tokenize(sent, stem) if isinstance(sent, (str, type(u""))) else list(sent) for sent in sents]
+
+def rouge_batch(candidates, reference, orders=ROUGE_ORDERS, stem=True):
+    """ROUGE scores of many candidate summaries against one reference.
+    Summaries are lists of sentences, each a string (see tokenize) or a list
+    of tokens or token ids. The reference n-grams, and the LCS of every
+    distinct candidate sentence with each reference sentence, are computed
+    once for the batch. Returns a [candidates, len(metric_names(orders))]
+    array.
+    """
+    model_sents = _tokenized(reference, stem)
+    model_tokens = [token for sent in model_sents for token in sent]
+    model_grams = dict((n, ngram_counts(model_tokens, n)) for n in orders)
+    lcs_cache = {}
+    scores = np.empty((len(candidates), len(metric_names(orders))))
+    for candidx, candidate in enumerate(candidates):
+        peer_sents = _tokenized(candidate, stem)
+        peer_tokens = [token for sent in peer_sents for token in sent]
+        row = []
+        for n in orders:
+            hit = _clipped_hits(peer_tokens, model_grams[n], n)
+            row.extend(_measures(hit, max(len(peer_tokens)-n+1, 0), max(len(model_tokens)-n+1, 0)))
+        row.extend(_measures(*rouge_l_hits(peer_sents, model_sents, lcs_cache)))
+        scores[candidx] = row
+    return scores
+
+def summary_scores(peer_sents, model_sents, orders=ROUGE_ORDERS):
+    """ROUGE scores of one summary against one reference, keyed like
+    pyrouge's output_to_dict (rouge_1_f_score, rouge_l_recall, ...).
+    """
+    return dict(zip(metric_names(orders), rouge_batch([peer_sents], model_sents, orders)[0].tolist()))
+
+def _reported_scores(scores):
+    """Scores of one document as ROUGE-1.5.5 keeps them: recall and precision
+    rounded to five decimals, then F of the rounded values, rounded too.
+    """
+    reported = []
+    for recall, precision, _ in zip(scores[0::3], scores[1::3], scores[2::3]):
+        recall, precision = float("%.5f" % recall), float("%.5f" % precision)
+        reported += [recall, precision, float("%.5f" % _f_score(precision, recall))]
+    return reported
+
+def _score_documents(args):
+    system_dir, gold_dir, docids, system_suffix, gold_suffix, stem = args
+    scores = np.empty((len(docids), len(ROUGE_METRICS)))
+    for docindex, docid in enumerate(docids):
+        peer_sents = read_summary(os.path.join(system_dir, docid+system_suffix), stem)
+        model_sents = read_summary(os.path.join(gold_dir, docid+gold_suffix), stem)
+        scores[docindex] = _reported_scores(rouge_batch([peer_sents], model_sents)[0])
+    return scores
+
+def document_scores(system_dir, gold_dir, system_suffix=".model", gold_suffix=".gold", stem=True, num_workers=1, pool=None):
+    """ROUGE of every <id>.model summary in system_dir against <id>.gold in
+    gold_dir, sharded over num_workers processes: those of pool when given
+    (e.g. the reward pool of the training), else a pool started for the
+    call. Returns the ids and a [documents, len(ROUGE_METRICS)] score array.
+    """
+    docids = sorted(filename[:-len(system_suffix)] for filename in os.listdir(system_dir) if filename.endswith(system_suffix))
+    shard_count = min(len(docids), 4*num_workers) if num_workers > 1 else 1
+    shards = [(system_dir, gold_dir, docids[shardidx*len(docids)//shard_count:(shardidx+1)*len(docids)//shard_count], system_suffix, gold_suffix, stem)
+              for shardidx in range(shard_count)]
+    if shard_count > 1 and pool is not None:
+        shard_scores = pool.map(_score_documents, shards)
+    elif shard_count > 1:
+        with closing(Pool(num_workers)) as pool:
+            shard_scores = pool.map(_score_documents, shards)
+    else:
+        shard_scores = [_score_documents(shard) for shard in shards]
+    return docids, np.concatenate(shard_scores) if shard_scores else np.empty((0, len(ROUGE_METRICS)))
+
+def write_document_scores(filename, docids, scores):
+    """Per-document scores in one compressed numpy archive.
+    """
+    with open(filename, "wb") as score_file:
+        np.savez_compressed(score_file, docids=np.array(docids, dtype="U"), metrics=np.array(ROUGE_METRICS, dtype="U"), scores=scores.astype(np.float32))
+
+def read_document_scores(filename):
+    """(docids, metrics, scores) written by write_document_scores.
+    """
+    with np.load(filename) as archive:
+        return archive["docids"].tolist(), archive["metrics"].tolist(), archive["scores"].astype(np.float64)
+
+# drand48, the generator behind Perl's srand and rand (Perl 5.20 and later)
+_DRAND48_MULTIPLIER = np.uint64(0x5DEECE66D)
+_DRAND48_INCREMENT = np.uint64(0xB)
+_DRAND48_MASK = np.uint64((1 << 48) - 1)
+
+def bootstrap_resamples(scores, num_samples=BOOTSTRAP_SAMPLES):
+    """Means of every score column over the bootstrap resamples of
+    ROUGE-1.5.5: resample i is drawn after srand(i), with
+    int(rand(doccount)) indexing the documents sorted by their 1-based
+    evaluation id as strings.
+    """
+    doccount = scores.shape[0]
+    instances = scores[sorted(range(doccount), key=lambda docidx: str(docidx+1))]
+    states = (np.arange(num_samples, dtype=np.uint64) << np.uint64(16)) | np.uint64(0x330E)
+    sums = np.zeros((num_samples, scores.shape[1]))
+    for _ in range(doccount):
+        # uint64 products wrap modulo 2**64, a multiple of 2**48
+        states = (states * _DRAND48_MULTIPLIER + _DRAND48_INCREMENT) & _DRAND48_MASK
+        sums += instances[(states * 2.0**-48 * doccount).astype(np.int64)]
+    return sums / doccount
+
+def bootstrap_intervals(means, confidence=0.95):
+    """Confidence intervals read off the sorted resample means as
+    ROUGE-1.5.5 does. Returns (low, high) arrays.
+    """
+    num_samples = means.shape[0]
+    means = np.sort(means, axis=0)
+    delta = num_samples * (1-confidence) / 2
+    upper = int(num_samples-delta-1)
+    lower = int(delta)
+    ratio = num_samples-delta-1-upper
+    low = means[lower] + (means[min(lower+1, num_samples-1)]-means[lower]) * ratio
+    high = means[upper] + (means[min(upper+1, num_samples-1)]-means[upper]) * ratio
+    return low, high
+
+def average_with_intervals(scores, confidence=0.95):
+    """Averages keyed like pyrouge's output_to_dict, with the confidence
+    interval bounds as <metric>_cb and <metric>_ce. Like ROUGE-1.5.5, the
+    average is the mean of the bootstrap resamples.
+    """
+    output_dict = {}
+    if scores.shape[0] == 0:
+        return output_dict
+    means = bootstrap_resamples(scores)
+    low, high = bootstrap_intervals(means, confidence)
+    average = means.mean(axis=0)
+    for metricidx, metric in enumerate(ROUGE_METRICS):
+        output_dict[metric] = float(average[metricidx])
+        output_dict[metric+"_cb"] = float(low[metricidx])
+        output_dict[metric+"_ce"] = float(high[metricidx])
+    return output_dict
+
+def rouge_directories(system_dir, gold_dir, system_suffix=".model", gold_suffix=".gold", stem=True, num_workers=1, scores_filename=None, pool=None):
+    """Average ROUGE of every <id>.model summary in system_dir against
+    <id>.gold in gold_dir, with 95% bootstrap intervals. Per-document
+    scores are saved to scores_filename when given.
+    """
+    docids, scores = document_scores(system_dir, gold_dir, system_suffix, gold_suffix, stem, num_workers, pool)
+    if scores_filename is not None:
+        write_document_scores(scores_filename, docids, scores)
+    return average_with_intervals(scores)
+
+####################################
+# Candidates made of document sentences
+####################################
+
+def _tail(seqs, count):
+    tokens = []
+    for seq in reversed(seqs):
+        tokens = seq[max(0, len(seq)-(count-len(tokens))):] + tokens
+        if len(tokens) >= count:
+            break
+    return tokens
+
+def _head(seqs, count):
+    tokens = []
+    for seq in seqs:
+        tokens = tokens + seq[:count-len(tokens)]
+        if len(tokens) >= count:
+            break
+    return tokens
+
+class SentenceScorer:
+    """Precomputed n-grams of the sentences of one document and of its
+    reference, for scoring many candidates made of document sentences.
+
+    Tokens are mapped to integer ids and every n-gram is packed into one
+    integer, so a candidate's n-gram set is the union of its sentences' sets
+    plus the few n-grams that span the joins between consecutive sentences.
+
+    The keys are Python integers, so they never overflow. Packing the whole
+    document into int64 arrays at once (rolling multiply-add, np.isin
+    against the reference) gives the same keys but measured slower here:
+    18.6 ms against 12.5 ms to build the sets of 20 documents of 40
+    sentences, and 38 ms against 31 ms for the reward's candidate hits,
+    since the sets still have to be built for the unions.
+    """
+    def __init__(self, sentences, references, orders):
+        self.vocab = {}
+        self.sentences = [self._token_ids(tokens) for tokens in sentences]
+        self.references = [self._token_ids(tokens) for tokens in references]
+        self.base = len(self.vocab)
+        self.orders = orders
+
+        reference_tokens = [token for sent in self.references for token in sent]
+        self.reference_ngrams = self.ngram_sets(reference_tokens)
+        # Per sentence n-grams and the ones also found in the reference, built on first use
+        self.sentence_sets = {}
+
+    def _token_ids(self, tokens):
+        return [self.vocab.setdefault(token, len(self.vocab)) for token in tokens]
+
+    def _pack(self, window):
+        key = 0
+        for token in window:
+            key = key*self.base + token
+        return key
+
+    def ngram_sets(self, tokens):
+        """Sets of packed n-grams of tokens, by order.
+        """
+        ngram_sets = {}
+        keys = tokens
+        for n in range(1, max(self.orders)+1):
+            if n > 1:
+                keys = [key*self.base + token for key, token in zip(keys, tokens[n-1:])]
+            if n in self.orders:
+                ngram_sets[n] = set(keys)
+        return ngram_sets
+
+    def join_ngrams(self, sentindices, n):
+        """Packed n-grams of the concatenated sentences that span at least one
+        join between two of them.
+        """
+        keys = set()
+        seqs = [self.sentences[sentidx] for sentidx in sentindices]
+        for joinidx in range(1, len(seqs)):
+            tail = _tail(seqs[:joinidx], n-1)
+            window = tail + _head(seqs[joinidx:], n-1)
+            for start in range(len(tail)):
+                if start+n > len(tail) and start+n <= len(window):
+                    keys.add(self._pack(window[start:start+n]))
+        return keys
+
+    def get_sentence_sets(self, sentidx):
+        """(n-grams, n-grams found in the reference) of one sentence, by order.
+        """
+        sets = self.sentence_sets.get(sentidx)
+        if sets is None:
+            ngrams = self.ngram_sets(self.sentences[sentidx])
+            hits = dict((n, ngrams[n] & self.reference_ngrams[n]) for n in self.orders)
+            sets = (ngrams, hits)
+            self.sentence_sets[sentidx] = sets
+        return sets
+
+    def candidate_ngrams(self, sentindices, n):
+        keys = self.join_ngrams(sentindices, n) if n > 1 else set()
+        for sentidx in sentindices:
+            keys |= self.get_sentence_sets(sentidx)[0][n]
+        return keys
+
+    def candidate_hits(self, sentindices, n):
+        """Candidate n-grams found in the reference.
+        """
+        keys = self.join_ngrams(sentindices, n) & self.reference_ngrams[n] if n > 1 else set()
+        for sentidx in sentindices:
+            keys |= self.get_sentence_sets(sentidx)[1][n]
+        return keys
+
+    def score_batch(self, candidates):
+        """Scores of many candidates, each a list of sentence indices.
+        """
+        return np.array([self.score(sentindices) for sentindices in candidates])
+
+class RewardScorer(SentenceScorer):
+    """Training reward of reward_utils: ROUGE-1..4 recall over sets of word
+    ids and the F-score of the LCS of the whole candidate against the whole
+    reference, averaged. Sentences and reference sentences are lists of word
+    ids; padding (0) is dropped from sentences and every sentence is
+    followed by a 0 separator.
+    """
+    def __init__(self, document, highlights):
+        sentences = [[wordid for wordid in sent if wordid != 0] + [0] for sent in document]
+        references = [list(sent) + [0] for sent in highlights]
+        SentenceScorer.__init__(self, sentences, references, (1, 2, 3, 4))
+        self.reference_tokens = [token for sent in self.references for token in sent]
+        self.reference_masks = lcs_match_masks(self.reference_tokens)
+
+    def score(self, sentindices):
+        # Get ROUGE-N recalls
+        rouge_recall_n = []
+        for n in self.orders:
+            gold_count = len(self.reference_ngrams[n])
+            rouge_recall_n.append(0 if gold_count == 0 else float(len(self.candidate_hits(sentindices, n)))/float(gold_count))
+
+        # Get ROUGE-L
+        cand_tokens = [token for sentidx in sentindices for token in self.sentences[sentidx]]
+        len_lcs = lcs_length(cand_tokens, self.reference_tokens, self.reference_masks)
+        r = 0 if (len_lcs == 0) else (float(len_lcs)/len(cand_tokens))
+        p = 0 if (len_lcs == 0) else (float(len_lcs)/len(self.reference_tokens))
+        b = 0 if (r == 0) else (p / r)
+        rouge_recall_l = 0 if (len_lcs == 0) else (((1+(b*b))*r*p)/(r+(b*b*p)))
+
+        return (rouge_recall_n[0]+rouge_recall_n[1]+rouge_recall_n[2]+rouge_recall_n[3]+rouge_recall_l)/5.0
+
+class OracleScorer(SentenceScorer):
+    """Oracle score of scripts/oracle-estimator (rouge.py conventions): mean
+    of the ROUGE-1 and ROUGE-2 F-scores over n-gram sets and the summary-level
+    ROUGE-L F-score over the union of LCS word sets. Sentences are strings
+    split on single spaces; candidates are read in document order.
+    """
+    def __init__(self, sentdata, golddata, orders=(1, 2)):
+        SentenceScorer.__init__(self, [sent.split(" ") for sent in sentdata], [sent.split(" ") for sent in golddata], orders)
+        self.reference_words = set(token for sent in self.references for token in sent)
+        self.sentence_words = [set(sent) for sent in self.sentences]
+        # Words of the LCS of every reference sentence with each sentence, built on first use
+        self.sentence_lcs_words = {}
+
+    def get_sentence_lcs_words(self, sentidx):
+        lcs_words = self.sentence_lcs_words.get(sentidx)
+        if lcs_words is None:
+            sent = self.sentences[sentidx]
+            match_masks = lcs_match_masks(sent)
+            lcs_words = set()
+            for reference in self.references:
+                lcs_words.update(reference[position] for position in lcs_positions(reference, sent, match_masks, ties_up=False))
+            self.sentence_lcs_words[sentidx] = lcs_words
+        return lcs_words
+
+    def rouge_n(self, sentindices, n):
+        """rouge.py rouge_n of the sentences in the given order.
+        """
+        return _oracle_rouge_n(len(self.candidate_ngrams(sentindices, n)), len(self.reference_ngrams[n]), len(self.candidate_hits(sentindices, n)))
+
+    def rouge_l_summary_level(self, sentindices):
+        """rouge.py rouge_l_summary_level of the sentences.
+        """
+        candidate_words = set()
+        lcs_words = set()
+        for sentidx in sentindices:
+            candidate_words |= self.sentence_words[sentidx]
+            lcs_words |= self.get_sentence_lcs_words(sentidx)
+        return _oracle_rouge_l(len(lcs_words), len(self.reference_words), len(candidate_words))
+
+    def score(self, sentindices):
+        sentindices = sorted(set(sentindices))
+        rouge_f = [self.rouge_n(sentindices, n)["f"] for n in self.orders]
+        return (rouge_f[0] + rouge_f[1] + self.rouge_l_summary_level(sentindices)["f"])/3.0
+
+    def _extend(self, state, sentidx, keep_sets):
+        """Set sizes of a prefix candidate extended by one later sentence:
+        ((n-gram counts, hit counts) by order, word count, LCS word count),
+        and the extended candidate's state when keep_sets.
+        """
+        ngrams, hits = self.get_sentence_sets(sentidx)
+        words = self.sentence_words[sentidx]
+        lcs_words = self.get_sentence_lcs_words(sentidx)
+        sent = self.sentences[sentidx]
+        if state is None:
+            counts = ([(len(ngrams[n]), len(hits[n])) for n in self.orders], len(words), len(lcs_words))
+            return counts, (_tail([sent], max(self.orders)-1), ngrams, hits, words, lcs_words) if keep_sets else None
+
+        tail, prefix_ngrams, prefix_hits, prefix_words, prefix_lcs_words = state
+        ngram_counts = []
+        new_ngrams = {}
+        new_hits = {}
+        for n in self.orders:
+            # n-grams spanning the join with the prefix
+            join_tail = _tail([tail], n-1)
+            window = join_tail + sent[:n-1]
+            join_keys = set(self._pack(window[start:start+n]) for start in range(len(join_tail)) if start+n <= len(window))
+            join_hits = join_keys & self.reference_ngrams[n]
+            if keep_sets:
+                new_ngrams[n] = prefix_ngrams[n] | ngrams[n] | join_keys
+                new_hits[n] = prefix_hits[n] | hits[n] | join_hits
+                ngram_counts.append((len(new_ngrams[n]), len(new_hits[n])))
+            else:
+                ngram_counts.append((_union_size(prefix_ngrams[n], ngrams[n], join_keys), _union_size(prefix_hits[n], hits[n], join_hits)))
+        if keep_sets:
+            new_words = prefix_words | words
+            new_lcs_words = prefix_lcs_words | lcs_words
+            counts = (ngram_counts, len(new_words), len(new_lcs_words))
+            return counts, (_tail([tail, sent], max(self.orders)-1), new_ngrams, new_hits, new_words, new_lcs_words)
+        counts = (ngram_counts, len(prefix_words) + len(words.difference(prefix_words)), len(prefix_lcs_words) + len(lcs_words.difference(prefix_lcs_words)))
+        return counts, None
+
+    def score_combinations(self, sentindices, sizes):
+        """(score, combination) of every combination of the given sentences
+        with one of the given sizes, by size and in the order of
+        itertools.combinations. Combinations are visited depth first so
+        that each extends the sets of its prefix by one sentence.
+        """
+        sentindices = sorted(set(sentindices))
+        if not sizes:
+            return []
+        max_size = max(sizes)
+        results = dict((size, []) for size in sizes)
+
+        def visit(prefix, state, start):
+            for position in range(start, len(sentindices)):
+                combination = prefix + [sentindices[position]]
+                keep_sets = len(combination) < max_size
+                counts, extended = self._extend(state, sentindices[position], keep_sets)
+                if len(combination) in results:
+                    ngram_counts, word_count, lcs_word_count = counts
+                    rouge_f = [_oracle_rouge_n(evaluated_count, len(self.reference_ngrams[n]), overlapping_count)["f"]
+                               for n, (evaluated_count, overlapping_count) in zip(self.orders, ngram_counts)]
+                    f_lcs = _oracle_rouge_l(lcs_word_count, len(self.reference_words), word_count)["f"]
+                    results[len(combination)].append(((rouge_f[0] + rouge_f[1] + f_lcs)/3.0, combination))
+                if keep_sets:
+                    visit(combination, extended, position+1)
+
+        visit([], None, 0)
+        return [item for size in sorted(sizes) for item in results[size]]
+
+    def _extension_bound(self, state, remaining, count):
+        """Upper bound on the score of every candidate that extends the
+        candidate of state (None for the empty one) by 1 to count of the
+        remaining sentences. Each added sentence brings at most its own new
+        hits and LCS words, plus n-1 n-grams across its join; F of ROUGE-N
+        grows with precision and recall, the rouge.py ROUGE-L F is bounded
+        by its maximum over the reachable box.
+        """
+        if state is None:
+            state = ([], dict((n, set()) for n in self.orders), dict((n, set()) for n in self.orders), set(), set())
+        tail, ngrams, hits, words, lcs_words = state
+
+        rouge_f = []
+        for n in self.orders:
+            sentence_sets = [self.get_sentence_sets(sentidx) for sentidx in remaining]
+            gains = [len(sent_hits[n].difference(hits[n])) for sent_ngrams, sent_hits in sentence_sets]
+            # Fewest new n-grams outside the reference that one added sentence brings
+            misses = min(len(sent_ngrams[n].difference(ngrams[n])) - gain for (sent_ngrams, sent_hits), gain in zip(sentence_sets, gains))
+            reachable = len(set().union(*[sent_hits[n] for sent_ngrams, sent_hits in sentence_sets]).difference(hits[n]))
+            reference_count = len(self.reference_ngrams[n])
+            join_count = count*(n-1)
+            new_hits = min(sum(sorted(gains, reverse=True)[:count]) + join_count, reachable + join_count, reference_count - len(hits[n]))
+            # New hits are new n-grams of the candidate
+            rouge_f.append(_oracle_rouge_n(len(ngrams[n]) + new_hits + misses, reference_count, len(hits[n]) + new_hits)["f"])
+
+        sentence_lcs_words = [self.get_sentence_lcs_words(sentidx) for sentidx in remaining]
+        gains = sorted((len(sent_lcs_words.difference(lcs_words)) for sent_lcs_words in sentence_lcs_words), reverse=True)
+        lcs_count = len(lcs_words) + min(sum(gains[:count]), len(set().union(*sentence_lcs_words).difference(lcs_words)))
+        # LCS words are candidate words, but not always new ones
+        word_count = len(words) + min(len(self.sentence_words[sentidx].difference(words)) for sentidx in remaining)
+        f_lcs = _oracle_lcs_f_bound(lcs_count / len(self.reference_words), min(1.0, lcs_count / word_count))
+
+        return (rouge_f[0] + rouge_f[1] + f_lcs)/3.0 + BOUND_SLACK
+
+    def top_combinations(self, sentindices, sizes, top_n):
+        """The top_n items of score_combinations in the order of
+        sort(reverse=True), found by branch and bound: a candidate is only
+        extended while the bound of its extensions can reach the top_n
+        scored so far.
+        """
+        sentindices = sorted(set(sentindices))
+        if not sizes:
+            return []
+        max_size = max(sizes)
+        # Best (score, combination) found so far, worst first
+        best = []
+
+        def visit(prefix, state, start):
+            children = []
+            for position in range(start, len(sentindices)):
+                combination = prefix + [sentindices[position]]
+                keep_sets = len(combination) < max_size
+                counts, extended = self._extend(state, sentindices[position], keep_sets)
+                if len(combination) in sizes:
+                    ngram_counts, word_count, lcs_word_count = counts
+                    rouge_f = [_oracle_rouge_n(evaluated_count, len(self.reference_ngrams[n]), overlapping_count)["f"]
+                               for n, (evaluated_count, overlapping_count) in zip(self.orders, ngram_counts)]
+                    f_lcs = _oracle_rouge_l(lcs_word_count, len(self.reference_words), word_count)["f"]
+                    item = ((rouge_f[0] + rouge_f[1] + f_lcs)/3.0, combination)
+                    if len(best) < top_n:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                remaining = sentindices[position+1:]
+                if keep_sets and remaining:
+                    children.append((self._extension_bound(extended, remaining, max_size-len(combination)), position, combination, extended))
+
+            # Most promising first, so that the top_n fill up with good candidates early
+            children.sort(key=lambda child: child[0], reverse=True)
+            for bound, position, combination, extended in children:
+                if len(best) == top_n and bound < best[0][0]:
+                    break
+                visit(combination, extended, position+1)
+
+        visit([], None, 0)
+        return sorted(best, reverse=True)
+
+def _union_size(a, b, c):
+    return len(a) + len(b.difference(a)) + len(c.difference(a, b))
+
+def _oracle_rouge_n(evaluated_count, reference_count, overlapping_count):
+    precision = 0.0 if evaluated_count == 0 else overlapping_count / evaluated_count
+    recall = 0.0 if reference_count == 0 else overlapping_count / reference_count
+    f1_score = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+    return {"f": f1_score, "p": precision, "r": recall}
+
+# With beta = p/r the rouge.py ROUGE-L F is r*g(p/r), g(t) = t(1+t^2)/(1+t^3),
+# which increases up to t = ORACLE_LCS_F_PEAK and decreases after it
+ORACLE_LCS_F_PEAK = 1.6776506988040598
+
+def _oracle_lcs_f_ratio(t):
+    return t * (1 + t * t) / (1 + t ** 3)
+
+def _oracle_lcs_f_bound(r_lcs, p_lcs):
+    # Largest rouge.py ROUGE-L F with recall at most r_lcs and precision at most p_lcs
+    if r_lcs <= 0 or p_lcs <= 0:
+        return 0.0
+    return max(r_lcs * _oracle_lcs_f_ratio(min(p_lcs / r_lcs, ORACLE_LCS_F_PEAK)),
+               p_lcs * _oracle_lcs_f_ratio(min(r_lcs / p_lcs, ORACLE_LCS_F_PEAK)))
+
+def _oracle_rouge_l(lcs_count, reference_count, candidate_count):
+    r_lcs = lcs_count / reference_count
+    p_lcs = lcs_count / candidate_count
+    beta = p_lcs / (r_lcs + 1e-12)
+    num = (1 + (beta ** 2)) * r_lcs * p_lcs
+    denom = r_lcs + ((beta ** 2) * p_lcs)
+    f_lcs = num / (denom + 1e-12)
+    return {"f": f_lcs, "p": p_lcs, "r": r_lcs}
+
+####################################
+# rouge.py interface
+####################################
+
+def oracle_rouge_n(evaluated_sentences, reference_sentences, n=2):
+    """ROUGE-N of scripts/oracle-estimator/rouge.py: {"f", "p", "r"} over
+    the sets of space separated n-grams of two lists of sentences.
+    """
+    if len(evaluated_sentences) <= 0 or len(reference_sentences) <= 0:
+        raise ValueError("Collections must contain at least 1 sentence.")
+    scorer = OracleScorer(evaluated_sentences, reference_sentences, (n,))
+    return scorer.rouge_n(range(len(evaluated_sentences)), n)
+
+def oracle_rouge_l_summary_level(evaluated_sentences, reference_sentences):
+    """Summary-level ROUGE-L of scripts/oracle-estimator/rouge.py: {"f", "p",
+    "r"} over the union of LCS word sets.
+    """
+    if len(evaluated_sentences) <= 0 or len(reference_sentences) <= 0:
+        raise ValueError("Collections must contain at least 1 sentence.")
+    scorer = OracleScorer(evaluated_sentences, reference_sentences, (1,))
+    return scorer.rouge_l_summary_level(range(len(evaluated_sentences)))
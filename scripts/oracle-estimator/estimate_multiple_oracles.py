@@ -4,29 +4,27 @@
 # Improved by Yang Liu to use a must faster ROUGE
 
 
+import argparse
 import os
 import re
-import itertools
-from multiprocessing import Pool
 import sys
-import rouge
+import time
+import zlib
 import codecs
+from multiprocessing import Pool
+
+# Shared sentence-decomposed scorer (rouge_utils.py at the top of the repository)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from rouge_utils import OracleScorer
 
 
-def cal_rouge(fullset, sentdata, golddata):
+def cal_rouge(fullset, scorer):
+    # Same score as the rouge.py ROUGE-1/2 F and summary-level ROUGE-L F of the selected sentences
     fullset.sort()
-    model_highlights = [sentdata[idx] for idx in range(len(sentdata)) if idx in fullset]
-    rouge_1 = rouge.rouge_n(model_highlights, golddata, 1)['f']
-    rouge_2 = rouge.rouge_n(model_highlights, golddata, 2)['f']
-    rouge_l = rouge.rouge_l_summary_level(model_highlights, golddata)['f']
-    rouge_score = (rouge_1 + rouge_2 + rouge_l)/3.0
+    rouge_score = scorer.score(fullset)
     return (rouge_score, fullset)
 
 
-def _multi_run_wrapper(args):
-    return cal_rouge(*args)
-
-
 def get_fileids(topdir, newstype, datatype, server):
     if newstype == "cnn":
         return open(topdir + "/Temp-ServerFileIds/cnn-" + datatype + "-fileids.txt." + server).read().strip().split(
@@ -40,94 +38,215 @@ def get_fileids(topdir, newstype, datatype, server):
     exit(0)
 
 
-if __name__ == "__main__":
-
-    args = sys.argv[1:]
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('num_workers', type=int, help='Number of worker processes, each estimating whole documents')
+    parser.add_argument('data_dir', help='Directory with article/ and abstracts/')
+    parser.add_argument('-ns', '--num_shards', type=int, default=1, help='Number of shards the documents are split into')
+    parser.add_argument('-s', '--shard', type=int, default=0, help='Shard to process (0 to num_shards-1)')
+    parser.add_argument('-sl', '--sent_limit', type=int, default=4, help='Most sentences in an oracle')
+    parser.add_argument('-ps', '--pool_size', type=int, default=10, help='Best single sentences that oracles are drawn from')
+    parser.add_argument('-tn', '--top_n', type=int, default=0,
+                        help='Only keep the top_n oracles, found by branch and bound (0: all combinations)')
+    parser.add_argument('-c', '--consolidated', action='store_true',
+                        help='Append every document as a .label.multipleoracle block to one file per shard '
+                             'instead of writing .f-sent and .moracle files')
+    args = parser.parse_args()
+    if args.shard < 0 or args.shard >= args.num_shards:
+        print("Error: shard must be between 0 and num_shards-1.")
+        exit(0)
+    if args.sent_limit < 2:
+        print("Error: sent_limit must be at least 2.")
+        exit(0)
+    if args.pool_size < 1:
+        print("Error: pool_size must be at least 1.")
+        exit(0)
+    return args
+
+
+def get_shard(summaryfname, num_shards):
+    # Stable across runs, machines and added documents
+    return zlib.crc32(summaryfname.encode('utf-8')) % num_shards
+
+
+def read_journal(fianllabeldir, outputfname):
+    """Documents completed by any earlier run: one name per line in the
+    *.journal files of the output directory. A line cut short by a crash
+    is cut off the end of outputfname, the journal this run appends to.
+    """
+    completed = set()
+    for journalfname in os.listdir(fianllabeldir):
+        if not journalfname.endswith(".journal"):
+            continue
+        journalfname = os.path.join(fianllabeldir, journalfname)
+        size = 0
+        complete_size = 0
+        with open(journalfname, "rb") as fdata:
+            for line in fdata:
+                size += len(line)
+                if line.endswith(b"\n"):
+                    completed.add(line[:-1].decode('utf-8'))
+                    complete_size = size
+        if journalfname == outputfname and complete_size < size:
+            with open(journalfname, "r+b") as fdata:
+                fdata.truncate(complete_size)
+    return completed
+
+
+def read_consolidated(fianllabeldir, outputfname):
+    """Documents completed by any earlier run in the consolidated
+    shard-*.label.multipleoracle files of the output directory: a block is
+    complete once its blank line is written. A block cut short by a crash
+    is cut off the end of outputfname, the file this run appends to.
+    """
+    completed = set()
+    for consolidatedfname in os.listdir(fianllabeldir):
+        if not (consolidatedfname.startswith("shard-") and consolidatedfname.endswith(".label.multipleoracle")):
+            continue
+        consolidatedfname = os.path.join(fianllabeldir, consolidatedfname)
+        size = 0
+        complete_size = 0
+        summaryfname = None
+        with open(consolidatedfname, "rb") as fdata:
+            for line in fdata:
+                size += len(line)
+                if line == b"\n":
+                    if summaryfname is not None:
+                        completed.add(summaryfname)
+                    summaryfname = None
+                    complete_size = size
+                elif summaryfname is None:
+                    summaryfname = line.rstrip(b"\n").decode('utf-8')
+        if consolidatedfname == outputfname and complete_size < size:
+            with open(consolidatedfname, "r+b") as fdata:
+                fdata.truncate(complete_size)
+    return completed
+
+
+# Set once in every worker
+_options = None
+
+
+def _init_worker(options):
+    global _options
+    _options = options
+
+
+def estimate_oracles(summaryfname):
+    """Estimates the oracles of one document. Returns the record to append
+    to the output of the shard: the document's .label.multipleoracle block
+    when consolidated, otherwise its journal line once its .f-sent and
+    .moracle files are written.
+    """
+    mainbody_dir, highlights_dir, fianllabeldir, sent_limit, pool_size, top_n, consolidated = _options
+
+    sentfull = os.path.join(mainbody_dir, summaryfname + ".article")
+    sentdata = (codecs.open(sentfull, encoding='utf-8').readlines())  # full doc
+    #goldfull = os.path.join(highlights_dir, summaryfname + ".abstracts")
+    gold_file_name = summaryfname.replace("src", "tgt")
+    #tokens = gold_file_name.split("-")
+    #gold_file_name = tokens[0] + "-" + tokens[0] + "-" + tokens[2] + "-" + tokens[3] + "-" + tokens[4]
+    goldfull = os.path.join(highlights_dir, gold_file_name + ".abstracts")
+    golddata = (codecs.open(goldfull, encoding='utf-8').readlines())  # full doc
+
+    rougesentwisefile = os.path.join(fianllabeldir, summaryfname + ".f-sent")
+
+    # Per-sentence n-grams and LCS words, shared by all candidates of the document
+    scorer = OracleScorer(sentdata, golddata)
+
+    sentids_lst = [[sentid] for sentid in range(len(sentdata))]
+    rougescore_sentwise = []
+    for sentids in sentids_lst:
+        rougescore_sentwise.append(cal_rouge(sentids, scorer))
+
+    # print rougescore_sentwise
+    if not consolidated:
+        foutput = open(rougesentwisefile, "w")
+        foutput.write("\n".join([str(item[0]) + "\t" + str(item[1][0]) for item in rougescore_sentwise]) + "\n")
+        foutput.close()
+    rougescore_sentwise.sort(reverse=True)
 
-    pool = Pool(int(args[0]))
-    data_dir = args[1]
-    task = int(args[2])
-    sent_limit = 4
+    toprougesentences = [item[1][0] for item in rougescore_sentwise[:pool_size]]
+    toprougesentences.sort()
 
-    fullcount = 0
+    labelfullmodif = fianllabeldir + "/" + summaryfname + ".moracle"
 
-    mainbody_dir = os.path.join(data_dir, 'article')
-    highlights_dir = os.path.join(data_dir, 'abstracts')
+    # Combinations are cheap unions of precomputed sets: score them here
+    # rather than pickling the document to the pool for every candidate.
+    # Each combination extends the sets of its prefix by one sentence.
+    if top_n > 0:
+        # Exact top_n without scoring every combination
+        rougescore_sentids = scorer.top_combinations(toprougesentences, range(2, sent_limit + 1), top_n)
+    else:
+        rougescore_sentids = scorer.score_combinations(toprougesentences, range(2, sent_limit + 1))
 
-    _listfiles = os.listdir(mainbody_dir)
-    all_l = len(_listfiles)
-    _listfiles = sorted(_listfiles)
-    if (task == 0):
-        listfiles = _listfiles[:int(all_l / 3)]
-    elif (task == 1):
-        listfiles = _listfiles[int(all_l / 3):int(all_l * 2 / 3)]
-    elif (task == 2):
-        listfiles = _listfiles[int(all_l * 2 / 3):]
-    elif (task == 3):
-        listfiles = _listfiles
+    rougescore_sentids.sort(reverse=True)
+    moracle_lines = [(" ".join([str(sentidx) for sentidx in item[1]])) + "\t" + str(item[0]) + "\n" for item in rougescore_sentids]
 
-    fianllabeldir = os.path.join(data_dir, 'article-oracles')
-    if (not os.path.exists(fianllabeldir)):
-        os.mkdir(fianllabeldir)
+    if consolidated:
+        # Name, number of sentences with a positive score and the oracles, as combine_multi_oracle_files.py writes them
+        fsent_count = len([item for item in rougescore_sentwise if item[0] > 0])
+        return summaryfname + "\n" + str(fsent_count) + "\n" + "".join(moracle_lines) + "\n"
 
-    for summaryfname in listfiles:
-        if not re.match('^\d', summaryfname):
-            continue
-        summaryfname = summaryfname.split('.')[0]
-        if os.path.isfile(os.path.join(fianllabeldir, summaryfname + ".f-sent")) and os.path.isfile(
-                os.path.join(fianllabeldir, summaryfname + ".moracle")):
-            continue
-        print(summaryfname)
-        sentfull = os.path.join(mainbody_dir, summaryfname + ".article")
-        sentdata = (codecs.open(sentfull, encoding='utf-8').readlines())  # full doc
-        #goldfull = os.path.join(highlights_dir, summaryfname + ".abstracts")
-        gold_file_name = summaryfname.replace("src", "tgt")
-        #tokens = gold_file_name.split("-")
-        #gold_file_name = tokens[0] + "-" + tokens[0] + "-" + tokens[2] + "-" + tokens[3] + "-" + tokens[4]
-        goldfull = os.path.join(highlights_dir, gold_file_name + ".abstracts")
-        golddata = (codecs.open(goldfull, encoding='utf-8').readlines())  # full doc
-
-        rougesentwisefile = os.path.join(fianllabeldir, summaryfname + ".f-sent")
-
-        sentids_lst = [[sentid] for sentid in range(len(sentdata))]
-        rougescore_sentwise = []
-        for sentids in sentids_lst:
-            rougescore_sentwise.append(cal_rouge(sentids, sentdata, golddata))
-
-        # print rougescore_sentwise
-        foutput = open(rougesentwisefile, "w")
-        foutput.write("\n".join([str(item[0]) + "\t" + str(item[1][0]) for item in rougescore_sentwise]) + "\n")
-        foutput.close()
-        rougescore_sentwise.sort(reverse=True)
+    foutput = open(labelfullmodif, "w")
+    foutput.write("".join(moracle_lines))
+    foutput.close()
 
-        toprougesentences = [item[1][0] for item in rougescore_sentwise[:10]]
-        toprougesentences.sort()
+    return summaryfname + "\n"
 
-        labelfullmodif = fianllabeldir + "/" + summaryfname + ".moracle"
-        rougescore_sentids = []
-        rougescore_sentids += rougescore_sentwise[:10][:]
 
-        arguments_list = []
-        for itemcount in range(2, sent_limit + 1):
-            arguments_list += [(list(sentids), sentdata, golddata) for sentids in
-                               itertools.combinations(toprougesentences, itemcount)]
-        rougescore_sentids = pool.map(_multi_run_wrapper, arguments_list)
+if __name__ == "__main__":
 
-        # Process results
-        # for rougescore, arguments in zip(rougescore_list, arguments_list):
-        #     rougescore_sentids.append((rougescore, arguments[0]))
+    args = parse_arguments()
 
-        # rougescore_sentids = []
-        # for sentids in sentids_lst:
-        #     rougescore_sentids.append(cal_rouge(sentids, sentdata, golddata))
+    data_dir = args.data_dir
 
-        rougescore_sentids.sort(reverse=True)
+    mainbody_dir = os.path.join(data_dir, 'article')
+    highlights_dir = os.path.join(data_dir, 'abstracts')
 
-        foutput = open(labelfullmodif, "w")
-        for item in rougescore_sentids:
-            foutput.write((" ".join([str(sentidx) for sentidx in item[1]])) + "\t" + str(item[0]) + "\n")
-        foutput.close()
+    fianllabeldir = os.path.join(data_dir, 'article-oracles')
+    if (not os.path.exists(fianllabeldir)):
+        os.mkdir(fianllabeldir)
 
-        if fullcount % 100 == 0:
-            print(fullcount)
+    # Documents of this shard that no run has completed yet
+    if args.consolidated:
+        outputfname = os.path.join(fianllabeldir, "shard-%d-of-%d.label.multipleoracle" % (args.shard, args.num_shards))
+        completed = read_consolidated(fianllabeldir, outputfname)
+    else:
+        outputfname = os.path.join(fianllabeldir, "shard-%d-of-%d.journal" % (args.shard, args.num_shards))
+        completed = read_journal(fianllabeldir, outputfname)
+    summaryfnames = []
+    for summaryfname in sorted(os.listdir(mainbody_dir)):
+        if not re.match('^\d', summaryfname):
+            continue
+        summaryfname = summaryfname.split('.')[0]
+        if get_shard(summaryfname, args.num_shards) == args.shard and summaryfname not in completed:
+            summaryfnames.append(summaryfname)
+    print("Shard %d of %d: %d documents to estimate, %d completed before" % (args.shard, args.num_shards, len(summaryfnames), len(completed)))
+
+    options = (mainbody_dir, highlights_dir, fianllabeldir, args.sent_limit, args.pool_size, args.top_n, args.consolidated)
+    if args.num_workers > 1:
+        pool = Pool(args.num_workers, _init_worker, (options,))
+        estimated = pool.imap_unordered(estimate_oracles, summaryfnames)
+    else:
+        _init_worker(options)
+        estimated = (estimate_oracles(summaryfname) for summaryfname in summaryfnames)
+
+    # Records are only appended once complete: a document is done when its record is
+    output = open(outputfname, "ab")
+    start_time = time.time()
+    fullcount = 0
+    for record in estimated:
+        output.write(record.encode('utf-8'))
+        output.flush()
         fullcount += 1
+        if fullcount % 100 == 0 or fullcount == len(summaryfnames):
+            elapsed = max(time.time() - start_time, 1e-6)
+            print("%d/%d documents, %.1f documents/s, %.0f s left" % (fullcount, len(summaryfnames), fullcount / elapsed,
+                                                                       (len(summaryfnames) - fullcount) * elapsed / fullcount))
+            sys.stdout.flush()
+    output.close()
+
+    if args.num_workers > 1:
+        pool.close()
+        pool.join()
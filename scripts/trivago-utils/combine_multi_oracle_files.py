@@ -13,6 +13,8 @@ def parse_arguments():
     parser.add_argument('-t', '--title', help='Title file', required=True)
     parser.add_argument('-mc', '--max_count', help='Maximum file count', required=True)
     parser.add_argument('-ft', '--file_type', help='File type to process', required=True)
+    parser.add_argument('-s', '--shards', action='store_true',
+                        help='Merge the shard files written by estimate_multiple_oracles.py --consolidated')
 
     args = parser.parse_args()
 
@@ -26,7 +28,10 @@ def parse_arguments():
         title_list = process_title_file(title)
         print("*** Number of titles found {}".format(len(title_list)))
 
-        process_directory(input_directory, max_file_count, file_type, title_list)
+        if args.shards:
+            process_shards(input_directory, max_file_count, file_type, title_list)
+        else:
+            process_directory(input_directory, max_file_count, file_type, title_list)
 
 def process_title_file(title):
     title_list = []
@@ -67,6 +72,57 @@ def process_directory(input_directory, max_file_count, file_type, title_list):
 
 
 
+def index_shard_blocks(input_directory):
+    """Byte ranges of the block bodies (sentence count and oracle lines) in the
+    shard-*.label.multipleoracle files of input_directory, by document name.
+    """
+    block_index = {}
+    for shard_filename in sorted(os.listdir(input_directory)):
+        if not (shard_filename.startswith("shard-") and shard_filename.endswith(".label.multipleoracle")):
+            continue
+        shard_filename = os.path.join(input_directory, shard_filename)
+        offset = 0
+        document_name = None
+        with open(shard_filename, "rb") as shard_file:
+            for line in shard_file:
+                if line == b"\n":
+                    if document_name is not None:
+                        block_index[document_name] = (shard_filename, body_start, offset)
+                    document_name = None
+                elif document_name is None:
+                    document_name = line.rstrip(b"\n").decode("utf-8")
+                    body_start = offset + len(line)
+                offset += len(line)
+    return block_index
+
+
+def process_shards(input_directory, max_file_count, file_type, title_list):
+    block_index = index_shard_blocks(input_directory)
+    print("*** Number of documents found in the shards {}".format(len(block_index)))
+
+    output_file = open(input_directory + "/usp." + file_type + ".label.multipleoracle", "wb")
+    document_name_suffix = "-0-src-" + file_type + "-txt"
+    shard_files = {}
+
+    for line_count, title in enumerate(title_list):
+        block = block_index.get(str(line_count) + document_name_suffix)
+        if line_count <= int(max_file_count) and block is not None:
+            shard_filename, body_start, body_end = block
+            if shard_filename not in shard_files:
+                shard_files[shard_filename] = open(shard_filename, "rb")
+            shard_file = shard_files[shard_filename]
+            shard_file.seek(body_start)
+
+            output_file.write(title.encode("utf-8"))
+            output_file.write(shard_file.read(body_end - body_start))
+        output_file.write(b"\n")
+
+    for shard_file in shard_files.values():
+        shard_file.close()
+    print("*** Output file generated.")
+    output_file.close()
+
+
 def calculate_fsent(fsent_file):
     fsent_lines = fsent_file.readlines()
     fsent_count = 0
@@ -0,0 +1,194 @@
+"""
+Reference implementations this project used before the in-process ROUGE
+rewrite, kept verbatim for the equivalence tests (the baseline rouge.py of
+the oracle estimator is in legacy_rouge).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import Counter
+
+from rouge_utils import ROUGE_ALPHA, ROUGE_ORDERS
+
+####################################
+# reward_utils.py
+####################################
+
+def _get_lcs(a, b):
+    lengths = [[0 for j in range(len(b)+1)] for i in range(len(a)+1)]
+    # row 0 and column 0 are initialized to 0 already
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            if x == y:
+                lengths[i+1][j+1] = lengths[i][j] + 1
+            else:
+                lengths[i+1][j+1] = max(lengths[i+1][j], lengths[i][j+1])
+    # read the substring out from the matrix
+    result = []
+    x, y = len(a), len(b)
+    while x != 0 and y != 0:
+        if lengths[x][y] == lengths[x-1][y]:
+            x -= 1
+        elif lengths[x][y] == lengths[x][y-1]:
+            y -= 1
+        else:
+            assert a[x-1] == b[y-1]
+            result = [a[x-1]] + result
+            x -= 1
+            y -= 1
+    return len(result)
+
+def _get_ngram_sets(highlights):
+    set_1gram = set()
+    set_2gram = set()
+    set_3gram = set()
+    set_4gram = set()
+    fullen = len(highlights)
+    for widx in range(fullen):
+        # 1gram
+        set_1gram.add(str(highlights[widx]))
+        # 2gram
+        if (widx+1) < fullen:
+            set_2gram.add(str(highlights[widx])+"-"+str(highlights[widx+1]))
+        # 3gram
+        if (widx+2) < fullen:
+            set_3gram.add(str(highlights[widx])+"-"+str(highlights[widx+1])+"-"+str(highlights[widx+2]))
+        # 4gram
+        if (widx+3) < fullen:
+            set_4gram.add(str(highlights[widx])+"-"+str(highlights[widx+1])+"-"+str(highlights[widx+2])+"-"+str(highlights[widx+3]))
+    return set_1gram, set_2gram, set_3gram, set_4gram
+
+def _rouge_wrapper_traindata_nopyrouge(docname, final_labels_str, document, highlights):
+    # The reward only: the final labels of the original depend on FLAGS
+    cand_highlights_full = []
+    for sentidx in final_labels_str.split("-"):
+        cand_highlights_full += [wordid for wordid in document[int(sentidx)] if wordid != 0]
+        cand_highlights_full.append(0)
+    highlights_full = []
+    for sent in highlights:
+        highlights_full += sent
+        highlights_full.append(0)
+
+    # Get sets
+    cand_1gram, cand_2gram, cand_3gram, cand_4gram = _get_ngram_sets(cand_highlights_full)
+    gold_1gram, gold_2gram, gold_3gram, gold_4gram = _get_ngram_sets(highlights_full)
+
+    # Get ROUGE-N recalls
+    rouge_recall_1 = 0
+    if len(gold_1gram) != 0:
+        rouge_recall_1 = float(len(gold_1gram.intersection(cand_1gram)))/float(len(gold_1gram))
+    rouge_recall_2 = 0
+    if len(gold_2gram) != 0:
+        rouge_recall_2 = float(len(gold_2gram.intersection(cand_2gram)))/float(len(gold_2gram))
+    rouge_recall_3 = 0
+    if len(gold_3gram) != 0:
+        rouge_recall_3 = float(len(gold_3gram.intersection(cand_3gram)))/float(len(gold_3gram))
+    rouge_recall_4 = 0
+    if len(gold_4gram) != 0:
+        rouge_recall_4 = float(len(gold_4gram.intersection(cand_4gram)))/float(len(gold_4gram))
+
+    # Get ROUGE-L
+    len_lcs = _get_lcs(cand_highlights_full, highlights_full)
+    r = 0 if (len_lcs == 0) else (float(len_lcs)/len(cand_highlights_full))
+    p = 0 if (len_lcs == 0) else (float(len_lcs)/len(highlights_full))
+    b = 0 if (r == 0) else (p / r)
+    rouge_recall_l = 0 if (len_lcs == 0) else (((1+(b*b))*r*p)/(r+(b*b*p)))
+
+    rouge_recall_average = (rouge_recall_1+rouge_recall_2+rouge_recall_3+rouge_recall_4+rouge_recall_l)/5.0
+    return rouge_recall_average
+
+####################################
+# rouge_utils.py, before rouge_batch
+####################################
+
+def _f_score(precision, recall, alpha=ROUGE_ALPHA):
+    if precision == 0 or recall == 0:
+        return 0.0
+    return (precision * recall) / ((1 - alpha) * precision + alpha * recall)
+
+def _add_scores(scores, name, hit, peer_count, model_count):
+    precision = hit / peer_count if peer_count > 0 else 0.0
+    recall = hit / model_count if model_count > 0 else 0.0
+    scores["rouge_%s_recall"%name] = recall
+    scores["rouge_%s_precision"%name] = precision
+    scores["rouge_%s_f_score"%name] = _f_score(precision, recall)
+
+def ngram_counts(tokens, n):
+    return Counter(tuple(tokens[idx:idx+n]) for idx in range(len(tokens)-n+1))
+
+def rouge_n_hits(peer_tokens, model_tokens, n):
+    """Clipped n-gram overlap of two token lists, with the n-gram totals of
+    both sides: (hit, peer_count, model_count).
+    """
+    peer_grams = ngram_counts(peer_tokens, n)
+    model_grams = ngram_counts(model_tokens, n)
+    hit = sum(min(count, peer_grams[gram]) for gram, count in model_grams.items() if gram in peer_grams)
+    return hit, max(len(peer_tokens)-n+1, 0), max(len(model_tokens)-n+1, 0)
+
+def lcs_positions(model, peer):
+    """Positions in model of one longest common subsequence with peer, with
+    the tie breaking of ROUGE-1.5.5.
+    """
+    rows = len(model)
+    cols = len(peer)
+    if rows == 0 or cols == 0:
+        return []
+    lengths = [[0]*(cols+1) for _ in range(rows+1)]
+    for i in range(rows):
+        x = model[i]
+        above = lengths[i]
+        current = lengths[i+1]
+        for j in range(cols):
+            if x == peer[j]:
+                current[j+1] = above[j] + 1
+            elif above[j+1] >= current[j]:
+                current[j+1] = above[j+1]
+            else:
+                current[j+1] = current[j]
+    positions = []
+    i, j = rows, cols
+    while i > 0 and j > 0:
+        if model[i-1] == peer[j-1]:
+            positions.append(i-1)
+            i -= 1
+            j -= 1
+        elif lengths[i-1][j] >= lengths[i][j-1]:
+            i -= 1
+        else:
+            j -= 1
+    positions.reverse()
+    return positions
+
+def rouge_l_hits(peer_sents, model_sents):
+    """Summary-level union LCS hits: (hit, peer_count, model_count).
+    """
+    peer_counts = Counter(token for sent in peer_sents for token in sent)
+    model_counts = Counter(token for sent in model_sents for token in sent)
+    peer_count = sum(peer_counts.values())
+    model_count = sum(model_counts.values())
+    hit = 0
+    for model_sent in model_sents:
+        union = set()
+        for peer_sent in peer_sents:
+            union.update(lcs_positions(model_sent, peer_sent))
+        for position in sorted(union):
+            token = model_sent[position]
+            if model_counts[token] > 0 and peer_counts[token] > 0:
+                hit += 1
+                model_counts[token] -= 1
+                peer_counts[token] -= 1
+    return hit, peer_count, model_count
+
+def summary_scores(peer_sents, model_sents, orders=ROUGE_ORDERS):
+    """ROUGE scores of one tokenized summary against one tokenized reference,
+    keyed like pyrouge's output_to_dict (rouge_1_f_score, rouge_l_recall, ...).
+    """
+    peer_tokens = [token for sent in peer_sents for token in sent]
+    model_tokens = [token for sent in model_sents for token in sent]
+    scores = {}
+    for n in orders:
+        _add_scores(scores, str(n), *rouge_n_hits(peer_tokens, model_tokens, n))
+    _add_scores(scores, "l", *rouge_l_hits(peer_sents, model_sents))
+    return scores
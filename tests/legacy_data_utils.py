@@ -0,0 +1,97 @@
+"""
+Baseline Data.get_batch of data_utils.py, list based, kept as the reference
+of the equivalence tests of build_batch. Only self became the data argument
+and the sampled oracle of every document can be given as randidx_oracles.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import random
+
+from my_flags import FLAGS
+
+# Special IDs
+PAD_ID = 0
+UNK_ID = 1
+
+def get_batch(data, startidx, endidx, randidx_oracles=None):
+    # This is very fast if you keep everything in Numpy
+    
+    def process_to_chop_pad(orgids, requiredsize):
+        if (len(orgids) >= requiredsize):
+            return orgids[:requiredsize]
+        else:
+            padids = [PAD_ID] * (requiredsize - len(orgids))
+            return (orgids + padids)
+
+    # Numpy dtype
+    dtype = np.float16 if FLAGS.use_fp16 else np.float32
+    
+    # For train, (endidx-startidx)=FLAGS.batch_size, for others its as specified
+    batch_docnames = np.empty((endidx-startidx), dtype="S60") # File ID of size "cnn-" or "dailymail-" with fileid of size 40
+    batch_docs = np.empty(((endidx-startidx), (FLAGS.max_doc_length + FLAGS.max_title_length + FLAGS.max_image_length), FLAGS.max_sent_length), dtype="int32") 
+    batch_label = np.empty(((endidx-startidx), FLAGS.max_doc_length, FLAGS.target_label_size), dtype=dtype) # Single best oracle, used for JP models or accuracy estimation 
+    batch_weight = np.empty(((endidx-startidx), FLAGS.max_doc_length), dtype=dtype) 
+    batch_oracle_multiple = np.empty(((endidx-startidx), 1, FLAGS.max_doc_length, FLAGS.target_label_size), dtype=dtype)
+    batch_reward_multiple = np.empty(((endidx-startidx), 1), dtype=dtype)
+    
+    batch_idx = 0
+    for fileindex in data.fileindices[startidx:endidx]:
+        # Document Names
+        batch_docnames[batch_idx] = data.filenames[fileindex]
+        
+        # Document
+        doc_wordids = [] # [FLAGS.max_doc_length + FLAGS.max_title_length + FLAGS.max_image_length, FLAGS.max_sent_length]
+        for idx in range(FLAGS.max_doc_length):
+            thissent = []
+            if idx < len(data.docs[fileindex]):
+                thissent = data.docs[fileindex][idx][:]
+            thissent = process_to_chop_pad(thissent, FLAGS.max_sent_length) # [FLAGS.max_sent_length]
+            doc_wordids.append(thissent)
+        for idx in range(FLAGS.max_title_length):
+            thissent = []
+            if idx < len(data.titles[fileindex]):
+                thissent = data.titles[fileindex][idx][:]
+            thissent = process_to_chop_pad(thissent, FLAGS.max_sent_length) # [FLAGS.max_sent_length]
+            doc_wordids.append(thissent)
+        for idx in range(FLAGS.max_image_length):
+            thissent = []
+            if idx < len(data.images[fileindex]):
+                thissent = data.images[fileindex][idx][:]
+            thissent = process_to_chop_pad(thissent, FLAGS.max_sent_length) # [FLAGS.max_sent_length]
+            doc_wordids.append(thissent)
+        batch_docs[batch_idx] = np.array(doc_wordids[:], dtype="int32")
+        
+        # Labels: Select the single best
+        labels_vecs = [[1, 0] if (item in data.labels[fileindex][0]) else [0, 1] for item in range(FLAGS.max_doc_length)]
+        batch_label[batch_idx] = np.array(labels_vecs[:], dtype=dtype)
+
+        # Weights
+        weights = process_to_chop_pad(data.weights[fileindex][:], FLAGS.max_doc_length)
+        batch_weight[batch_idx] = np.array(weights[:], dtype=dtype)
+
+        # Multiple Labels and rewards
+        labels_set = [] # FLAGS.num_sample_rollout, FLAGS.max_doc_length, FLAGS.target_label_size
+        reward_set = [] # FLAGS.num_sample_rollout, FLAGS.max_doc_length, FLAGS.target_label_size
+        for idx in range(FLAGS.num_sample_rollout):
+            thislabels = []
+            if idx < len(data.labels[fileindex]):
+                thislabels = [[1, 0] if (item in data.labels[fileindex][idx]) else [0, 1] for item in range(FLAGS.max_doc_length)]
+                reward_set.append(data.rewards[fileindex][idx])
+            else:
+                # Simply copy the best one
+                thislabels = [[1, 0] if (item in data.labels[fileindex][0]) else [0, 1] for item in range(FLAGS.max_doc_length)]
+                reward_set.append(data.rewards[fileindex][0])
+            labels_set.append(thislabels)
+        # Randomly Sample one oracle label
+        randidx_oracle = random.randint(0, (FLAGS.num_sample_rollout-1)) if randidx_oracles is None else randidx_oracles[batch_idx]
+        batch_oracle_multiple[batch_idx][0] = np.array(labels_set[randidx_oracle][:], dtype=dtype)
+        batch_reward_multiple[batch_idx] = np.array([reward_set[randidx_oracle]], dtype=dtype)
+        
+        # increase batch count
+        batch_idx += 1
+
+    return batch_docnames, batch_docs, batch_label, batch_weight, batch_oracle_multiple, batch_reward_multiple
@@ -0,0 +1,44 @@
+"""
+Small random corpora in the preprocessed text format (.doc, .title, .image,
+.label.multipleoracle) for the data loading tests.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+def random_documents(rnd, num_docs, max_sents=12, max_words=8, max_oracles=5, vocab_size=50):
+    """Documents as {"filename", "doc", "title", "image", "doclen", "oracles"},
+    sentences are lists of word ids and oracles (sentids, reward) pairs.
+    Oracles may select sentences beyond the document length.
+    """
+    def sentences(count):
+        return [[rnd.randint(2, vocab_size) for _ in range(rnd.randint(1, max_words))] for _ in range(count)]
+
+    documents = []
+    for docidx in range(num_docs):
+        doclen = rnd.randint(1, max_sents)
+        oracles = []
+        for _ in range(rnd.randint(1, max_oracles)):
+            sentids = sorted(rnd.sample(range(doclen + 2), min(3, doclen)))
+            oracles.append((sentids, round(rnd.random(), 6)))
+        documents.append({"filename": "cnn-%06d"%docidx, "doc": sentences(doclen), "title": sentences(rnd.randint(1, 2)),
+                          "image": sentences(rnd.randint(1, 4)), "doclen": doclen, "oracles": oracles})
+    return documents
+
+def document_lines(document):
+    """section_lines and oracle_lines of a document, as parsed from the text files.
+    """
+    section_lines = dict((section, [" ".join(str(wordid) for wordid in sent) for sent in document[section]]) for section in ("doc", "title", "image"))
+    oracle_lines = [" ".join(str(sentid) for sentid in sentids) + "\t" + repr(reward) for sentids, reward in document["oracles"]]
+    return section_lines, oracle_lines
+
+def write_text_corpus(file_prefix, documents):
+    files = dict((ext, open(file_prefix+"."+ext, "w")) for ext in ("doc", "title", "image", "label.multipleoracle"))
+    for document in documents:
+        section_lines, oracle_lines = document_lines(document)
+        for section in ("doc", "title", "image"):
+            files[section].write("\n".join([document["filename"]] + section_lines[section]) + "\n\n")
+        files["label.multipleoracle"].write("\n".join([document["filename"], str(document["doclen"])] + oracle_lines) + "\n\n")
+    for fdata in files.values():
+        fdata.close()
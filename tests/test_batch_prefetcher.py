@@ -0,0 +1,154 @@
+"""
+BatchPrefetcher of data_utils: batches come in order, producers stay at most
+queue_size batches ahead, errors reach the consumer and threads are joined
+when the consumer stops early.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+try:
+    import tensorflow
+except ImportError:
+    tensorflow = None
+
+if tensorflow is not None:
+    import data_utils
+    from my_flags import FLAGS
+
+from tests import synthetic
+
+@unittest.skipIf(tensorflow is None, "data_utils needs tensorflow")
+class BatchPrefetcherTest(unittest.TestCase):
+    def test_order(self):
+        for num_threads in (0, 1, 4):
+            batches = list(data_utils.BatchPrefetcher(lambda idx: idx * idx, [(idx,) for idx in range(50)], num_threads=num_threads, queue_size=3))
+            self.assertEqual(batches, [idx * idx for idx in range(50)])
+
+    def test_look_ahead(self):
+        queue_size = 3
+        lock = threading.Lock()
+        consumed = [0]
+        look_ahead = []
+
+        def batch_fn(idx):
+            with lock:
+                look_ahead.append(idx - consumed[0])
+            time.sleep(0.001)
+            return idx
+
+        for batch in data_utils.BatchPrefetcher(batch_fn, [(idx,) for idx in range(40)], num_threads=4, queue_size=queue_size):
+            with lock:
+                consumed[0] += 1
+            time.sleep(0.005)
+        self.assertEqual(len(look_ahead), 40)
+        # The batch handed to the consumer frees its slot just before it is counted
+        self.assertLessEqual(max(look_ahead), queue_size)
+
+    def test_exception(self):
+        def batch_fn(idx):
+            if idx == 5:
+                raise RuntimeError("batch %d"%idx)
+            return idx
+
+        for num_threads in (0, 3):
+            batches = []
+            with self.assertRaises(RuntimeError):
+                for batch in data_utils.BatchPrefetcher(batch_fn, [(idx,) for idx in range(10)], num_threads=num_threads, queue_size=2):
+                    batches.append(batch)
+            self.assertEqual(batches, list(range(5)))
+
+    def test_batch_args_exception(self):
+        def batch_args():
+            for idx in range(3):
+                yield (idx,)
+            raise ValueError("shard")
+
+        batches = []
+        with self.assertRaises(ValueError):
+            for batch in data_utils.BatchPrefetcher(lambda idx: idx, batch_args(), num_threads=2, queue_size=2):
+                batches.append(batch)
+        self.assertEqual(batches, [0, 1, 2])
+
+    def test_no_threads(self):
+        calling_thread = threading.current_thread()
+        threads = []
+
+        def batch_fn(idx):
+            threads.append(threading.current_thread())
+            return idx
+
+        prefetcher = data_utils.BatchPrefetcher(batch_fn, [(idx,) for idx in range(5)], num_threads=0)
+        self.assertEqual(list(prefetcher), list(range(5)))
+        self.assertEqual(threads, [calling_thread] * 5)
+        self.assertEqual(prefetcher.wait_time, 0.0)
+
+    def test_early_break(self):
+        started = []
+        producers = set()
+
+        def batch_fn(idx):
+            started.append(idx)
+            producers.add(threading.current_thread())
+            time.sleep(0.01)
+            return idx
+
+        prefetcher = data_utils.BatchPrefetcher(batch_fn, [(idx,) for idx in range(100)], num_threads=3, queue_size=4)
+        for batch in prefetcher:
+            if batch == 2:
+                break
+        # Breaking out of the loop closes the generator, which stops and joins the producers
+        self.assertEqual(prefetcher._threads, [])
+        self.assertFalse([thread for thread in producers if thread.is_alive()])
+        num_started = len(started)
+        time.sleep(0.05)
+        self.assertEqual(len(started), num_started)
+        self.assertLess(num_started, 100)
+
+@unittest.skipIf(tensorflow is None, "data_utils needs tensorflow")
+class DataBatchJobsTest(unittest.TestCase):
+    """Prefetched batches of Data against build_batch on get_batch_jobs.
+    """
+    flag_values = {"data_mode": "cnn", "compiled_data_directory": "", "write_data_files": False, "num_parse_workers": 1,
+                   "max_doc_length": 6, "max_title_length": 1, "max_image_length": 2, "max_sent_length": 5, "num_sample_rollout": 3, "use_fp16": False}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        synthetic.write_text_corpus(self.directory+"/cnn.training", synthetic.random_documents(random.Random(0), 37))
+        self.saved_flags = dict((name, getattr(FLAGS, name)) for name in list(self.flag_values) + ["preprocessed_data_directory"])
+        for name, value in self.flag_values.items():
+            setattr(FLAGS, name, value)
+        FLAGS.preprocessed_data_directory = self.directory
+
+    def tearDown(self):
+        for name, value in self.saved_flags.items():
+            setattr(FLAGS, name, value)
+        shutil.rmtree(self.directory)
+
+    def test_order(self):
+        data = data_utils.Data(None, "training")
+        data.shuffle_fileindices()
+        batch_jobs = data.get_batch_jobs(4, include_last=True)
+        for num_threads in (0, 2):
+            batches = list(data_utils.BatchPrefetcher(data_utils.build_batch, batch_jobs, num_threads=num_threads, queue_size=2))
+            self.assertEqual(len(batches), len(batch_jobs))
+            for batch, (store, docindices) in zip(batches, batch_jobs):
+                expected = data_utils.build_batch(store, docindices)
+                # Everything but the randomly sampled oracle
+                for array, expected_array in zip(batch[:4], expected[:4]):
+                    np.testing.assert_array_equal(array, expected_array)
+            docnames = np.concatenate([batch[0] for batch in batches]).tolist()
+            self.assertEqual(docnames, [data.filenames[fileindex].encode() for fileindex in data.fileindices])
+
+if __name__ == "__main__":
+    unittest.main()
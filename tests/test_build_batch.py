@@ -0,0 +1,94 @@
+"""
+build_batch of data_utils against the list based get_batch it replaced (see
+tests/legacy_data_utils.py), on a small random corpus. Arrays must be
+identical, with the same dtypes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import tensorflow
+except ImportError:
+    tensorflow = None
+
+if tensorflow is not None:
+    import data_utils
+    from my_flags import FLAGS
+    from tests import legacy_data_utils
+
+from tests import synthetic
+
+class ListData:
+    """Lists of the baseline Data.populate_data.
+    """
+    def __init__(self, documents):
+        self.filenames = [document["filename"] for document in documents]
+        self.docs = [document["doc"][:FLAGS.max_doc_length] for document in documents]
+        self.titles = [document["title"][:FLAGS.max_title_length] for document in documents]
+        self.images = [document["image"][:FLAGS.max_image_length] for document in documents]
+        self.weights = [[1 for item in range(document["doclen"])][:FLAGS.max_doc_length] for document in documents]
+        self.labels = [[sentids for sentids, _ in document["oracles"][:FLAGS.num_sample_rollout]] for document in documents]
+        self.rewards = [[reward for _, reward in document["oracles"][:FLAGS.num_sample_rollout]] for document in documents]
+        self.fileindices = list(range(len(self.filenames)))
+
+@unittest.skipIf(tensorflow is None, "data_utils needs tensorflow")
+class BuildBatchTest(unittest.TestCase):
+    flag_values = {"data_mode": "cnn", "compiled_data_directory": "", "write_data_files": False, "num_parse_workers": 1,
+                   "max_doc_length": 6, "max_title_length": 1, "max_image_length": 2, "max_sent_length": 5, "num_sample_rollout": 3,
+                   "target_label_size": 2, "use_fp16": False}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # Documents, sentences and titles longer than the limits, fewer oracles than rollouts
+        self.documents = synthetic.random_documents(random.Random(0), 37)
+        synthetic.write_text_corpus(self.directory+"/cnn.training", self.documents)
+        self.saved_flags = dict((name, getattr(FLAGS, name)) for name in list(self.flag_values) + ["preprocessed_data_directory"])
+        for name, value in self.flag_values.items():
+            setattr(FLAGS, name, value)
+        FLAGS.preprocessed_data_directory = self.directory
+
+    def tearDown(self):
+        for name, value in self.saved_flags.items():
+            setattr(FLAGS, name, value)
+        shutil.rmtree(self.directory)
+
+    def assert_same_batches(self, batch_size):
+        data = data_utils.Data(None, "training")
+        list_data = ListData(self.documents)
+        sampled = set()
+        for seed in range(40):
+            random.Random(seed).shuffle(data.fileindices)
+            list_data.fileindices = data.fileindices
+            for startidx, endidx in data.get_batch_ranges(batch_size, include_last=True):
+                # Oracles build_batch is going to sample
+                np.random.seed(seed)
+                randidx_oracles = np.random.randint(0, FLAGS.num_sample_rollout, size=endidx-startidx).tolist()
+                np.random.seed(seed)
+                batch = data.get_batch(startidx, endidx)
+                expected = legacy_data_utils.get_batch(list_data, startidx, endidx, randidx_oracles)
+                self.assertEqual(len(batch), len(expected))
+                for array, expected_array in zip(batch, expected):
+                    self.assertEqual(array.dtype, expected_array.dtype)
+                    np.testing.assert_array_equal(array, expected_array)
+                sampled.update(zip(data.fileindices[startidx:endidx], randidx_oracles))
+        # Every rollout of every document, including the repeated best oracle
+        self.assertEqual(len(sampled), len(self.documents) * FLAGS.num_sample_rollout)
+
+    def test_build_batch(self):
+        self.assert_same_batches(4)
+
+    def test_build_batch_fp16(self):
+        FLAGS.use_fp16 = True
+        self.assert_same_batches(5)
+
+if __name__ == "__main__":
+    unittest.main()
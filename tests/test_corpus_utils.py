@@ -0,0 +1,76 @@
+"""
+Oracle table of corpus_utils: labels and weights unpacked from the bitsets
+of prepare_oracle_table/sample_oracles against the arrays of the original
+list based batches.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import unittest
+
+import numpy as np
+
+from corpus_utils import CorpusBuilder
+from tests import synthetic
+
+def build_store(documents):
+    builder = CorpusBuilder()
+    for document in documents:
+        section_lines, oracle_lines = synthetic.document_lines(document)
+        builder.add_document(document["filename"], section_lines, document["doclen"], oracle_lines)
+    return builder.build()
+
+def original_labels(document, rolloutidx, max_doc_length):
+    # Rollouts beyond the oracles of a document copy the best one
+    oracles = document["oracles"]
+    sentids, reward = oracles[rolloutidx] if rolloutidx < len(oracles) else oracles[0]
+    labels = [[1, 0] if (item in sentids) else [0, 1] for item in range(max_doc_length)]
+    return np.array(labels, dtype=np.float32), np.float32(reward)
+
+def original_weights(document, max_doc_length):
+    weights = [1 for item in range(document["doclen"])][:max_doc_length]
+    return np.array(weights + [0] * (max_doc_length - len(weights)), dtype=np.float32)
+
+class OracleTableTest(unittest.TestCase):
+    def setUp(self):
+        # Documents up to 20 sentences with 1 to 8 oracles
+        self.documents = synthetic.random_documents(random.Random(0), 60, max_sents=20, max_oracles=8)
+        self.store = build_store(self.documents)
+
+    def test_round_trip(self):
+        for num_rollouts, max_doc_length in ((5, 6), (3, 8), (10, 13)):
+            self.store.prepare_oracle_table(num_rollouts, max_doc_length, chunk_size=7)
+            docindices = np.arange(len(self.documents))
+            for rolloutidx in range(num_rollouts):
+                mask, rewards = self.store.sample_oracles(docindices, np.full(len(docindices), rolloutidx, dtype=np.int64), max_doc_length)
+                labels = np.stack([mask, ~mask], axis=-1).astype(np.float32)
+                for docindex, document in enumerate(self.documents):
+                    expected_labels, expected_reward = original_labels(document, rolloutidx, max_doc_length)
+                    np.testing.assert_array_equal(labels[docindex], expected_labels)
+                    self.assertEqual(rewards[docindex], expected_reward)
+
+            weights = self.store.weight_mask(docindices, max_doc_length).astype(np.float32)
+            for docindex, document in enumerate(self.documents):
+                np.testing.assert_array_equal(weights[docindex], original_weights(document, max_doc_length))
+
+        # The random inputs cover truncated documents and repeated best oracles
+        self.assertTrue(any(document["doclen"] > 13 for document in self.documents))
+        self.assertTrue(any(len(document["oracles"]) < 3 for document in self.documents))
+
+    def test_mixed_rollouts(self):
+        num_rollouts, max_doc_length = 4, 9
+        self.store.prepare_oracle_table(num_rollouts, max_doc_length)
+        rnd = np.random.RandomState(0)
+        docindices = rnd.randint(0, len(self.documents), size=100)
+        rolloutindices = rnd.randint(0, num_rollouts, size=100)
+        mask, rewards = self.store.sample_oracles(docindices, rolloutindices, max_doc_length)
+        for batch_idx, (docindex, rolloutidx) in enumerate(zip(docindices, rolloutindices)):
+            expected_labels, expected_reward = original_labels(self.documents[docindex], rolloutidx, max_doc_length)
+            np.testing.assert_array_equal(mask[batch_idx], expected_labels[:, 0].astype(bool))
+            self.assertEqual(rewards[batch_idx], expected_reward)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Binary cache of the pretrained word embeddings of data_utils.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import tensorflow
+except ImportError:
+    tensorflow = None
+
+if tensorflow is not None:
+    import data_utils
+    from my_flags import FLAGS
+
+@unittest.skipIf(tensorflow is None, "data_utils needs tensorflow")
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wordembed_filename = os.path.join(self.directory, "words.vec")
+        with open(self.wordembed_filename, "w") as fembedd:
+            fembedd.write("3 4\nw1 1 2 3 4 5\nw2 5 6 7 8 9\nw3 9 10 11 12 13\n")
+        self.saved_flags = dict((name, getattr(FLAGS, name)) for name in ("pretrained_wordembedding", "embedding_cache_directory", "wordembed_size",
+                                                                         "num_parse_workers", "train_dir", "use_fp16"))
+        FLAGS.pretrained_wordembedding = self.wordembed_filename
+        FLAGS.embedding_cache_directory = ""
+        FLAGS.wordembed_size = 4
+        FLAGS.num_parse_workers = 1
+        FLAGS.train_dir = self.directory
+        FLAGS.use_fp16 = False
+
+    def tearDown(self):
+        for name, value in self.saved_flags.items():
+            setattr(FLAGS, name, value)
+        shutil.rmtree(self.directory)
+
+    def assert_embeddings(self, vocab_dict, word_embedding_array):
+        self.assertEqual(vocab_dict, {"_PAD": 0, "_UNK": 1, "w1": 2, "w2": 3, "w3": 4})
+        np.testing.assert_array_equal(word_embedding_array, np.array([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12]], dtype=np.float32))
+
+    def test_cache(self):
+        self.assert_embeddings(*data_utils.DataProcessor().prepare_vocab_embeddingdict())
+        cache_prefix = data_utils.get_embedding_cache_prefix(self.wordembed_filename)
+        self.assertTrue(os.path.isfile(cache_prefix+".npy"))
+        self.assertTrue(os.path.isfile(cache_prefix+".vocab"))
+        self.assert_embeddings(*data_utils.DataProcessor().prepare_vocab_embeddingdict())
+
+    def test_unwritable_cache(self):
+        # Missing directory: the embeddings are still returned, no cache file is left behind
+        FLAGS.embedding_cache_directory = os.path.join(self.directory, "missing")
+        self.assert_embeddings(*data_utils.DataProcessor().prepare_vocab_embeddingdict())
+        self.assertFalse(os.path.exists(FLAGS.embedding_cache_directory))
+        self.assertEqual(sorted(os.listdir(self.directory)), ["vocab.txt", "words.vec"])
+
+if __name__ == "__main__":
+    unittest.main()
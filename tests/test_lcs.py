@@ -0,0 +1,54 @@
+"""
+Bit-parallel lcs_length against the dynamic programming table of the
+original reward code.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import unittest
+
+import rouge_utils
+from tests import legacy
+
+class LcsLengthTest(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(0)
+
+    def random_pair(self, max_length, alphabet):
+        a = [self.rnd.randrange(alphabet) for _ in range(self.rnd.randint(0, max_length))]
+        b = [self.rnd.randrange(alphabet) for _ in range(self.rnd.randint(0, max_length))]
+        return a, b
+
+    def assert_same_lcs(self, a, b):
+        expected = legacy._get_lcs(a, b)
+        self.assertEqual(rouge_utils.lcs_length(a, b), expected, msg="%r %r"%(a, b))
+        self.assertEqual(rouge_utils.lcs_length(a, b, rouge_utils.lcs_match_masks(b)), expected)
+        self.assertEqual(rouge_utils.lcs_length(b, a), expected)
+
+    def test_empty(self):
+        for a, b in [([], []), ([], [1, 2]), ([3], []), ([1], [2])]:
+            self.assert_same_lcs(a, b)
+
+    def test_small_alphabets(self):
+        for alphabet in (1, 2, 3, 4):
+            for _ in range(500):
+                self.assert_same_lcs(*self.random_pair(12, alphabet))
+
+    def test_word_ids(self):
+        # Sentences of word ids with 0 separators, as in the reward
+        for _ in range(300):
+            a, b = self.random_pair(60, 50)
+            self.assert_same_lcs(a + [0] + a[:5], b)
+
+    def test_long_sequences(self):
+        # Longer than a machine word, so that the carries cross word boundaries
+        for alphabet in (2, 20, 1000):
+            a = [self.rnd.randrange(alphabet) for _ in range(self.rnd.randint(300, 700))]
+            b = [self.rnd.randrange(alphabet) for _ in range(self.rnd.randint(300, 700))]
+            self.assert_same_lcs(a, b)
+
+if __name__ == "__main__":
+    unittest.main()
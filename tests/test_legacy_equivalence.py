@@ -0,0 +1,124 @@
+"""
+Scores of rouge_utils against the implementations they replaced (see
+tests/legacy.py and tests/legacy_rouge.py), on randomized inputs. Scores
+must be identical, not only close.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import random
+import unittest
+
+import rouge_utils
+from tests import legacy
+from tests import legacy_rouge
+
+class OracleRougeTest(unittest.TestCase):
+    """rouge.py of the oracle estimator.
+    """
+    def setUp(self):
+        self.rnd = random.Random(0)
+        self.words = ["w%d"%wordidx for wordidx in range(20)]
+
+    def random_line(self, max_length):
+        # Lines as read by the estimator, sometimes with their newline
+        line = " ".join(self.rnd.choice(self.words) for _ in range(self.rnd.randint(1, max_length)))
+        return line + "\n" if self.rnd.random() < 0.5 else line
+
+    def random_lines(self, max_count, max_length):
+        return [self.random_line(max_length) for _ in range(self.rnd.randint(1, max_count))]
+
+    def cal_rouge(self, sentindices, sentdata, golddata):
+        # Oracle score of the baseline estimator
+        summary = [sentdata[sentidx] for sentidx in sorted(sentindices)]
+        return (legacy_rouge.rouge_n(summary, golddata, 1)["f"] + legacy_rouge.rouge_n(summary, golddata, 2)["f"] +
+                legacy_rouge.rouge_l_summary_level(summary, golddata)["f"])/3.0
+
+    def test_rouge_n(self):
+        for _ in range(500):
+            evaluated, reference = self.random_lines(5, 12), self.random_lines(4, 10)
+            for n in (1, 2, 3, 4):
+                self.assertEqual(rouge_utils.oracle_rouge_n(evaluated, reference, n), legacy_rouge.rouge_n(evaluated, reference, n))
+
+    def test_rouge_l_summary_level(self):
+        for _ in range(500):
+            evaluated, reference = self.random_lines(5, 12), self.random_lines(4, 10)
+            self.assertEqual(rouge_utils.oracle_rouge_l_summary_level(evaluated, reference), legacy_rouge.rouge_l_summary_level(evaluated, reference))
+
+    def test_empty_collections(self):
+        for function in (rouge_utils.oracle_rouge_n, rouge_utils.oracle_rouge_l_summary_level):
+            self.assertRaises(ValueError, function, [], ["w1"])
+            self.assertRaises(ValueError, function, ["w1"], [])
+
+    def test_oracle_scorer(self):
+        for _ in range(20):
+            sentdata, golddata = self.random_lines(10, 15), self.random_lines(4, 10)
+            scorer = rouge_utils.OracleScorer(sentdata, golddata)
+            sentindices = range(len(sentdata))
+            sizes = range(1, 5)
+            expected = [(self.cal_rouge(combination, sentdata, golddata), list(combination))
+                        for size in sizes for combination in itertools.combinations(sentindices, size)]
+            for score, combination in expected:
+                self.assertEqual(scorer.score(combination), score)
+            self.assertEqual(scorer.score_combinations(sentindices, sizes), expected)
+            expected.sort(reverse=True)
+            for top_n in (1, 5, 20):
+                self.assertEqual(scorer.top_combinations(sentindices, sizes, top_n), expected[:top_n])
+
+    def test_no_sizes(self):
+        scorer = rouge_utils.OracleScorer(["w1 w2", "w2 w3"], ["w1 w2 w3"])
+        self.assertEqual(scorer.score_combinations([0, 1], range(2, 2)), [])
+        self.assertEqual(scorer.top_combinations([0, 1], range(2, 2), 5), [])
+
+class RewardTest(unittest.TestCase):
+    """Training reward of reward_utils.
+    """
+    def setUp(self):
+        self.rnd = random.Random(0)
+
+    def test_reward_scorer(self):
+        for _ in range(50):
+            # Padded document rows and highlights of word ids from a small vocabulary
+            document = []
+            for _ in range(12):
+                length = self.rnd.randint(0, 14)
+                document.append([self.rnd.randint(1, 12) for _ in range(length)] + [0]*(15-length))
+            highlights = [[self.rnd.randint(1, 12) for _ in range(self.rnd.randint(1, 8))] for _ in range(self.rnd.randint(1, 4))]
+            scorer = rouge_utils.RewardScorer(document, highlights)
+            for _ in range(30):
+                # Rollouts list their sentences in any order
+                sentindices = self.rnd.sample(range(12), self.rnd.randint(1, 5))
+                final_labels_str = "-".join(str(sentidx) for sentidx in sentindices)
+                self.assertEqual(scorer.score(sentindices), legacy._rouge_wrapper_traindata_nopyrouge("doc", final_labels_str, document, highlights))
+
+class SummaryScoresTest(unittest.TestCase):
+    """ROUGE-1.5.5 scores of single summaries.
+    """
+    def setUp(self):
+        self.rnd = random.Random(0)
+        self.words = ["w%d"%wordidx for wordidx in range(20)]
+
+    def random_sentence(self, max_length):
+        return [self.rnd.choice(self.words) for _ in range(self.rnd.randint(0, max_length))]
+
+    def test_summary_scores(self):
+        for _ in range(50):
+            doc_sents = [self.random_sentence(20) for _ in range(12)]
+            gold = [self.random_sentence(12) for _ in range(self.rnd.randint(1, 4))]
+            candidates = [[doc_sents[sentidx] for sentidx in sorted(self.rnd.sample(range(12), self.rnd.randint(0, 4)))] for _ in range(20)]
+            batch_scores = rouge_utils.rouge_batch(candidates, gold)
+
+            vocab = {}
+            word_ids = lambda sent: [vocab.setdefault(word, len(vocab)+1) for word in sent]
+            id_scores = rouge_utils.rouge_batch([[word_ids(sent) for sent in candidate] for candidate in candidates], [word_ids(sent) for sent in gold])
+            for candidate, scores, ids_row in zip(candidates, batch_scores, id_scores):
+                expected = legacy.summary_scores(candidate, gold)
+                self.assertEqual(rouge_utils.summary_scores(candidate, gold), expected)
+                self.assertEqual(scores.tolist(), [expected[metric] for metric in rouge_utils.ROUGE_METRICS])
+                self.assertEqual(ids_row.tolist(), scores.tolist())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Resumable output of scripts/oracle-estimator/estimate_multiple_oracles.py
+(journal and consolidated shard files) and the shard merge of
+scripts/trivago-utils/combine_multi_oracle_files.py.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+ESTIMATOR = os.path.join(SCRIPTS_DIR, "oracle-estimator", "estimate_multiple_oracles.py")
+
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "oracle-estimator"))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "trivago-utils"))
+import estimate_multiple_oracles
+import combine_multi_oracle_files
+
+def write_data_dir(data_dir, num_docs, rnd):
+    """article/ and abstracts/ of num_docs random documents, every fourth one
+    missing, and the title file of combine_multi_oracle_files.py.
+    """
+    words = ["w%d"%wordidx for wordidx in range(40)] + ["the", "a", "of"] * 4
+    line = lambda length: " ".join(rnd.choice(words) for _ in range(length))
+    os.makedirs(os.path.join(data_dir, "article"))
+    os.makedirs(os.path.join(data_dir, "abstracts"))
+    with open(os.path.join(data_dir, "titles.txt"), "w") as ftitle:
+        for docidx in range(num_docs):
+            ftitle.write("usp-hotel-%d\n"%docidx)
+            if docidx % 4 == 3:
+                continue
+            with open(os.path.join(data_dir, "article", "%d-0-src-train-txt.article"%docidx), "w") as farticle:
+                farticle.write("\n".join(line(rnd.randint(3, 15)) for _ in range(rnd.randint(1, 12))) + "\n")
+            with open(os.path.join(data_dir, "abstracts", "%d-0-tgt-train-txt.abstracts"%docidx), "w") as fabstract:
+                fabstract.write("\n".join(line(rnd.randint(4, 10)) for _ in range(rnd.randint(1, 3))) + "\n")
+
+def run_estimator(data_dir, *options):
+    """Runs the estimator, returns (documents to estimate, documents completed before).
+    """
+    output = subprocess.check_output([sys.executable, ESTIMATOR, "1", data_dir, "--sent_limit", "3", "--pool_size", "5"] + list(options))
+    counts = re.search(r"(\d+) documents to estimate, (\d+) completed before", output.decode("utf-8"))
+    return int(counts.group(1)), int(counts.group(2))
+
+def read_bytes(filename):
+    with open(filename, "rb") as fdata:
+        return fdata.read()
+
+def write_bytes(filename, data):
+    with open(filename, "wb") as fdata:
+        fdata.write(data)
+
+class ReadOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_journal(self):
+        outputfname = os.path.join(self.directory, "shard-0-of-2.journal")
+        otherfname = os.path.join(self.directory, "shard-1-of-2.journal")
+        write_bytes(outputfname, b"doc1\ndoc2\ndo")
+        write_bytes(otherfname, b"doc3\ndoc")
+        write_bytes(os.path.join(self.directory, "doc9.moracle"), b"1 2\t0.5\n")
+        self.assertEqual(estimate_multiple_oracles.read_journal(self.directory, outputfname), set(["doc1", "doc2", "doc3"]))
+        # Only the journal of this run is cut
+        self.assertEqual(read_bytes(outputfname), b"doc1\ndoc2\n")
+        self.assertEqual(read_bytes(otherfname), b"doc3\ndoc")
+
+    def test_read_consolidated(self):
+        outputfname = os.path.join(self.directory, "shard-0-of-2.label.multipleoracle")
+        otherfname = os.path.join(self.directory, "shard-1-of-2.label.multipleoracle")
+        complete = b"doc1\n2\n0 1\t0.5\n\ndoc2\n1\n0 2\t0.25\n1 2\t0.125\n\n"
+        write_bytes(outputfname, complete + b"doc4\n3\n0 1\t0.")
+        write_bytes(otherfname, b"doc3\n1\n0 1\t0.5\n\ndoc5\n1\n")
+        self.assertEqual(estimate_multiple_oracles.read_consolidated(self.directory, outputfname), set(["doc1", "doc2", "doc3"]))
+        self.assertEqual(read_bytes(outputfname), complete)
+        self.assertEqual(read_bytes(otherfname), b"doc3\n1\n0 1\t0.5\n\ndoc5\n1\n")
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.directory, "data")
+        write_data_dir(self.data_dir, 12, random.Random(0))
+        self.oracle_dir = os.path.join(self.data_dir, "article-oracles")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_journal(self):
+        self.assertEqual(run_estimator(self.data_dir), (9, 0))
+        journalfname = os.path.join(self.oracle_dir, "shard-0-of-1.journal")
+        journal = read_bytes(journalfname)
+        lines = journal.splitlines(True)
+        self.assertEqual(len(lines), 9)
+
+        # Crash while writing the last line
+        write_bytes(journalfname, b"".join(lines[:-1]) + lines[-1][:3])
+        self.assertEqual(run_estimator(self.data_dir), (1, 8))
+        self.assertEqual(read_bytes(journalfname), journal)
+        self.assertEqual(run_estimator(self.data_dir), (0, 9))
+
+    def test_consolidated(self):
+        self.assertEqual(run_estimator(self.data_dir, "--consolidated"), (9, 0))
+        shardfname = os.path.join(self.oracle_dir, "shard-0-of-1.label.multipleoracle")
+        shard = read_bytes(shardfname)
+        blocks = shard.split(b"\n\n")[:-1]
+        self.assertEqual(len(blocks), 9)
+
+        # Crash in the middle of the last block
+        write_bytes(shardfname, b"".join(block + b"\n\n" for block in blocks[:-1]) + blocks[-1][:len(blocks[-1]) // 2])
+        self.assertEqual(run_estimator(self.data_dir, "--consolidated"), (1, 8))
+        self.assertEqual(read_bytes(shardfname), shard)
+        self.assertEqual(os.listdir(self.oracle_dir), ["shard-0-of-1.label.multipleoracle"])
+
+class CombineShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_process_shards(self):
+        combined = []
+        for data_name in ("files", "shards"):
+            data_dir = os.path.join(self.directory, data_name)
+            write_data_dir(data_dir, 20, random.Random(0))
+            oracle_dir = os.path.join(data_dir, "article-oracles")
+            title_list = combine_multi_oracle_files.process_title_file(os.path.join(data_dir, "titles.txt"))
+            if data_name == "files":
+                run_estimator(data_dir)
+                combine_multi_oracle_files.process_directory(oracle_dir + "/", "15", "train", title_list)
+            else:
+                for shard in range(2):
+                    run_estimator(data_dir, "--consolidated", "--num_shards", "2", "--shard", str(shard))
+                self.assertEqual(sorted(name for name in os.listdir(oracle_dir) if name.startswith("shard-")),
+                                 ["shard-0-of-2.label.multipleoracle", "shard-1-of-2.label.multipleoracle"])
+                combine_multi_oracle_files.process_shards(oracle_dir, "15", "train", title_list)
+            combined.append(read_bytes(os.path.join(oracle_dir, "usp.train.label.multipleoracle")))
+        self.assertEqual(combined[0], combined[1])
+        # Documents up to max_count, blank blocks for the missing ones
+        self.assertEqual(combined[0].count(b"usp-hotel-"), 12)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Reward_Cache of reward_utils: import of the old json dictionary, eviction
+of the in-memory entries and reads back from the sqlite store.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import tensorflow
+except ImportError:
+    tensorflow = None
+
+if tensorflow is not None:
+    import reward_utils
+
+@unittest.skipIf(tensorflow is None, "reward_utils needs tensorflow")
+class RewardCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "reward-cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_rouge_dict(self):
+        json_filename = os.path.join(self.directory, "rouge-dict.json")
+        with open(json_filename, "w") as data_file:
+            json.dump({"doc1": {"1-3": 0.25, "2": 0.5}, "doc2": {"1-2-70": 0.75}}, data_file)
+        cache = reward_utils.Reward_Cache(self.filename, 10, import_filename=json_filename)
+        cache.open()
+        # 1-based sentence indices become bits of the mask
+        self.assertEqual(cache.get("doc1", 0b101), 0.25)
+        self.assertEqual(cache.get("doc1", 0b10), 0.5)
+        self.assertEqual(cache.get("doc2", 0b11 | 1 << 69), 0.75)
+        self.assertIsNone(cache.get("doc1", 0b1))
+        self.assertIsNone(cache.get("doc3", 0b1))
+        cache.close()
+
+        # Imported once, when the store is created
+        os.remove(json_filename)
+        cache = reward_utils.Reward_Cache(self.filename, 10, import_filename=json_filename)
+        cache.open()
+        self.assertEqual(cache.get("doc2", 0b11 | 1 << 69), 0.75)
+        self.assertEqual(cache.disk_hits, 1)
+        cache.close()
+
+    def test_eviction(self):
+        cache = reward_utils.Reward_Cache(self.filename, 3)
+        cache.open()
+        for mask in range(1, 5):
+            cache.put("doc", mask, mask / 10.0)
+        self.assertEqual(list(cache.entries), [(0, 2), (0, 3), (0, 4)])
+
+        # A memory hit makes the entry the most recently used one
+        self.assertEqual(cache.get("doc", 2), 0.2)
+        cache.put("doc", 5, 0.5)
+        self.assertEqual(list(cache.entries), [(0, 4), (0, 2), (0, 5)])
+        self.assertEqual(cache.hits, 1)
+        cache.close()
+
+    def test_disk_hit_after_eviction(self):
+        cache = reward_utils.Reward_Cache(self.filename, 2)
+        cache.open()
+        for mask in range(1, 5):
+            cache.put("doc", mask, mask / 10.0)
+        cache.flush()
+        self.assertNotIn((0, 1), cache.entries)
+        self.assertEqual(cache.get("doc", 1), 0.1)
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, 1, 0))
+        # Read back into memory
+        self.assertIn((0, 1), cache.entries)
+        self.assertEqual(len(cache.entries), 2)
+        self.assertEqual(cache.get("doc", 1), 0.1)
+        self.assertEqual(cache.hits, 1)
+        cache.close()
+
+    def test_flush_size(self):
+        flush_size = reward_utils.REWARD_CACHE_FLUSH_SIZE
+        reward_utils.REWARD_CACHE_FLUSH_SIZE = 3
+        try:
+            cache = reward_utils.Reward_Cache(self.filename, 10)
+            cache.open()
+            for mask in range(1, 5):
+                cache.put("doc", mask, mask / 10.0)
+            self.assertEqual(len(cache.pending_rewards), 1)
+            self.assertEqual(cache.pending_docs, [])
+            self.assertEqual(cache.connection.execute("SELECT COUNT(*) FROM rewards").fetchone()[0], 3)
+            cache.close()
+        finally:
+            reward_utils.REWARD_CACHE_FLUSH_SIZE = flush_size
+
+if __name__ == "__main__":
+    unittest.main()
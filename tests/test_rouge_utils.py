@@ -0,0 +1,87 @@
+"""
+rouge_utils against the output of the ROUGE-1.5.5 Perl script, run in the
+fixture directory with the options this project uses:
+
+    ROUGE-1.5.5.pl -e <data> -a -c 95 -d -m -n 4 -w 1.2 -z SPL rouge.cfg > ROUGE-1.5.5.out
+
+rouge.cfg lists the documents in the order of document_scores, so that the
+evaluation ids (and hence the bootstrap resamples) are the same.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import unittest
+from contextlib import closing
+from multiprocessing import Pool
+
+import rouge_utils
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "rouge")
+
+_AVERAGE_LINE = re.compile(r"^X ROUGE-([0-9L]) Average_([RPF]): ([0-9.]+) \(95%-conf\.int\. ([0-9.]+) - ([0-9.]+)\)$")
+_EVAL_LINE = re.compile(r"^X ROUGE-([0-9L]) Eval ([0-9]+)\.X R:([0-9.]+) P:([0-9.]+) F:([0-9.]+)$")
+_MEASURES = {"R": "recall", "P": "precision", "F": "f_score"}
+
+def read_perl_output(filename):
+    """Averages keyed like average_with_intervals and per-document scores
+    keyed by evaluation id, from the output of ROUGE-1.5.5.pl -d.
+    """
+    averages, evals = {}, {}
+    with open(filename) as output_file:
+        for line in output_file:
+            line = line.strip()
+            match = _AVERAGE_LINE.match(line)
+            if match:
+                order, measure, average, low, high = match.groups()
+                metric = "rouge_%s_%s"%(order.lower(), _MEASURES[measure])
+                averages[metric] = float(average)
+                averages[metric+"_cb"] = float(low)
+                averages[metric+"_ce"] = float(high)
+            match = _EVAL_LINE.match(line)
+            if match:
+                order, evalid = match.group(1).lower(), int(match.group(2))
+                for measure, value in zip(("recall", "precision", "f_score"), match.groups()[2:]):
+                    evals.setdefault(evalid, {})["rouge_%s_%s"%(order, measure)] = float(value)
+    return averages, evals
+
+class RougeDirectoriesTest(unittest.TestCase):
+    def setUp(self):
+        self.system_dir = os.path.join(FIXTURE_DIR, "system")
+        self.gold_dir = os.path.join(FIXTURE_DIR, "gold")
+        self.averages, self.evals = read_perl_output(os.path.join(FIXTURE_DIR, "ROUGE-1.5.5.out"))
+
+    def test_document_scores(self):
+        docids, scores = rouge_utils.document_scores(self.system_dir, self.gold_dir)
+        self.assertEqual(len(docids), len(self.evals))
+        for docindex, docid in enumerate(docids):
+            for metricidx, metric in enumerate(rouge_utils.ROUGE_METRICS):
+                self.assertAlmostEqual(scores[docindex, metricidx], self.evals[docindex+1][metric], delta=5e-6, msg="%s %s"%(docid, metric))
+
+    def test_rouge_directories(self):
+        output_dict = rouge_utils.rouge_directories(self.system_dir, self.gold_dir)
+        self.assertEqual(sorted(output_dict), sorted(self.averages))
+        for metric in self.averages:
+            self.assertAlmostEqual(output_dict[metric], self.averages[metric], delta=5e-6, msg=metric)
+
+    def test_rouge_directories_workers(self):
+        self.assertEqual(rouge_utils.rouge_directories(self.system_dir, self.gold_dir, num_workers=3),
+                         rouge_utils.rouge_directories(self.system_dir, self.gold_dir))
+
+    def test_rouge_directories_pool(self):
+        with closing(Pool(2)) as pool:
+            self.assertEqual(rouge_utils.rouge_directories(self.system_dir, self.gold_dir, num_workers=2, pool=pool),
+                             rouge_utils.rouge_directories(self.system_dir, self.gold_dir))
+
+    def test_rouge_directories_empty(self):
+        self.assertEqual(rouge_utils.rouge_directories(os.path.join(FIXTURE_DIR, "gold"), self.gold_dir), {})
+
+    def test_tokenize(self):
+        # hyphens split words and are dropped, WordNet exceptions come before Porter stemming
+        self.assertEqual(rouge_utils.tokenize("Covid-19 mice were found -- U.S. $5"), ["covid", "19", "mouse", "be", "find", "u", "s", "5"])
+
+if __name__ == "__main__":
+    unittest.main()